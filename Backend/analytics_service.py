@@ -0,0 +1,356 @@
+"""
+基金组合分析服务
+对比/自选中的多只基金：日收益率相关性矩阵 + 层次聚类排序，用于查看分散程度
+
+- 各基金的日收益率（相对自身上一个净值点）对齐到共同交易日历（trading_calendar，所有基金日期的并集），
+  缺失为 NaN，相关系数按两两共同有数据的交易日计算（pairwise complete）
+- 相关系数矩阵用 4 次矩阵乘法一次性求出，不逐对循环
+- 聚类为平均连接（UPGMA），距离 d = sqrt((1 - ρ) / 2)，返回叶子顺序，
+  按该顺序排列矩阵后相关性高的基金相邻
+- 结果按 (基金代码集合, 各基金数据版本, 参数) 缓存
+
+SimilarityIndex: 全市场相似基金索引（"走势像这只的基金"）
+- 预先把每只基金近一年的日收益率标准化为单位向量（z-score / √有效天数，缺失日为 0），
+  两只基金都无缺失时向量内积即为相关系数，共同交易日少时内积向 0 收缩
+- 查询时按块做矩阵-向量乘法，argpartition 取前 k 个
+- 每次批量更新完成后整体重建，重建期间旧索引继续提供查询
+"""
+import math
+import threading
+import warnings
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from response_cache import CachedResponse
+from risk_engine import prepare_series
+from trading_calendar import TradingCalendar
+
+# 默认回看天数（自然日）
+DEFAULT_LOOKBACK_DAYS = 365
+# 两只基金共同交易日少于该值时相关系数为 None
+MIN_OVERLAP_DAYS = 60
+# 单次请求最多支持的基金数
+MAX_CORRELATION_FUNDS = 200
+
+
+def _return_matrix(trends: Dict[str, list], days: int,
+                   calendar: Optional[TradingCalendar] = None) -> Tuple[List[str], TradingCalendar, np.ndarray]:
+    """
+    构建 基金×交易日 的日收益率矩阵，回看窗口以所有基金中最新的净值日期为终点
+    calendar: 指定交易日历时对齐到该日历（日历外的日期丢弃），否则使用所有基金日期的并集
+    返回 (有数据的基金代码, 交易日历, 收益率矩阵)，没有足够数据的基金不在结果中
+    """
+    prepared_series = {code: prepare_series(trend) for code, trend in trends.items()}
+    return _prepared_return_matrix({code: p for code, p in prepared_series.items() if p is not None},
+                                   days, calendar)
+
+
+def trim_series(series: Tuple[np.ndarray, np.ndarray], days: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把 prepare_series 的结果截取到该基金最近 days 天（多保留一个点用于计算第一个收益率），并复制出独立数组
+    所有基金中最新的日期不早于该基金的最新日期，截取后 _prepared_return_matrix 的结果不变
+    """
+    dates, values = series
+    start = max(0, int(np.searchsorted(dates, dates[-1] - days)) - 1)
+    return dates[start:].copy(), values[start:].copy()
+
+
+def _prepared_return_matrix(prepared_series: Dict[str, Tuple[np.ndarray, np.ndarray]], days: int,
+                            calendar: Optional[TradingCalendar] = None) -> Tuple[List[str], TradingCalendar, np.ndarray]:
+    """_return_matrix 的后半部分，输入为已经 prepare_series 的 {基金代码: (日序号, 净值)}"""
+    if not prepared_series:
+        return [], TradingCalendar.union([]), np.empty((0, 0))
+    latest = calendar.ordinals[-1] if calendar is not None and len(calendar) else \
+        max(dates[-1] for dates, _ in prepared_series.values())
+    cutoff = int(latest) - days
+
+    codes, series = [], []
+    for code, (dates, values) in prepared_series.items():
+        prev = values[:-1]
+        mask = (prev != 0) & (dates[1:] >= cutoff)
+        if not mask.any():
+            continue
+        codes.append(code)
+        series.append((dates[1:][mask], values[1:][mask] / prev[mask] - 1))
+
+    if not codes:
+        return [], TradingCalendar.union([]), np.empty((0, 0))
+
+    if calendar is None:
+        calendar = TradingCalendar.union([dates for dates, _ in series])
+    return codes, calendar, calendar.align(series)
+
+
+def pairwise_correlation(matrix: np.ndarray, min_overlap: int = MIN_OVERLAP_DAYS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按两两共同有数据的列计算相关系数（NaN 表示缺失）
+    返回 (相关系数矩阵, 共同交易日数矩阵)，共同交易日不足或方差为 0 时为 NaN
+    """
+    valid = ~np.isnan(matrix)
+    x = np.where(valid, matrix, 0.0)
+    m = valid.astype(np.float64)
+
+    overlap = m @ m.T                   # 共同交易日数
+    sum_x = x @ m.T                     # [i, j] = i 在共同交易日上的收益率之和
+    sum_xx = (x * x) @ m.T              # [i, j] = i 在共同交易日上的收益率平方和
+    sum_xy = x @ x.T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_i = sum_x / overlap
+        mean_j = mean_i.T
+        cov = sum_xy / overlap - mean_i * mean_j
+        var_i = sum_xx / overlap - mean_i ** 2
+        var_j = var_i.T
+        corr = cov / np.sqrt(var_i * var_j)
+
+    corr[(overlap < min_overlap) | ~np.isfinite(corr)] = np.nan
+    np.clip(corr, -1.0, 1.0, out=corr)
+    np.fill_diagonal(corr, 1.0)
+    return corr, overlap.astype(np.int64)
+
+
+def average_linkage(distance: np.ndarray) -> Tuple[List[int], List[list]]:
+    """
+    平均连接层次聚类
+    返回 (叶子顺序, 合并记录)；合并记录格式与 scipy linkage 一致: [簇a, 簇b, 距离, 样本数]，
+    新簇编号从 n 开始递增
+    """
+    n = len(distance)
+    if n == 0:
+        return [], []
+    d = distance.astype(np.float64).copy()
+    np.fill_diagonal(d, np.inf)
+    sizes = np.ones(n)
+    cluster_ids = list(range(n))
+    members = [[i] for i in range(n)]
+    merges = []
+
+    for next_id in range(n, 2 * n - 1):
+        i, j = divmod(int(np.argmin(d)), n)
+        if i > j:
+            i, j = j, i
+        merges.append([cluster_ids[i], cluster_ids[j], round(float(d[i, j]), 6), int(sizes[i] + sizes[j])])
+
+        # Lance-Williams 更新：新簇到其他簇的距离为两簇距离按样本数加权平均
+        row = (sizes[i] * d[i] + sizes[j] * d[j]) / (sizes[i] + sizes[j])
+        d[i, :] = row
+        d[:, i] = row
+        d[i, i] = np.inf
+        d[j, :] = np.inf
+        d[:, j] = np.inf
+
+        sizes[i] += sizes[j]
+        members[i] = members[i] + members[j]
+        members[j] = []
+        cluster_ids[i] = next_id
+
+    # 较小的下标总是保留为合并后的簇，最终根簇位于第 0 个位置
+    return members[0], merges
+
+
+def _round_matrix(matrix: np.ndarray, digits: int = 4) -> List[List[Optional[float]]]:
+    rounded = np.round(matrix, digits)
+    return [[None if math.isnan(v) else v for v in row] for row in rounded.tolist()]
+
+
+def calculate_correlation(trends: Dict[str, list], days: int = DEFAULT_LOOKBACK_DAYS,
+                          min_overlap: int = MIN_OVERLAP_DAYS) -> dict:
+    """
+    计算多只基金的日收益率相关性矩阵与聚类顺序
+    trends: {基金代码: 净值走势列表}
+    days: 回看天数（自然日，以最新净值日期为终点）
+    返回 codes / matrix / overlap / order / linkage 等字段，数据不足的基金列在 missing 中
+    """
+    codes, calendar, returns = _return_matrix(trends, days)
+
+    corr, overlap = pairwise_correlation(returns, min_overlap) if codes else (np.empty((0, 0)), np.empty((0, 0)))
+    # 相关系数未知的基金对视为不相关
+    distance = np.sqrt((1 - np.nan_to_num(corr, nan=0.0)) / 2)
+    order, merges = average_linkage(distance)
+
+    off_diagonal = corr[~np.eye(len(codes), dtype=bool)] if len(codes) > 1 else np.empty(0)
+    off_diagonal = off_diagonal[~np.isnan(off_diagonal)]
+    found = set(codes)
+
+    return {
+        'codes': codes,
+        'matrix': _round_matrix(corr),
+        'overlap': overlap.tolist(),
+        'order': [codes[i] for i in order],
+        'linkage': merges,
+        'average_correlation': round(float(off_diagonal.mean()), 4) if len(off_diagonal) else None,
+        'missing': [code for code in trends if code not in found],
+        'start_date': calendar.first_date,
+        'end_date': calendar.last_date,
+        'days': days,
+        'min_overlap': min_overlap,
+    }
+
+
+# ==================== 相似基金索引 ====================
+
+# 相似度计算使用的回看天数（自然日）
+SIMILARITY_LOOKBACK_DAYS = 365
+# 有效日收益率少于该数量的基金不进入索引
+SIMILARITY_MIN_RETURNS = 120
+# 分块矩阵-向量乘法的行数
+SIMILARITY_BLOCK_ROWS = 4096
+
+
+def normalize_return_vectors(matrix: np.ndarray, min_returns: int = SIMILARITY_MIN_RETURNS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    日收益率矩阵（缺失为 NaN）逐行标准化为单位向量
+    返回 (保留的行掩码, float32 向量矩阵)；有效点不足或波动为 0 的行不保留
+    """
+    valid = ~np.isnan(matrix)
+    counts = valid.sum(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(matrix, axis=1, keepdims=True)
+        std = np.nanstd(matrix, axis=1, keepdims=True)
+    keep = (counts >= min_returns) & (std[:, 0] > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vectors = np.where(valid, (matrix - mean) / std, 0.0) / np.sqrt(np.maximum(counts, 1))[:, None]
+    return keep, vectors[keep].astype(np.float32)
+
+
+class SimilarityIndex:
+    """全市场日收益率向量索引，线程安全（重建时整体替换，查询不加锁）"""
+
+    def __init__(self, lookback_days: int = SIMILARITY_LOOKBACK_DAYS, min_returns: int = SIMILARITY_MIN_RETURNS,
+                 block_rows: int = SIMILARITY_BLOCK_ROWS):
+        self.lookback_days = lookback_days
+        self.min_returns = min_returns
+        self.block_rows = block_rows
+        # (基金代码列表, 代码→行号, 向量矩阵, 交易日历, 构建时间)
+        self._data = ([], {}, np.empty((0, 0), dtype=np.float32), TradingCalendar.union([]), None)
+        self._build_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self._data[0])
+
+    @property
+    def built_time(self) -> Optional[datetime]:
+        return self._data[4]
+
+    @property
+    def calendar(self) -> TradingCalendar:
+        return self._data[3]
+
+    def build(self, trends: Dict[str, list]) -> int:
+        """由 {基金代码: 净值走势} 构建索引，返回入索引的基金数"""
+        return self.build_from_items(trends.items())
+
+    def build_from_items(self, items: Iterable[Tuple[str, list]]) -> int:
+        """
+        由逐个产生的 (基金代码, 净值走势) 构建索引，返回入索引的基金数
+        每只基金读入后立即转换为数组并截取到回看窗口，完整走势不会同时驻留内存
+        """
+        with self._build_lock:
+            prepared_series = {}
+            for code, trend in items:
+                series = prepare_series(trend)
+                if series is not None:
+                    prepared_series[code] = trim_series(series, self.lookback_days)
+            codes, calendar, matrix = _prepared_return_matrix(prepared_series, self.lookback_days)
+            del prepared_series
+            if codes:
+                keep, vectors = normalize_return_vectors(matrix, self.min_returns)
+                codes = [code for code, kept in zip(codes, keep) if kept]
+            else:
+                vectors = np.empty((0, 0), dtype=np.float32)
+            self._data = (codes, {code: i for i, code in enumerate(codes)}, vectors, calendar, datetime.now())
+            return len(codes)
+
+    def vector_for(self, net_worth_trend: list) -> Optional[np.ndarray]:
+        """把不在索引中的基金走势按索引的交易日历转换为查询向量"""
+        calendar = self.calendar
+        if not len(calendar):
+            return None
+        codes, _, matrix = _return_matrix({'query': net_worth_trend}, self.lookback_days, calendar)
+        if not codes:
+            return None
+        keep, vectors = normalize_return_vectors(matrix, self.min_returns)
+        return vectors[0] if keep[0] else None
+
+    def query(self, fund_code: str, k: int = 20, vector: Optional[np.ndarray] = None,
+              exclude: Iterable[str] = ()) -> Optional[List[Tuple[str, float]]]:
+        """
+        查询与基金最相似的 k 只基金，返回 [(基金代码, 相似度)]，按相似度降序
+        基金不在索引中且未提供 vector 时返回 None
+        """
+        codes, positions, vectors, _, _ = self._data
+        if vector is None:
+            row = positions.get(fund_code)
+            if row is None:
+                return None
+            vector = vectors[row]
+        if not codes:
+            return []
+
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.block_rows):
+            block = vectors[start:start + self.block_rows]
+            np.dot(block, vector, out=scores[start:start + len(block)])
+        for code in [fund_code, *exclude]:
+            if code in positions:
+                scores[positions[code]] = -np.inf
+
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(codes[i], round(float(scores[i]), 4)) for i in top]
+
+
+# 单例模式
+_similarity_index = None
+
+def get_similarity_index() -> SimilarityIndex:
+    """获取相似基金索引单例"""
+    global _similarity_index
+    if _similarity_index is None:
+        _similarity_index = SimilarityIndex()
+    return _similarity_index
+
+
+class CorrelationCache:
+    """
+    相关性响应缓存（LRU，存储预编码的响应）
+    键由调用方根据基金代码集合、各基金数据版本和参数生成，数据变更后旧条目自然不再命中
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# 单例模式
+_correlation_cache = None
+
+def get_correlation_cache() -> CorrelationCache:
+    """获取相关性结果缓存单例"""
+    global _correlation_cache
+    if _correlation_cache is None:
+        _correlation_cache = CorrelationCache()
+    return _correlation_cache
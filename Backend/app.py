@@ -1,21 +1,45 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS
 from database import init_db, SessionLocal
 from models import (FundBasicInfo, FundTrend, FundEstimate, FundPortfolio, 
                     FundExtraData, FundWatchlist, FundWatchlistGroup, 
-                    FundRiskMetrics, FundScreeningRank)
+                    FundRiskMetrics, FundRiskState, FundScreeningRank, FundScreeningFlat,
+                    BatchUpdateJob, SCREENING_SORT_COLUMNS)
 from fund_api import FundAPI
 from fund_list_cache import get_fund_list_cache
+from batch_jobs import (BATCH_FRESH_HOURS, JobCheckpoint, JobHeartbeat, claim_job, create_job, finish_job,
+                        fresh_fund_codes, is_resumable, job_params, job_to_dict, recover_interrupted_jobs)
+from batch_updater import (BatchUpdatePipeline, DEFAULT_FETCH_WORKERS, DEFAULT_PARSE_WORKERS,
+                           DEFAULT_RATE_LIMIT)
 from llm_service import get_llm_service
+from response_cache import get_response_cache, build_cached_response, invalidate_on_commit
+from analytics_service import (calculate_correlation, get_correlation_cache, get_similarity_index,
+                               DEFAULT_LOOKBACK_DAYS, MAX_CORRELATION_FUNDS)
+from risk_engine import (calculate_risk_metrics, calculate_risk_metrics_batch,
+                         calculate_benchmark_metrics, BENCHMARK_METRIC_KEYS,
+                         calculate_rolling_metrics, nav_value, ROLLING_METRICS)
+from risk_state import update_risk_state
+from trading_calendar import period_first_mask, to_ordinal, to_ordinals
+from upstream import UpstreamUnavailable, get_upstream_client
+from metric_distribution import get_metric_distributions, DISTRIBUTION_METRICS
+from rank_index import get_rank_index
+from screening_engine import SCREENING_ENGINE_ENABLED, get_screening_engine
+from screening_export import EXPORT_BATCH_SIZE, EXPORT_COLUMNS, EXPORT_FORMATS, encode_export
+from screening_strategies import (STRATEGIES, FACET_HISTOGRAMS, get_strategy, get_strategy_membership,
+                                  histogram_buckets, range_conditions)
+from screening_table import (refresh_screening_fund, rebuild_screening_table, recalculate_screening_ranks,
+                             get_screening_version, get_count_cache, get_stats_cache)
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, asc, and_, or_, func
-from datetime import datetime, timedelta
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy import desc, asc, and_, or_, case, func, select, literal, tuple_, type_coerce, LargeBinary
+from datetime import datetime
+import base64
+import hashlib
 import json
 import math
 import threading
 import time
 import re
-import requests
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
@@ -35,6 +59,39 @@ def teardown_db(exception):
 init_db()
 fund_api = FundAPI()
 fund_list_cache = get_fund_list_cache()
+response_cache = get_response_cache()
+correlation_cache = get_correlation_cache()
+similarity_index = get_similarity_index()
+metric_distributions = get_metric_distributions()
+rank_index = get_rank_index()
+strategy_membership = get_strategy_membership()
+screening_engine = get_screening_engine()
+stats_cache = get_stats_cache()
+upstream_client = get_upstream_client()
+
+_startup_lock = threading.Lock()
+_startup_done = False
+
+def run_startup_tasks():
+    """
+    进程启动后执行一次（由第一个请求触发，导入模块时不执行）：
+    心跳过期的批量更新任务标记为中断，可通过 /api/screening/jobs/<id>/resume 续跑
+    """
+    global _startup_done
+    with _startup_lock:
+        if _startup_done:
+            return
+        _startup_done = True
+    db = SessionLocal()
+    try:
+        recover_interrupted_jobs(db)
+    finally:
+        db.close()
+
+@app.before_request
+def _run_startup_tasks_once():
+    if not _startup_done:
+        run_startup_tasks()
 
 def _json_dumps(data):
     return json.dumps(data, ensure_ascii=False) if data is not None else None
@@ -47,33 +104,76 @@ def _json_loads(data, default):
     except Exception:
         return default
 
-def _build_cached_response(db: Session, fund_code: str):
-    basic = db.query(FundBasicInfo).filter(FundBasicInfo.fund_code == fund_code).first()
-    trend = db.query(FundTrend).filter(FundTrend.fund_code == fund_code).first()
-    estimate = db.query(FundEstimate).filter(FundEstimate.fund_code == fund_code).first()
-    portfolio = db.query(FundPortfolio).filter(FundPortfolio.fund_code == fund_code).first()
-    extra = db.query(FundExtraData).filter(FundExtraData.fund_code == fund_code).first()
+def _query_cached_rows(db: Session, fund_code: str):
+    """
+    一次索引查询取回缓存所需的全部记录
+    以基金代码为驱动行 LEFT JOIN 各表，任一表缺失时对应位置为 None
+    返回: (basic, trend, estimate, portfolio, extra, risk)
+    """
+    code = select(literal(fund_code).label('fund_code')).subquery()
+    row = db.query(
+        FundBasicInfo, FundTrend, FundEstimate, FundPortfolio, FundExtraData, FundRiskMetrics
+    ).select_from(code).outerjoin(
+        FundBasicInfo, FundBasicInfo.fund_code == code.c.fund_code
+    ).outerjoin(
+        FundTrend, FundTrend.fund_code == code.c.fund_code
+    ).outerjoin(
+        FundEstimate, FundEstimate.fund_code == code.c.fund_code
+    ).outerjoin(
+        FundPortfolio, FundPortfolio.fund_code == code.c.fund_code
+    ).outerjoin(
+        FundExtraData, FundExtraData.fund_code == code.c.fund_code
+    ).outerjoin(
+        FundRiskMetrics, FundRiskMetrics.fund_code == code.c.fund_code
+    ).first()
+    return tuple(row) if row else (None,) * 6
+
+
+def _build_cached_response(db: Session, fund_code: str, raw=False, extra_fields=None, rows=None):
+    """
+    从数据库缓存构建基金详情数据
+
+    raw=False: 返回 dict（逐个解析存储的 JSON）
+    raw=True:  直接把存储的 JSON 文本片段拼接成响应字符串，不做解码和重新编码
+               （存储内容均由 _json_dumps 生成，可直接拼接）
+    extra_fields: 追加到结果中的额外字段（如 risk_metrics、data_source）
+    rows: 已通过 _query_cached_rows 查询到的记录，避免重复查询
+    """
+    basic, trend, estimate, portfolio, extra, _ = rows or _query_cached_rows(db, fund_code)
 
     if not any([basic, trend, estimate, portfolio, extra]):
         return None
 
-    data = {}
+    def field(text_value, default):
+        if raw:
+            return text_value or json.dumps(default)
+        return _json_loads(text_value, default)
+
+    def plain(value):
+        return _json_dumps(value) if raw else value
+
+    def group(items):
+        if raw:
+            return '{' + ', '.join(f'{json.dumps(key)}: {value}' for key, value in items) + '}'
+        return dict(items)
+
+    data = []
 
     if basic:
-        data['basic_info'] = _json_loads(basic.basic_json, {})
-        data['performance'] = _json_loads(basic.performance_json, {})
+        data.append(('basic_info', field(basic.basic_json, {})))
+        data.append(('performance', field(basic.performance_json, {})))
 
     if trend:
-        data['net_worth_trend'] = _json_loads(trend.net_worth_trend_json, [])
-        data['accumulated_net_worth'] = _json_loads(trend.accumulated_net_worth_json, [])
-        data['position_trend'] = _json_loads(trend.position_trend_json, [])
-        data['total_return_trend'] = _json_loads(trend.total_return_trend_json, [])
-        data['ranking_trend'] = _json_loads(trend.ranking_trend_json, [])
-        data['ranking_percentage'] = _json_loads(trend.ranking_percentage_json, [])
-        data['scale_fluctuation'] = _json_loads(trend.scale_fluctuation_json, {})
+        data.append(('net_worth_trend', field(trend.net_worth_trend_json, [])))
+        data.append(('accumulated_net_worth', field(trend.accumulated_net_worth_json, [])))
+        data.append(('position_trend', field(trend.position_trend_json, [])))
+        data.append(('total_return_trend', field(trend.total_return_trend_json, [])))
+        data.append(('ranking_trend', field(trend.ranking_trend_json, [])))
+        data.append(('ranking_percentage', field(trend.ranking_percentage_json, [])))
+        data.append(('scale_fluctuation', field(trend.scale_fluctuation_json, {})))
 
     if estimate:
-        data['realtime_estimate'] = {
+        data.append(('realtime_estimate', plain({
             'name': estimate.name,
             'fund_code': fund_code,
             'net_worth': estimate.net_worth,
@@ -81,25 +181,76 @@ def _build_cached_response(db: Session, fund_code: str):
             'estimate_value': estimate.estimate_value,
             'estimate_change': estimate.estimate_change,
             'estimate_time': estimate.estimate_time
-        }
+        })))
 
     if portfolio:
-        data['portfolio'] = {
-            'stock_codes': _json_loads(portfolio.stock_codes_json, []),
-            'bond_codes': _json_loads(portfolio.bond_codes_json, []),
-            'stock_codes_new': _json_loads(portfolio.stock_codes_new_json, []),
-            'bond_codes_new': _json_loads(portfolio.bond_codes_new_json, [])
-        }
+        data.append(('portfolio', group([
+            ('stock_codes', field(portfolio.stock_codes_json, [])),
+            ('bond_codes', field(portfolio.bond_codes_json, [])),
+            ('stock_codes_new', field(portfolio.stock_codes_new_json, [])),
+            ('bond_codes_new', field(portfolio.bond_codes_new_json, []))
+        ])))
 
     if extra:
-        data['holder_structure'] = _json_loads(extra.holder_structure_json, {})
-        data['asset_allocation'] = _json_loads(extra.asset_allocation_json, {})
-        data['performance_evaluation'] = _json_loads(extra.performance_evaluation_json, {})
-        data['fund_managers'] = _json_loads(extra.fund_managers_json, [])
-        data['subscription_redemption'] = _json_loads(extra.subscription_redemption_json, {})
-        data['same_type_funds'] = _json_loads(extra.same_type_funds_json, [])
+        data.append(('holder_structure', field(extra.holder_structure_json, {})))
+        data.append(('asset_allocation', field(extra.asset_allocation_json, {})))
+        data.append(('performance_evaluation', field(extra.performance_evaluation_json, {})))
+        data.append(('fund_managers', field(extra.fund_managers_json, [])))
+        data.append(('subscription_redemption', field(extra.subscription_redemption_json, {})))
+        data.append(('same_type_funds', field(extra.same_type_funds_json, [])))
+
+    for key, value in (extra_fields or {}).items():
+        data.append((key, plain(value)))
+
+    return group(data)
 
-    return data
+
+def _json_text_response(json_text, status=200):
+    """直接返回已编码的 JSON 文本"""
+    return app.response_class(json_text, status=status, mimetype='application/json')
+
+
+def _cached_bytes_response(entry):
+    """
+    返回预编码的缓存响应
+    - 客户端接受 gzip 且有预压缩数据时直接返回压缩字节
+    - 两种编码的响应体不同，ETag 分别为 <etag> 与 <etag>-gzip，避免缓存或条件请求混用
+    - 客户端 If-None-Match 命中所选编码的 ETag 时返回 304
+    """
+    use_gzip = entry.gzip_body is not None and bool(request.accept_encodings['gzip'])
+    etag = f'{entry.etag}-gzip' if use_gzip else entry.etag
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    elif use_gzip:
+        response = app.response_class(entry.gzip_body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(entry.body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # 允许浏览器缓存，但每次使用前需携带 ETag 重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _risk_record_to_dict(risk_record):
+    """FundRiskMetrics 记录转换为 risk_metrics 字典"""
+    return {
+        'max_drawdown_3m': risk_record.max_drawdown_3m,
+        'max_drawdown_6m': risk_record.max_drawdown_6m,
+        'max_drawdown_1y': risk_record.max_drawdown_1y,
+        'max_drawdown_3y': risk_record.max_drawdown_3y,
+        'max_drawdown_all': risk_record.max_drawdown_all,
+        'sharpe_ratio_1y': risk_record.sharpe_ratio_1y,
+        'sharpe_ratio_3y': risk_record.sharpe_ratio_3y,
+        'volatility_1y': risk_record.volatility_1y,
+        'volatility_3y': risk_record.volatility_3y,
+        'annual_return_1y': risk_record.annual_return_1y,
+        'annual_return_3y': risk_record.annual_return_3y,
+        'calmar_ratio_1y': risk_record.calmar_ratio_1y,
+        'calmar_ratio_3y': risk_record.calmar_ratio_3y,
+        **{key: getattr(risk_record, key) for key in BENCHMARK_METRIC_KEYS},
+    }
 
 @app.route('/')
 def hello():
@@ -289,24 +440,35 @@ def get_fund_detail(fund_code):
         # 【数据一致性】同时更新风险指标，确保详情/对比/筛选数据统一
         net_worth_trend = fund_data.get('net_worth_trend', [])
         if net_worth_trend and len(net_worth_trend) >= 30:
-            risk_metrics = calculate_risk_metrics(net_worth_trend)
+            risk_metrics = _calculate_risk_incremental(
+                db, fund_code, net_worth_trend, fund_data.get('total_return_trend')
+            )
             if risk_metrics:
                 _save_risk_metrics(db, fund_code, risk_metrics)
                 # 将风险指标也附加到返回数据中
                 fund_data['risk_metrics'] = risk_metrics
 
         try:
+            refresh_screening_fund(db, fund_code)
+            _rerank_fund_type(db, fund_code)
+            invalidate_on_commit(db, fund_code)
             db.commit()
         except Exception as e:
             print(f"Error saving to database: {e}")
             db.rollback()
+            rank_index.invalidate()
 
         return jsonify(fund_data)
     
     # 如果API获取失败，尝试从数据库获取缓存数据作为兜底
-    cached_data = _build_cached_response(db, fund_code)
-    if cached_data:
-        return jsonify(cached_data)
+    version = response_cache.get_version(fund_code)
+    entry = response_cache.get(fund_code, 'detail', version)
+    if entry is None:
+        cached_json = _build_cached_response(db, fund_code, raw=True)
+        if cached_json:
+            entry = response_cache.put(fund_code, 'detail', cached_json.encode('utf-8'), version)
+    if entry is not None:
+        return _cached_bytes_response(entry)
 
     return jsonify({"error": "Fund not found"}), 404
 
@@ -415,6 +577,201 @@ def get_fund_trend(fund_code):
     return jsonify({"error": "Fund trend data not found"}), 404
 
 
+@app.route('/api/fund/<fund_code>/rolling-metrics', methods=['GET'])
+def get_fund_rolling_metrics(fund_code):
+    """
+    获取滚动窗口指标序列
+    参数: window=窗口交易日数（默认252），metrics=逗号分隔的指标（return,vol,sharpe,drawdown）
+    基于数据库中的净值走势计算，结果按基金数据版本缓存
+    """
+    try:
+        window = int(request.args.get('window', 252))
+    except ValueError:
+        return jsonify({'error': 'window must be an integer'}), 400
+    if window < 20 or window > 2520:
+        return jsonify({'error': 'window must be between 20 and 2520'}), 400
+    
+    metrics = [m.strip() for m in request.args.get('metrics', 'sharpe,vol,drawdown').split(',') if m.strip()]
+    unknown = [m for m in metrics if m not in ROLLING_METRICS]
+    if unknown or not metrics:
+        return jsonify({'error': f"Unknown metrics: {','.join(unknown)}", 'available': list(ROLLING_METRICS)}), 400
+    metrics = sorted(set(metrics), key=ROLLING_METRICS.index)
+    
+    endpoint = f"rolling:{window}:{','.join(metrics)}"
+    version = response_cache.get_version(fund_code)
+    entry = response_cache.get(fund_code, endpoint, version)
+    if entry is not None:
+        return _cached_bytes_response(entry)
+    
+    db = get_db()
+    trend = db.query(FundTrend).filter(FundTrend.fund_code == fund_code).first()
+    if not trend:
+        return jsonify({'error': 'Fund trend data not found'}), 404
+    
+    rolling = calculate_rolling_metrics(_json_loads(trend.net_worth_trend_json, []), window, metrics)
+    if rolling is None:
+        return jsonify({'error': f'Not enough data for window {window}'}), 404
+    
+    body = json.dumps({
+        'fund_code': fund_code,
+        'window': window,
+        'metrics': metrics,
+        **rolling
+    }, ensure_ascii=False).encode('utf-8')
+    entry = response_cache.put(fund_code, endpoint, body, version, data_time=trend.updated_time)
+    return _cached_bytes_response(entry)
+
+
+# ==================== 组合分析 API ====================
+
+@app.route('/api/analytics/correlation', methods=['GET'])
+def get_correlation_matrix():
+    """
+    多只基金的日收益率相关性矩阵与层次聚类顺序
+    参数: codes=逗号分隔的基金代码（2~200只），days=回看天数（默认365）
+    结果按 (基金代码集合, 各基金数据版本, 回看天数) 缓存
+    """
+    codes = list(dict.fromkeys(c.strip() for c in request.args.get('codes', '').split(',') if c.strip()))
+    if len(codes) < 2:
+        return jsonify({'error': 'At least 2 fund codes are required'}), 400
+    if len(codes) > MAX_CORRELATION_FUNDS:
+        return jsonify({'error': f'At most {MAX_CORRELATION_FUNDS} fund codes are supported'}), 400
+    try:
+        days = int(request.args.get('days', DEFAULT_LOOKBACK_DAYS))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
+    if days < 90 or days > 3650:
+        return jsonify({'error': 'days must be between 90 and 3650'}), 400
+    codes.sort()
+    
+    db = get_db()
+    # 缓存键：代码集合 + 各基金走势更新时间与响应缓存版本
+    updated = dict(db.query(FundTrend.fund_code, FundTrend.updated_time).filter(
+        FundTrend.fund_code.in_(codes)
+    ).all())
+    versions = [
+        (code, updated[code].isoformat() if updated.get(code) else None, response_cache.get_version(code))
+        for code in codes
+    ]
+    cache_key = hashlib.blake2b(json.dumps([days, versions]).encode('utf-8'), digest_size=16).hexdigest()
+    entry = correlation_cache.get(cache_key)
+    if entry is not None:
+        return _cached_bytes_response(entry)
+    
+    trend_rows = dict(db.query(FundTrend.fund_code, FundTrend.net_worth_trend_json).filter(
+        FundTrend.fund_code.in_(codes)
+    ).all())
+    trends = {code: _json_loads(trend_rows.get(code), []) for code in codes}
+    names = dict(db.query(FundBasicInfo.fund_code, FundBasicInfo.fund_name).filter(
+        FundBasicInfo.fund_code.in_(codes)
+    ).all())
+    
+    result = calculate_correlation(trends, days)
+    result['names'] = {code: names.get(code) for code in codes}
+    body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+    data_times = [t for t in updated.values() if t]
+    entry = build_cached_response(body, data_time=max(data_times) if data_times else None)
+    correlation_cache.put(cache_key, entry)
+    return _cached_bytes_response(entry)
+
+
+# 相似基金索引重建锁：同一时间只有一个重建（批量更新结束时、首次查询触发的后台构建）
+_similarity_build_lock = threading.Lock()
+
+
+def _build_similarity_index(db):
+    """逐行读取净值走势构建索引（每只基金解析后立即截取到回看窗口），调用方持有 _similarity_build_lock"""
+    start = time.time()
+    rows = db.query(FundTrend.fund_code, FundTrend.net_worth_trend_json).filter(
+        FundTrend.net_worth_trend_json.isnot(None)
+    ).yield_per(500)
+    count = similarity_index.build_from_items((code, _json_loads(trend, [])) for code, trend in rows)
+    print(f"[相似基金] 索引重建完成: {count} 只基金，耗时 {time.time() - start:.1f} 秒")
+    return count
+
+
+def rebuild_similarity_index(db):
+    """从数据库中的净值走势重建相似基金索引（等待正在进行的重建结束），返回入索引的基金数"""
+    with _similarity_build_lock:
+        return _build_similarity_index(db)
+
+
+def _start_similarity_build():
+    """在后台线程构建相似基金索引；已有重建在进行时不重复启动"""
+    if not _similarity_build_lock.acquire(blocking=False):
+        return
+    
+    def run():
+        db = SessionLocal()
+        try:
+            _build_similarity_index(db)
+        except Exception as e:
+            print(f"[相似基金] 索引构建失败: {e}")
+        finally:
+            db.close()
+            _similarity_build_lock.release()
+    
+    threading.Thread(target=run, name='similarity-build', daemon=True).start()
+
+
+@app.route('/api/fund/<fund_code>/similar', methods=['GET'])
+def get_similar_funds(fund_code):
+    """
+    查找近一年日收益率走势与该基金最相似的基金（可作为替代品参考）
+    参数: k=返回数量（默认20，最多100）
+    """
+    try:
+        k = int(request.args.get('k', 20))
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    k = max(1, min(k, 100))
+    
+    if similarity_index.built_time is None:
+        # 索引在后台构建，不阻塞请求；并发的首次请求只会触发一次构建
+        _start_similarity_build()
+        response = jsonify({'error': 'Similarity index is being built, please retry later', 'building': True})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    
+    db = get_db()
+    results = similarity_index.query(fund_code, k)
+    if results is None:
+        # 不在索引中（新加入或索引构建后才有数据的基金）：按索引日历临时生成查询向量
+        trend = db.query(FundTrend.net_worth_trend_json).filter(FundTrend.fund_code == fund_code).scalar()
+        vector = similarity_index.vector_for(_json_loads(trend, [])) if trend else None
+        if vector is None:
+            return jsonify({'error': 'Not enough net worth data for similarity search'}), 404
+        results = similarity_index.query(fund_code, k, vector=vector)
+    
+    codes = [code for code, _ in results]
+    info = {
+        row.fund_code: row for row in db.query(
+            FundScreeningFlat.fund_code, FundScreeningFlat.fund_name, FundScreeningFlat.fund_type,
+            FundScreeningFlat.return_1y, FundScreeningFlat.volatility_1y
+        ).filter(FundScreeningFlat.fund_code.in_(codes)).all()
+    } if codes else {}
+    
+    similar = []
+    for code, score in results:
+        row = info.get(code)
+        similar.append({
+            'fund_code': code,
+            'fund_name': row.fund_name if row else None,
+            'fund_type': row.fund_type if row else None,
+            'return_1y': row.return_1y if row else None,
+            'volatility_1y': row.volatility_1y if row else None,
+            'similarity': score,
+        })
+    
+    return jsonify({
+        'fund_code': fund_code,
+        'lookback_days': similarity_index.lookback_days,
+        'index_size': similarity_index.size,
+        'index_time': similarity_index.built_time.isoformat() if similarity_index.built_time else None,
+        'similar': similar,
+    })
+
+
 # ==================== 自选基金 API ====================
 
 @app.route('/api/watchlist', methods=['GET'])
@@ -752,14 +1109,16 @@ def refresh_watchlist_estimates():
     fund_codes = [item.fund_code for item in watchlist]
     updated_count = 0
     results = []
+    # 上游熔断时剩余基金不再请求，保留数据库中已有的估值
+    unavailable = None
     
     for fund_code in fund_codes:
         try:
             # 只获取实时估值数据（轻量级请求）
-            real_time_url = f"http://fundgz.1234567.com.cn/js/{fund_code}.js"
-            response = requests.get(real_time_url, headers={
+            real_time_url = FundAPI.REALTIME_URL.format(code=fund_code)
+            response = upstream_client.get(real_time_url, headers={
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }, timeout=3)
+            }, timeout=3, retries=0)
             
             if response.status_code == 200:
                 match = re.search(r"jsonpgz\((.*?)\);", response.text)
@@ -789,6 +1148,7 @@ def refresh_watchlist_estimates():
                                 estimate_time=rt_data.get('gztime')
                             )
                             db.add(estimate_record)
+                        invalidate_on_commit(db, fund_code)
                         
                         updated_count += 1
                         results.append({
@@ -799,6 +1159,10 @@ def refresh_watchlist_estimates():
                             'net_worth': rt_data.get('dwjz'),
                             'net_worth_date': rt_data.get('jzrq')
                         })
+        except UpstreamUnavailable as e:
+            print(f"刷新估值中止: {e}")
+            unavailable = {'host': e.host, 'reason': e.reason, 'retry_after': round(e.retry_after, 1)}
+            break
         except Exception as e:
             # 单个基金失败不影响其他
             print(f"刷新 {fund_code} 估值失败: {e}")
@@ -814,169 +1178,13 @@ def refresh_watchlist_estimates():
         'message': f'Updated {updated_count} funds',
         'updated': updated_count,
         'total': len(fund_codes),
-        'data': results
+        'data': results,
+        'upstream_unavailable': unavailable
     })
 
 
 # ==================== 风险指标计算 ====================
 
-def calculate_risk_metrics(net_worth_trend):
-    """
-    计算基金风险指标：最大回撤、夏普比率、年化波动率、年化收益率
-    net_worth_trend: [{'date': '2024-01-01', 'net_worth': 1.0}, ...]
-    """
-    if not net_worth_trend or len(net_worth_trend) < 30:
-        return None
-    
-    # 按日期排序
-    sorted_data = sorted(net_worth_trend, key=lambda x: x.get('date', ''))
-    
-    # 转换为净值数组和日期数组
-    dates = []
-    values = []
-    for item in sorted_data:
-        if item.get('net_worth') is not None:
-            dates.append(item.get('date'))
-            values.append(float(item.get('net_worth')))
-    
-    # 过滤首日异常数据（如面值1.0与实际净值100+差异巨大）
-    # 这种情况会导致波动率和回撤计算极其离谱
-    if len(values) >= 2:
-        v0 = values[0]
-        v1 = values[1]
-        if v0 > 0 and abs((v1 - v0) / v0) > 0.5:
-            values.pop(0)
-            dates.pop(0)
-    
-    if len(values) < 30:
-        return None
-    
-    now = datetime.now()
-    
-    def get_period_data(months):
-        """获取指定时间段的数据"""
-        if months == 'all':
-            return values, dates
-        
-        cutoff_date = (now - timedelta(days=months * 30)).strftime('%Y-%m-%d')
-        period_values = []
-        period_dates = []
-        for i, d in enumerate(dates):
-            if d >= cutoff_date:
-                period_values.append(values[i])
-                period_dates.append(d)
-        return period_values, period_dates
-    
-    def calc_max_drawdown(period_values):
-        """计算最大回撤"""
-        if len(period_values) < 2:
-            return None
-        
-        peak = period_values[0]
-        max_dd = 0
-        
-        for value in period_values:
-            if value > peak:
-                peak = value
-            drawdown = (peak - value) / peak * 100
-            if drawdown > max_dd:
-                max_dd = drawdown
-        
-        return round(max_dd, 2)
-    
-    def calc_daily_returns(period_values):
-        """计算日收益率序列"""
-        if len(period_values) < 2:
-            return []
-        returns = []
-        for i in range(1, len(period_values)):
-            if period_values[i-1] != 0:
-                ret = (period_values[i] - period_values[i-1]) / period_values[i-1]
-                returns.append(ret)
-        return returns
-    
-    def calc_annual_return(period_values, trading_days):
-        """计算年化收益率"""
-        if len(period_values) < 2 or period_values[0] == 0:
-            return None
-        total_return = (period_values[-1] - period_values[0]) / period_values[0]
-        if trading_days <= 0:
-            return None
-        annual_return = ((1 + total_return) ** (252 / trading_days) - 1) * 100
-        return round(annual_return, 2)
-    
-    def calc_volatility(daily_returns):
-        """计算年化波动率"""
-        if len(daily_returns) < 10:
-            return None
-        mean_return = sum(daily_returns) / len(daily_returns)
-        variance = sum((r - mean_return) ** 2 for r in daily_returns) / len(daily_returns)
-        daily_vol = math.sqrt(variance)
-        annual_vol = daily_vol * math.sqrt(252) * 100
-        return round(annual_vol, 2)
-    
-    def calc_sharpe_ratio(annual_return, volatility, risk_free_rate=2.0):
-        """计算夏普比率，假设无风险利率为2%"""
-        if volatility is None or volatility == 0 or annual_return is None:
-            return None
-        sharpe = (annual_return - risk_free_rate) / volatility
-        return round(sharpe, 2)
-    
-    result = {}
-    
-    # 计算不同时间段的最大回撤
-    for period, months in [('3m', 3), ('6m', 6), ('1y', 12), ('3y', 36), ('all', 'all')]:
-        period_values, _ = get_period_data(months)
-        result[f'max_drawdown_{period}'] = calc_max_drawdown(period_values)
-    
-    # 计算1年和3年的年化收益率、波动率、夏普比率
-    # 重要：对于数据不足的周期，不计算指标（返回None），避免年化放大产生误导性数据
-    min_trading_days = {
-        '1y': 200,  # 至少200个交易日才计算1年期指标（约10个月）
-        '3y': 600,  # 至少600个交易日才计算3年期指标（约2.5年）
-    }
-    
-    for period, months in [('1y', 12), ('3y', 36)]:
-        period_values, period_dates = get_period_data(months)
-        trading_days = len(period_values)
-        
-        # 检查数据是否充足
-        min_days = min_trading_days.get(period, 30)
-        if trading_days < min_days:
-            # 数据不足，不计算该周期的指标
-            result[f'annual_return_{period}'] = None
-            result[f'volatility_{period}'] = None
-            result[f'sharpe_ratio_{period}'] = None
-            result[f'calmar_ratio_{period}'] = None
-            continue
-        
-        daily_returns = calc_daily_returns(period_values)
-        annual_return = calc_annual_return(period_values, trading_days)
-        volatility = calc_volatility(daily_returns)
-        sharpe = calc_sharpe_ratio(annual_return, volatility)
-        
-        # 额外检查：如果波动率异常大（>500%），说明数据有问题，放弃该计算结果
-        if volatility is not None and volatility > 500:
-            result[f'annual_return_{period}'] = None
-            result[f'volatility_{period}'] = None
-            result[f'sharpe_ratio_{period}'] = None
-            result[f'calmar_ratio_{period}'] = None
-            continue
-        
-        result[f'annual_return_{period}'] = annual_return
-        result[f'volatility_{period}'] = volatility
-        result[f'sharpe_ratio_{period}'] = sharpe
-        
-        # 计算卡玛比率
-        max_dd = result.get(f'max_drawdown_{period}')
-        if annual_return is not None and max_dd is not None and max_dd > 0:
-            result[f'calmar_ratio_{period}'] = round(annual_return / max_dd, 2)
-        else:
-            result[f'calmar_ratio_{period}'] = None
-    
-    return result
-
-
 def is_data_fresh(updated_time, days=7):
     """检查数据是否在指定天数内"""
     if not updated_time:
@@ -1000,9 +1208,17 @@ def get_fund_compare_data(fund_code):
     force_refresh = request.args.get('refresh', 'false').lower() == 'true'
     
     try:
-        # 检查缓存数据是否新鲜（1周内）
-        trend_record = db.query(FundTrend).filter(FundTrend.fund_code == fund_code).first()
-        risk_record = db.query(FundRiskMetrics).filter(FundRiskMetrics.fund_code == fund_code).first()
+        # 预编码响应缓存：数据未重新保存且仍在1周内时直接返回
+        version = response_cache.get_version(fund_code)
+        if not force_refresh:
+            entry = response_cache.get(fund_code, 'compare-data', version)
+            if entry is not None and is_data_fresh(entry.data_time, days=7):
+                return _cached_bytes_response(entry)
+        
+        # 一次查询取回全部缓存记录，并检查缓存数据是否新鲜（1周内）
+        cached_rows = _query_cached_rows(db, fund_code)
+        trend_record = cached_rows[1]
+        risk_record = cached_rows[5]
         
         use_cache = (
             not force_refresh and 
@@ -1011,90 +1227,73 @@ def get_fund_compare_data(fund_code):
         )
         
         if use_cache:
-            # 使用缓存数据
-            data = _build_cached_response(db, fund_code)
-            if data:
-                # 检查风险指标是否存在且新鲜
-                risk_data_valid = (
-                    risk_record and 
-                    is_data_fresh(risk_record.updated_time, days=7) and
-                    risk_record.sharpe_ratio_1y is not None
-                )
+            # 检查风险指标是否存在且新鲜
+            risk_data_valid = (
+                risk_record and 
+                is_data_fresh(risk_record.updated_time, days=7) and
+                risk_record.sharpe_ratio_1y is not None
+            )
 
-                # 额外检查：如果波动率异常大（>1000%），说明之前计算时受到了脏数据影响，需要重算
-                if risk_data_valid and risk_record.volatility_1y and risk_record.volatility_1y > 1000:
-                    risk_data_valid = False
+            # 额外检查：如果波动率异常大（>1000%），说明之前计算时受到了脏数据影响，需要重算
+            if risk_data_valid and risk_record.volatility_1y and risk_record.volatility_1y > 1000:
+                risk_data_valid = False
+            
+            if risk_data_valid:
+                risk_metrics = _risk_record_to_dict(risk_record)
+            else:
+                # 风险指标缺失，从缓存的净值数据计算（仅此时才解析净值走势）
+                net_worth_trend = _json_loads(trend_record.net_worth_trend_json, [])
+                total_return_trend = _json_loads(trend_record.total_return_trend_json, [])
+                risk_metrics = calculate_risk_metrics(net_worth_trend, total_return_trend=total_return_trend)
                 
-                if risk_data_valid:
-                    data['risk_metrics'] = {
-                        'max_drawdown_3m': risk_record.max_drawdown_3m,
-                        'max_drawdown_6m': risk_record.max_drawdown_6m,
-                        'max_drawdown_1y': risk_record.max_drawdown_1y,
-                        'max_drawdown_3y': risk_record.max_drawdown_3y,
-                        'max_drawdown_all': risk_record.max_drawdown_all,
-                        'sharpe_ratio_1y': risk_record.sharpe_ratio_1y,
-                        'sharpe_ratio_3y': risk_record.sharpe_ratio_3y,
-                        'volatility_1y': risk_record.volatility_1y,
-                        'volatility_3y': risk_record.volatility_3y,
-                        'annual_return_1y': risk_record.annual_return_1y,
-                        'annual_return_3y': risk_record.annual_return_3y,
-                        'calmar_ratio_1y': risk_record.calmar_ratio_1y,
-                        'calmar_ratio_3y': risk_record.calmar_ratio_3y,
-                    }
+                if risk_metrics:
+                    # 保存到 FundRiskMetrics
+                    _save_risk_metrics(db, fund_code, risk_metrics)
+                    db.commit()
+                    version = response_cache.get_version(fund_code)
                 else:
-                    # 风险指标缺失，从缓存的净值数据计算
-                    net_worth_trend = data.get('net_worth_trend', [])
-                    risk_metrics = calculate_risk_metrics(net_worth_trend)
-                    
-                    if risk_metrics:
-                        # 保存到 FundRiskMetrics
-                        _save_risk_metrics(db, fund_code, risk_metrics)
-                        db.commit()
-                        data['risk_metrics'] = risk_metrics
-                    else:
-                        data['risk_metrics'] = {}
-                
-                data['data_source'] = 'cache'
-                data['cache_time'] = trend_record.updated_time.isoformat() if trend_record.updated_time else None
-                return jsonify(data)
+                    risk_metrics = {}
+            
+            # 使用缓存数据：直接拼接存储的 JSON 片段，并写入响应缓存
+            cached_json = _build_cached_response(db, fund_code, raw=True, rows=cached_rows, extra_fields={
+                'risk_metrics': risk_metrics,
+                'data_source': 'cache',
+                'cache_time': trend_record.updated_time.isoformat() if trend_record.updated_time else None
+            })
+            if cached_json:
+                entry = response_cache.put(
+                    fund_code, 'compare-data', cached_json.encode('utf-8'), version,
+                    data_time=trend_record.updated_time
+                )
+                return _cached_bytes_response(entry)
         
         # 从API获取新数据
         api_data = fund_api.get_fund_data(fund_code)
         if not api_data:
             # 如果API失败，尝试返回缓存数据
             if trend_record:
-                data = _build_cached_response(db, fund_code)
-                if data:
-                    if risk_record and risk_record.sharpe_ratio_1y is not None:
-                        data['risk_metrics'] = {
-                            'max_drawdown_3m': risk_record.max_drawdown_3m,
-                            'max_drawdown_6m': risk_record.max_drawdown_6m,
-                            'max_drawdown_1y': risk_record.max_drawdown_1y,
-                            'max_drawdown_3y': risk_record.max_drawdown_3y,
-                            'max_drawdown_all': risk_record.max_drawdown_all,
-                            'sharpe_ratio_1y': risk_record.sharpe_ratio_1y,
-                            'sharpe_ratio_3y': risk_record.sharpe_ratio_3y,
-                            'volatility_1y': risk_record.volatility_1y,
-                            'volatility_3y': risk_record.volatility_3y,
-                            'annual_return_1y': risk_record.annual_return_1y,
-                            'annual_return_3y': risk_record.annual_return_3y,
-                            'calmar_ratio_1y': risk_record.calmar_ratio_1y,
-                            'calmar_ratio_3y': risk_record.calmar_ratio_3y,
-                        }
-                    else:
-                        net_worth_trend = data.get('net_worth_trend', [])
-                        risk_metrics = calculate_risk_metrics(net_worth_trend)
-                        if risk_metrics:
-                            _save_risk_metrics(db, fund_code, risk_metrics)
-                            db.commit()
-                        data['risk_metrics'] = risk_metrics or {}
-                    data['data_source'] = 'stale_cache'
-                    return jsonify(data)
+                if risk_record and risk_record.sharpe_ratio_1y is not None:
+                    risk_metrics = _risk_record_to_dict(risk_record)
+                else:
+                    net_worth_trend = _json_loads(trend_record.net_worth_trend_json, [])
+                    total_return_trend = _json_loads(trend_record.total_return_trend_json, [])
+                    risk_metrics = calculate_risk_metrics(net_worth_trend, total_return_trend=total_return_trend)
+                    if risk_metrics:
+                        _save_risk_metrics(db, fund_code, risk_metrics)
+                        db.commit()
+                cached_json = _build_cached_response(db, fund_code, raw=True, rows=cached_rows, extra_fields={
+                    'risk_metrics': risk_metrics or {},
+                    'data_source': 'stale_cache'
+                })
+                if cached_json:
+                    return _json_text_response(cached_json)
             return jsonify({'error': 'Failed to fetch fund data'}), 500
         
         # 计算风险指标
         net_worth_trend = api_data.get('net_worth_trend', [])
-        risk_metrics = calculate_risk_metrics(net_worth_trend)
+        risk_metrics = calculate_risk_metrics(
+            net_worth_trend, total_return_trend=api_data.get('total_return_trend', [])
+        )
         
         # 保存到数据库（所有相关表）
         _save_fund_data_to_db(db, fund_code, api_data)
@@ -1113,11 +1312,38 @@ def get_fund_compare_data(fund_code):
         return jsonify({'error': str(e)}), 500
 
 
+def _calculate_risk_incremental(db: Session, fund_code: str, net_worth_trend: list,
+                                total_return_trend: list = None):
+    """
+    增量计算风险指标
+    读取 FundRiskState 中的运行状态，只处理新增和滑出窗口的净值点，并保存新状态
+    相对基准指标只依赖近1年的累计收益率走势，每次直接计算
+    """
+    state_record = db.query(FundRiskState).filter(FundRiskState.fund_code == fund_code).first()
+    state = _json_loads(state_record.state_json, None) if state_record else None
+    
+    risk_metrics, state = update_risk_state(net_worth_trend, state)
+    
+    if state is None:
+        if state_record:
+            db.delete(state_record)
+    elif state_record:
+        state_record.state_json = _json_dumps(state)
+        state_record.updated_time = datetime.now()
+    else:
+        db.add(FundRiskState(fund_code=fund_code, state_json=_json_dumps(state)))
+    
+    if risk_metrics is not None:
+        risk_metrics.update(calculate_benchmark_metrics(total_return_trend or []))
+    return risk_metrics
+
+
 def _save_risk_metrics(db: Session, fund_code: str, risk_metrics: dict):
     """保存风险指标到 FundRiskMetrics 表"""
     if not risk_metrics:
         return
     
+    invalidate_on_commit(db, fund_code)
     risk_record = db.query(FundRiskMetrics).filter(FundRiskMetrics.fund_code == fund_code).first()
     
     if risk_record:
@@ -1131,10 +1357,16 @@ def _save_risk_metrics(db: Session, fund_code: str, risk_metrics: dict):
             **{k: v for k, v in risk_metrics.items() if hasattr(FundRiskMetrics, k)}
         )
         db.add(risk_record)
+    
+    # 同步刷新筛选宽表
+    refresh_screening_fund(db, fund_code)
 
 
-def _save_fund_data_to_db(db: Session, fund_code: str, data: dict):
-    """保存基金数据到数据库"""
+def _save_fund_data_to_db(db: Session, fund_code: str, data: dict, commit: bool = True):
+    """
+    保存基金数据到数据库
+    commit=False 时不提交，出错时直接抛出（批量更新流水线按批提交、统一处理回滚）
+    """
     try:
         # 保存基本信息
         basic_info = data.get('basic_info', {})
@@ -1211,12 +1443,30 @@ def _save_fund_data_to_db(db: Session, fund_code: str, data: dict):
             )
             db.add(extra_record)
         
-        db.commit()
+        # 同步刷新筛选宽表，并增量更新所在类型的同类排名
+        refresh_screening_fund(db, fund_code)
+        _rerank_fund_type(db, fund_code)
+        invalidate_on_commit(db, fund_code)
+        if commit:
+            db.commit()
     except Exception as e:
+        if not commit:
+            raise
         db.rollback()
+        rank_index.invalidate()
         print(f"Error saving fund data to db: {e}")
 
 
+def _rerank_fund_type(db: Session, fund_code: str):
+    """
+    单只基金收益率更新后，只重算其所在类型中名次受影响的基金的排名百分位与 4433 标记
+    批量更新期间跳过，由结束时的全量排名统一计算
+    """
+    if screening_update_status['running']:
+        return
+    rank_index.rerank_fund(db, fund_code)
+
+
 # ==================== 基金筛选功能 ====================
 
 # 全局变量：批量更新状态
@@ -1239,185 +1489,72 @@ def calculate_calmar_ratio(annual_return, max_drawdown):
     return round(annual_return / max_drawdown, 2)
 
 
-def check_4433_rule(rank_1y, rank_2y, rank_3y, rank_5y, rank_6m, rank_3m):
-    """
-    检查是否符合4433法则
-    4433法则：
-    - 近1年、2年、3年、5年排名在同类前1/4 (25%)
-    - 近6个月、3个月排名在前1/3 (33.33%)
-    注意：这里的排名应该是同类型基金中的排名百分位
-    """
-    # 长期排名：1年必须有，2年3年至少有一个
-    if rank_1y is None or rank_1y > 25:
-        return False
-    
-    # 检查2年和3年排名（如果有数据）
-    long_term_available = [r for r in [rank_2y, rank_3y] if r is not None]
-    if long_term_available:
-        for rank in long_term_available:
-            if rank > 25:
-                return False
-    
-    # 如果有5年数据，也需要在前25%
-    if rank_5y is not None and rank_5y > 25:
-        return False
-    
-    # 短期排名：6个月和3个月都必须在前33.33%
-    if rank_6m is None or rank_6m > 33.33:
-        return False
-    if rank_3m is None or rank_3m > 33.33:
-        return False
-    
-    return True
-
-
 # ==================== 基金筛选功能 ====================
 
-def check_4433_rule(rank_1y, rank_2y, rank_3y, rank_5y, rank_6m, rank_3m):
+def calculate_same_type_rankings(db):
     """
-    检查是否符合4433法则
-    4433法则：
-    - 近1年、2年、3年排名在同类前1/4 (25%)
-    - 近6个月、3个月排名在前1/3 (33.33%)
+    计算同类型基金的排名百分位和4433法则标记
+    基于筛选宽表中的收益率列，由一条窗口函数 SQL 计算并批量 upsert 到 FundScreeningRank，
+    有变化的排名再写回宽表（宽表其余列在基金数据保存时已刷新，不需要全量重建）
     """
-    # 长期排名：1年必须有，2年3年至少有一个
-    if rank_1y is None or rank_1y > 25:
-        return False
-    
-    # 检查2年和3年排名（如果有数据）
-    long_term_available = [r for r in [rank_2y, rank_3y] if r is not None]
-    if long_term_available:
-        for rank in long_term_available:
-            if rank > 25:
-                return False
-    
-    # 如果有5年数据，也需要在前25%
-    if rank_5y is not None and rank_5y > 25:
-        return False
-    
-    # 短期排名：6个月和3个月都必须在前33.33%
-    if rank_6m is None or rank_6m > 33.33:
-        return False
-    if rank_3m is None or rank_3m > 33.33:
-        return False
-    
-    return True
+    start = time.perf_counter()
+    ranked_count, changed_count = recalculate_screening_ranks(db)
+    db.commit()
+    # 增量排名索引随全量结果作废，下次单只更新时重建
+    rank_index.invalidate()
+    if SCREENING_ENGINE_ENABLED:
+        screening_engine.build(db)
+    print(f"[同类排名] 同类型排名计算完成：{ranked_count} 只基金，{changed_count} 只排名变化，"
+          f"耗时 {time.perf_counter() - start:.2f} 秒")
 
 
-def calculate_same_type_rankings(db):
+def recalculate_all_risk_metrics(db, workers=1, chunk_size=2000):
     """
-    计算同类型基金的排名百分位
-    基于 FundBasicInfo 中的收益数据计算排名，保存到 FundScreeningRank
+    批量重算所有基金的风险指标
+    按基金代码分批（keyset）读取净值走势的原始压缩字节，解压、解析与矩阵计算都在计算进程中完成，
+    主进程内存中只有一批压缩数据；每批结果 upsert 到 FundRiskMetrics，最后重建筛选宽表
+    返回成功计算的基金数
     """
-    # 获取所有有效的基金类型
-    fund_types = db.query(FundBasicInfo.fund_type).filter(
-        FundBasicInfo.fund_type.isnot(None),
-        FundBasicInfo.fund_type != ''
-    ).distinct().all()
-    
-    fund_types = [ft[0] for ft in fund_types]
-    print(f"[同类排名] 发现 {len(fund_types)} 种基金类型")
-    
-    for fund_type in fund_types:
-        # 获取该类型的所有基金（包含业绩数据）
-        funds = db.query(FundBasicInfo).filter(
-            FundBasicInfo.fund_type == fund_type,
-            FundBasicInfo.performance_json.isnot(None)
-        ).all()
-        
-        if len(funds) < 2:
+    # 绕过 CompressedJSONText 的解压，直接取存储的字节（未压缩的历史数据为文本，同样交给计算进程处理）
+    raw_trend = type_coerce(FundTrend.net_worth_trend_json, LargeBinary)
+    raw_total = type_coerce(FundTrend.total_return_trend_json, LargeBinary)
+    now = datetime.now()
+    updated_codes = []
+    last_code = ''
+    while True:
+        rows = db.query(FundTrend.fund_code, raw_trend, raw_total).filter(
+            FundTrend.net_worth_trend_json.isnot(None), FundTrend.fund_code > last_code
+        ).order_by(FundTrend.fund_code).limit(chunk_size).all()
+        if not rows:
+            break
+        last_code = rows[-1][0]
+        chunk_results = calculate_risk_metrics_batch(
+            {code: trend for code, trend, _ in rows}, now=now, workers=workers,
+            total_return_trends={code: total for code, _, total in rows}
+        )
+        del rows
+        if not chunk_results:
             continue
-        
-        print(f"[同类排名] 处理 {fund_type}: {len(funds)} 只基金")
-        
-        # 解析业绩数据
-        fund_performances = []
-        for fund in funds:
-            perf = _json_loads(fund.performance_json, {})
-            fund_performances.append({
-                'fund_code': fund.fund_code,
-                'return_1m': perf.get('1_month_return'),
-                'return_3m': perf.get('3_month_return'),
-                'return_6m': perf.get('6_month_return'),
-                'return_1y': perf.get('1_year_return'),
-                'return_2y': perf.get('2_year_return'),
-                'return_3y': perf.get('3_year_return'),
-            })
-        
-        # 为每个时间段计算排名
-        periods = [
-            ('return_1m', 'rank_pct_1m'),
-            ('return_3m', 'rank_pct_3m'),
-            ('return_6m', 'rank_pct_6m'),
-            ('return_1y', 'rank_pct_1y'),
-            ('return_2y', 'rank_pct_2y'),
-            ('return_3y', 'rank_pct_3y'),
-        ]
-        
-        # 为每只基金创建或更新排名记录
-        fund_ranks = {}  # fund_code -> rank data
-        for fp in fund_performances:
-            fund_ranks[fp['fund_code']] = {}
-        
-        for return_field, rank_field in periods:
-            # 获取有该时段收益数据的基金
-            # 重要：排除收益率为 0、"0.00"、None 的基金
-            # 这些通常是成立时间不足导致的缺失数据，而非真实的0%收益
-            def is_valid_return(val):
-                if val is None:
-                    return False
-                try:
-                    num_val = float(val)
-                    # 真实0%收益极其罕见，0值通常表示数据缺失
-                    # 允许一个很小的误差范围（如 -0.01% ~ 0.01%）视为可能的真实数据
-                    if abs(num_val) < 0.01:
-                        return False
-                    return True
-                except (ValueError, TypeError):
-                    return False
-            
-            funds_with_data = [(fp['fund_code'], float(fp[return_field])) for fp in fund_performances 
-                               if is_valid_return(fp[return_field])]
-            
-            if len(funds_with_data) < 2:
-                continue
-            
-            # 按收益率降序排序（收益高排名靠前）
-            funds_with_data.sort(key=lambda x: x[1], reverse=True)
-            total = len(funds_with_data)
-            
-            # 计算每只基金的排名百分位
-            for rank_idx, (fund_code, _) in enumerate(funds_with_data, 1):
-                rank_pct = round((rank_idx / total) * 100, 2)
-                fund_ranks[fund_code][rank_field] = rank_pct
-        
-        # 更新数据库
-        for fund_code, ranks in fund_ranks.items():
-            rank_record = db.query(FundScreeningRank).filter(
-                FundScreeningRank.fund_code == fund_code
-            ).first()
-            
-            if not rank_record:
-                rank_record = FundScreeningRank(fund_code=fund_code)
-                db.add(rank_record)
-            
-            for field, value in ranks.items():
-                setattr(rank_record, field, value)
-            
-            # 计算4433法则
-            pass_4433 = check_4433_rule(
-                ranks.get('rank_pct_1y'),
-                ranks.get('rank_pct_2y'),
-                ranks.get('rank_pct_3y'),
-                None,
-                ranks.get('rank_pct_6m'),
-                ranks.get('rank_pct_3m')
-            )
-            rank_record.pass_4433 = 1 if pass_4433 else 0
-            rank_record.updated_time = datetime.now()
+        records = [{'fund_code': code, **metrics, 'updated_time': now} for code, metrics in chunk_results.items()]
+        stmt = sqlite_insert(FundRiskMetrics)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['fund_code'],
+            set_={key: stmt.excluded[key] for key in records[0] if key != 'fund_code'}
+        )
+        db.execute(stmt, records)
+        updated_codes.extend(chunk_results)
+    if not updated_codes:
+        return 0
     
+    invalidate_on_commit(db, updated_codes)
+    flat_count = rebuild_screening_table(db)
     db.commit()
-    print("[同类排名] 同类型排名计算完成")
+    metric_distributions.build(db)
+    strategy_membership.build(db)
+    if SCREENING_ENGINE_ENABLED:
+        screening_engine.build(db)
+    print(f"[风险指标] 批量计算完成: {len(updated_codes)} 只基金，筛选宽表 {flat_count} 条")
+    return len(updated_codes)
 
 
 # 全局变量：批量更新状态
@@ -1429,9 +1566,34 @@ screening_update_status = {
     'success_count': 0,
     'fail_count': 0,
     'start_time': None,
-    'message': ''
+    'message': '',
+    # 当前批量更新任务（batch_jobs）及其中因数据足够新而跳过的基金数
+    'job_id': None,
+    'skipped_count': 0
 }
 screening_stop_flag = False
+# 正在运行的批量更新流水线（状态接口读取各阶段吞吐量）
+screening_pipeline = None
+
+
+def _store_fund_update(db, fund_code, fund_data, commit=True):
+    """
+    保存一只基金的完整数据到所有相关表，并增量计算风险指标
+    commit=False: 基本数据不单独提交，出错时抛出（批量更新流水线）
+    """
+    # 保存到所有相关表
+    _save_fund_data_to_db(db, fund_code, fund_data, commit=commit)
+    
+    # 计算并保存风险指标（基于上次的运行状态增量计算）
+    net_worth_trend = fund_data.get('net_worth_trend', [])
+    if net_worth_trend and len(net_worth_trend) >= 30:
+        risk_metrics = _calculate_risk_incremental(
+            db, fund_code, net_worth_trend, fund_data.get('total_return_trend')
+        )
+        if risk_metrics:
+            _save_risk_metrics(db, fund_code, risk_metrics)
+    
+    return True
 
 
 def update_single_fund_data(fund_code, db):
@@ -1445,145 +1607,200 @@ def update_single_fund_data(fund_code, db):
         if not fund_data:
             return False
         
-        # 保存到所有相关表
-        _save_fund_data_to_db(db, fund_code, fund_data)
-        
-        # 计算并保存风险指标
-        net_worth_trend = fund_data.get('net_worth_trend', [])
-        if net_worth_trend and len(net_worth_trend) >= 30:
-            risk_metrics = calculate_risk_metrics(net_worth_trend)
-            if risk_metrics:
-                _save_risk_metrics(db, fund_code, risk_metrics)
-        
-        return True
+        return _store_fund_update(db, fund_code, fund_data)
     except Exception as e:
         print(f"Error updating data for {fund_code}: {e}")
         return False
 
 
-def batch_update_fund_data(fund_types=None, limit=None):
+def batch_update_fund_data(fund_types=None, limit=None, fetch_workers=None, rate=None, fresh_hours=None,
+                           job_id=None):
     """
-    批量更新基金数据（简化版）
-    直接获取每只基金的完整详情数据
+    批量更新基金数据
+    通过三阶段流水线（batch_updater）：并发抓取（令牌桶限流）→ 多进程解析清洗 → 单线程批量写库
+    fetch_workers: 抓取线程数；rate: 每秒最多请求的基金数（为空时使用环境变量配置的默认值）
+    每次更新对应一个持久化任务（batch_jobs）：job_id 为空时新建任务，否则从该任务的检查点续跑；
+    最近 fresh_hours 小时内已更新过的基金直接跳过
     """
-    global screening_update_status, screening_stop_flag
+    global screening_update_status, screening_stop_flag, screening_pipeline
     
     if screening_update_status['running']:
         return {'error': '更新任务正在进行中'}
     
     screening_update_status['running'] = True
     screening_update_status['start_time'] = datetime.now()
+    rank_index.invalidate()
     screening_update_status['message'] = '正在获取基金列表...'
     screening_stop_flag = False
     
+    db = SessionLocal()
+    heartbeat = None
+    resumed_job_id = job_id
     try:
-        # 获取基金列表
-        fund_list = fund_list_cache.fund_list
-        
-        # 按类型筛选
-        if fund_types:
-            fund_list = [f for f in fund_list if any(t in f.get('TYPE', '') for t in fund_types)]
+        if job_id:
+            # 续跑：先抢占任务（其他进程已在续跑时失败），沿用任务保存的基金列表与参数（请求中指定的参数优先）
+            if not claim_job(db, job_id):
+                job_id = None
+                screening_update_status['message'] = f'任务 {resumed_job_id} 已在运行或无需续跑'
+                return {'error': screening_update_status['message']}
+            job = db.get(BatchUpdateJob, job_id)
+            params = job_params(job)
+            fetch_workers = fetch_workers or params.get('workers')
+            rate = rate or params.get('rate')
+            if fresh_hours is None:
+                fresh_hours = params.get('fresh_hours')
+        else:
+            # 获取基金列表
+            fund_list = fund_list_cache.fund_list
+            
+            # 按类型筛选
+            if fund_types:
+                fund_list = [f for f in fund_list if any(t in f.get('TYPE', '') for t in fund_types)]
+            
+            # 限制数量
+            if limit:
+                fund_list = fund_list[:limit]
+            
+            if fresh_hours is None:
+                fresh_hours = BATCH_FRESH_HOURS
+            job = create_job(db, [(f.get('CODE', ''), f.get('TYPE', '')) for f in fund_list], fund_types, {
+                'limit': limit, 'workers': fetch_workers, 'rate': rate, 'fresh_hours': fresh_hours,
+            })
+            job_id = job.id
+        screening_update_status['job_id'] = job_id
+        heartbeat = JobHeartbeat(SessionLocal, job_id)
+        heartbeat.start()
         
-        # 限制数量
-        if limit:
-            fund_list = fund_list[:limit]
+        # 检查点：已成功 / 已跳过的基金不再处理，最近已更新过的基金记为跳过
+        checkpoint = JobCheckpoint(db, job)
+        funds = checkpoint.pending()
+        fresh = set(fresh_fund_codes(db, [code for code, _ in funds], fresh_hours))
+        if fresh:
+            checkpoint.record(db, [(code, 'skipped', 'fresh') for code, _ in funds if code in fresh])
+            db.commit()
+            funds = [item for item in funds if item[0] not in fresh]
+        print(f"[批量更新] 任务 {job_id}: 共 {job.total} 只，已处理 {checkpoint.processed - len(fresh)} 只，"
+              f"跳过最近已更新 {len(fresh)} 只，本次处理 {len(funds)} 只")
         
-        screening_update_status['total'] = len(fund_list)
-        screening_update_status['progress'] = 0
-        screening_update_status['success_count'] = 0
-        screening_update_status['fail_count'] = 0
+        screening_update_status['total'] = job.total
+        screening_update_status['progress'] = checkpoint.processed
+        screening_update_status['success_count'] = checkpoint.counts['success']
+        screening_update_status['fail_count'] = checkpoint.counts['failed']
+        screening_update_status['skipped_count'] = checkpoint.counts['skipped']
         
-        db = SessionLocal()
+        names = {f.get('CODE', ''): f.get('NAME', '') for f in fund_list_cache.fund_list}
+        retried = {code for code, _ in funds if checkpoint.status.get(code) == 'failed'}
         
-        for i, fund in enumerate(fund_list):
-            # 检查停止标志
-            if screening_stop_flag:
-                screening_update_status['message'] = f"已手动停止。成功: {screening_update_status['success_count']}, 失败: {screening_update_status['fail_count']}"
-                break
-            
-            fund_code = fund.get('CODE', '')
-            screening_update_status['progress'] = i + 1
-            screening_update_status['current_fund'] = f"{fund_code} - {fund.get('NAME', '')}"
-            screening_update_status['message'] = f"正在处理: {screening_update_status['current_fund']}"
-            
-            if update_single_fund_data(fund_code, db):
-                screening_update_status['success_count'] += 1
+        def on_progress(fund_code, ok):
+            # 写库阶段每提交一批后逐只回调（单线程）；此前失败、本次重试的基金不重复计入进度
+            if fund_code in retried:
+                screening_update_status['fail_count'] -= 1
             else:
-                screening_update_status['fail_count'] += 1
-            
-            # 每10只基金提交一次
-            if (i + 1) % 10 == 0:
-                db.commit()
-            
-            # 添加延迟，避免请求过于频繁
-            time.sleep(0.3)
+                screening_update_status['progress'] += 1
+            screening_update_status['success_count' if ok else 'fail_count'] += 1
+            screening_update_status['current_fund'] = f"{fund_code} - {names.get(fund_code, '')}"
+            screening_update_status['message'] = f"正在处理: {screening_update_status['current_fund']}"
         
-        db.commit()
+        screening_pipeline = BatchUpdatePipeline(
+            save_fund=lambda db, fund_code, fund_data: _store_fund_update(db, fund_code, fund_data, commit=False),
+            session_factory=SessionLocal,
+            fetch_workers=fetch_workers or DEFAULT_FETCH_WORKERS,
+            parse_workers=DEFAULT_PARSE_WORKERS,
+            rate=rate or DEFAULT_RATE_LIMIT,
+            fund_api=fund_api,
+            should_stop=lambda: screening_stop_flag,
+            on_progress=on_progress,
+            checkpoint=checkpoint,
+        )
+        result = screening_pipeline.run(funds)
+        print(f"[批量更新] 完成 {result['success']} 只，失败 {result['fail']} 只，耗时 {result['elapsed']} 秒")
+        for stage in result['stages']:
+            print(f"[批量更新] {stage['name']}: {stage['processed']} 只，{stage['throughput']} 只/秒，"
+                  f"平均 {stage['avg_ms']} ms，利用率 {stage['utilization']}")
         
-        if not screening_stop_flag:
+        if screening_stop_flag:
+            screening_update_status['message'] = f"已手动停止。成功: {screening_update_status['success_count']}, 失败: {screening_update_status['fail_count']}"
+            finish_job(db, job_id, 'stopped', screening_update_status['message'])
+        else:
             # 计算同类型排名
             screening_update_status['message'] = '正在计算同类型排名...'
             calculate_same_type_rankings(db)
+            # 本轮更新了大量基金的风险指标，重建同类指标分布与策略成员位图
+            metric_distributions.build(db)
+            strategy_membership.build(db)
+            screening_update_status['message'] = '正在重建相似基金索引...'
+            rebuild_similarity_index(db)
             screening_update_status['message'] = f"更新完成！成功: {screening_update_status['success_count']}, 失败: {screening_update_status['fail_count']}"
-        
-        db.close()
+            finish_job(db, job_id, 'completed', screening_update_status['message'])
         
     except Exception as e:
         screening_update_status['message'] = f"更新失败: {str(e)}"
+        if job_id:
+            db.rollback()
+            finish_job(db, job_id, 'failed', screening_update_status['message'])
     finally:
+        if heartbeat is not None:
+            heartbeat.stop()
+        db.close()
         screening_update_status['running'] = False
     
     return {
         'success': True,
+        'job_id': job_id,
         'total': screening_update_status['total'],
         'success_count': screening_update_status['success_count'],
         'fail_count': screening_update_status['fail_count']
     }
 
 
-@app.route('/api/screening/status', methods=['GET'])
-def get_screening_status():
-    """获取筛选数据库状态"""
-    db = get_db()
-    
-    # 统计各表数量
-    basic_count = db.query(FundBasicInfo).count()
-    risk_count = db.query(FundRiskMetrics).filter(
-        FundRiskMetrics.sharpe_ratio_1y.isnot(None)
-    ).count()
-    rank_count = db.query(FundScreeningRank).count()
-    pass_4433_count = db.query(FundScreeningRank).filter(
-        FundScreeningRank.pass_4433 == 1
-    ).count()
-    
-    # 获取最新更新时间
-    latest = db.query(FundBasicInfo).order_by(
-        desc(FundBasicInfo.updated_time)
-    ).first()
-    latest_update = latest.updated_time.isoformat() if latest and latest.updated_time else None
-    
-    # 获取各类型数量
-    type_counts = {}
-    types = db.query(FundBasicInfo.fund_type, func.count(FundBasicInfo.fund_code)).group_by(
+def _fund_table_counts(db):
+    """基金数据各表的计数与类型分布（状态、统计接口共用，由 stats_cache 按数据版本缓存）"""
+    latest = db.query(func.max(FundBasicInfo.updated_time)).scalar()
+    type_counts = db.query(FundBasicInfo.fund_type, func.count(FundBasicInfo.fund_code)).group_by(
         FundBasicInfo.fund_type
     ).all()
-    for t, c in types:
-        if t:
-            type_counts[t] = c
+    return {
+        'basic_count': db.query(FundBasicInfo).count(),
+        'trend_count': db.query(FundTrend).count(),
+        'risk_metrics_count': db.query(FundRiskMetrics).filter(
+            FundRiskMetrics.sharpe_ratio_1y.isnot(None)
+        ).count(),
+        'ranking_count': db.query(FundScreeningRank).count(),
+        'pass_4433_count': db.query(FundScreeningRank).filter(
+            FundScreeningRank.pass_4433 == 1
+        ).count(),
+        'latest_update': latest.isoformat() if latest else None,
+        'type_counts': {t: c for t, c in type_counts if t},
+    }
+
+
+@app.route('/api/screening/status', methods=['GET'])
+def get_screening_status():
+    """
+    获取筛选数据库状态
+    前端在批量更新期间轮询该接口：计数来自 stats_cache，不会每次轮询都扫表
+    """
+    counts = stats_cache.get('fund_tables', lambda: _fund_table_counts(get_db()))
     
     return jsonify({
-        'basic_count': basic_count,
-        'risk_metrics_count': risk_count,
-        'ranking_count': rank_count,
-        'pass_4433_count': pass_4433_count,
-        'latest_update': latest_update,
-        'type_counts': type_counts,
+        'basic_count': counts['basic_count'],
+        'risk_metrics_count': counts['risk_metrics_count'],
+        'ranking_count': counts['ranking_count'],
+        'pass_4433_count': counts['pass_4433_count'],
+        'latest_update': counts['latest_update'],
+        'type_counts': counts['type_counts'],
         'update_status': {
             'running': screening_update_status['running'],
             'progress': screening_update_status['progress'],
             'total': screening_update_status['total'],
             'current_fund': screening_update_status['current_fund'],
-            'message': screening_update_status['message']
+            'message': screening_update_status['message'],
+            'job_id': screening_update_status['job_id'],
+            'success_count': screening_update_status['success_count'],
+            'fail_count': screening_update_status['fail_count'],
+            'skipped_count': screening_update_status['skipped_count'],
+            # 流水线各阶段的处理数与吞吐量（抓取 / 解析 / 写库）
+            'stages': screening_pipeline.stage_stats() if screening_pipeline else []
         }
     })
 
@@ -1594,6 +1811,9 @@ def start_screening_update():
     data = request.get_json() or {}
     fund_types = data.get('fund_types', ['混合型-偏股', '混合型-灵活', '股票型'])
     limit = data.get('limit')  # 可选：限制更新数量（测试用）
+    fetch_workers = data.get('workers')  # 可选：抓取线程数
+    rate = data.get('rate')  # 可选：每秒最多请求的基金数
+    fresh_hours = data.get('fresh_hours')  # 可选：跳过最近多少小时内已更新的基金（0 表示不跳过）
     
     if screening_update_status['running']:
         return jsonify({
@@ -1604,7 +1824,7 @@ def start_screening_update():
     # 在后台线程执行更新
     thread = threading.Thread(
         target=batch_update_fund_data, 
-        args=(fund_types, limit)
+        args=(fund_types, limit, fetch_workers, rate, fresh_hours)
     )
     thread.daemon = True
     thread.start()
@@ -1616,6 +1836,60 @@ def start_screening_update():
     })
 
 
+@app.route('/api/screening/jobs', methods=['GET'])
+def list_update_jobs():
+    """最近的批量更新任务"""
+    db = get_db()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    jobs = db.query(BatchUpdateJob).order_by(desc(BatchUpdateJob.id)).limit(limit).all()
+    return jsonify({'jobs': [job_to_dict(job) for job in jobs]})
+
+
+@app.route('/api/screening/jobs/<int:job_id>', methods=['GET'])
+def get_update_job(job_id):
+    """批量更新任务详情（含失败基金及原因）"""
+    db = get_db()
+    job = db.get(BatchUpdateJob, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_to_dict(job, db))
+
+
+@app.route('/api/screening/jobs/<int:job_id>/resume', methods=['POST'])
+def resume_update_job(job_id):
+    """从检查点续跑批量更新任务：跳过已成功的基金，重试失败的基金"""
+    data = request.get_json(silent=True) or {}
+    db = get_db()
+    job = db.get(BatchUpdateJob, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if screening_update_status['running']:
+        return jsonify({
+            'error': '更新任务正在进行中',
+            'status': screening_update_status
+        }), 409
+    if job.status == 'running':
+        # 所属进程已退出（心跳过期）的任务先标记为中断；心跳新鲜的任务正由其他进程运行，不能续跑
+        recover_interrupted_jobs(db)
+        db.refresh(job)
+    if not is_resumable(job):
+        return jsonify({'error': f'任务状态为 {job.status}，无需续跑'}), 400
+    
+    thread = threading.Thread(
+        target=batch_update_fund_data,
+        args=(None, None, data.get('workers'), data.get('rate'), data.get('fresh_hours'), job_id)
+    )
+    thread.daemon = True
+    thread.start()
+    
+    return jsonify({
+        'message': '任务已继续',
+        'job_id': job_id,
+        'remaining': job.total - (job.success_count or 0) - (job.skipped_count or 0)
+    })
+
+
 @app.route('/api/screening/stop', methods=['POST'])
 def stop_screening_update():
     """停止基金数据更新"""
@@ -1631,14 +1905,14 @@ def recalculate_rankings():
     try:
         calculate_same_type_rankings(db)
         
-        # 统计结果
+        # 统计结果（宽表中 pass_4433 非空即有排名记录）
         stats = db.query(
-            FundBasicInfo.fund_type,
-            func.count(FundScreeningRank.fund_code).label('total'),
-            func.sum(FundScreeningRank.pass_4433).label('pass_count')
-        ).join(
-            FundScreeningRank, FundBasicInfo.fund_code == FundScreeningRank.fund_code
-        ).group_by(FundBasicInfo.fund_type).all()
+            FundScreeningFlat.fund_type,
+            func.count(FundScreeningFlat.pass_4433).label('total'),
+            func.sum(FundScreeningFlat.pass_4433).label('pass_count')
+        ).filter(
+            FundScreeningFlat.pass_4433.isnot(None)
+        ).group_by(FundScreeningFlat.fund_type).all()
         
         type_stats = {}
         for fund_type, total, pass_count in stats:
@@ -1661,6 +1935,264 @@ def recalculate_rankings():
         }), 500
 
 
+# 筛选宽表中可排序的字段（每个字段在宽表上都有 (字段, fund_code) 复合索引）
+SCREENING_SORT_FIELDS = {name: getattr(FundScreeningFlat, name) for name in SCREENING_SORT_COLUMNS}
+
+SCREENING_PERIODS = ['1m', '3m', '6m', '1y', '2y', '3y']
+
+
+def _apply_screening_filters(query, strategy, filters, ignore_quick_type=False):
+    """
+    在筛选宽表查询上应用预设策略和自定义筛选条件
+    ignore_quick_type: 忽略快速类型筛选（用于统计可选类型）
+    """
+    F = FundScreeningFlat
+    
+    # 应用预设策略（由策略注册表编译为 SQL 条件，未知策略不筛选）
+    preset = get_strategy(strategy)
+    if preset:
+        query = query.filter(*preset.sql_filters(F))
+    
+    # 应用自定义类型筛选
+    if filters.get('fund_types'):
+        type_conditions = []
+        for t in filters['fund_types']:
+            type_conditions.append(F.fund_type.like(f'%{t}%'))
+        if type_conditions:
+            query = query.filter(or_(*type_conditions))
+    
+    # 快速类型筛选（精确匹配）
+    if filters.get('quick_fund_type') and not ignore_quick_type:
+        query = query.filter(F.fund_type == filters['quick_fund_type'])
+    
+    # 风险指标、相对基准指标、收益率与排名的区间筛选
+    query = query.filter(*[condition.to_sql(F) for condition in range_conditions(filters)])
+    
+    return query
+
+
+def _nonzero_return(value):
+    """收益率为 0 通常是成立时间不足导致的缺失数据，展示为空"""
+    return value if value else None
+
+
+def _screening_row_dict(row):
+    """筛选结果行转为接口返回（及导出）的字段"""
+    return {
+        'fund_code': row.fund_code,
+        'fund_name': row.fund_name,
+        'fund_type': row.fund_type,
+        # 业绩数据
+        'return_1m': row.return_1m,
+        'return_3m': row.return_3m,
+        'return_6m': row.return_6m,
+        'return_1y': _nonzero_return(row.return_1y),
+        'return_3y': _nonzero_return(row.return_3y),
+        # 风险指标
+        'max_drawdown_1y': row.max_drawdown_1y,
+        'max_drawdown_3y': row.max_drawdown_3y,
+        'volatility_1y': row.volatility_1y,
+        'volatility_3y': row.volatility_3y,
+        'sharpe_ratio_1y': row.sharpe_ratio_1y,
+        'sharpe_ratio_3y': row.sharpe_ratio_3y,
+        'calmar_ratio_1y': row.calmar_ratio_1y,
+        'calmar_ratio_3y': row.calmar_ratio_3y,
+        # 相对基准指标
+        'alpha_1y': row.alpha_1y,
+        'beta_1y': row.beta_1y,
+        'information_ratio_1y': row.information_ratio_1y,
+        'sortino_ratio_1y': row.sortino_ratio_1y,
+        # 排名数据
+        'rank_pct_1m': row.rank_pct_1m,
+        'rank_pct_3m': row.rank_pct_3m,
+        'rank_pct_6m': row.rank_pct_6m,
+        'rank_pct_1y': row.rank_pct_1y,
+        'pass_4433': row.pass_4433 == 1,
+        # 时间戳
+        'updated_time': row.updated_time.isoformat() if row.updated_time else None
+    }
+
+
+# 近似计数模式下最多扫描的行数
+APPROX_COUNT_LIMIT = 1000
+screening_count_cache = get_count_cache()
+
+
+def _encode_cursor(sort_by, sort_order, row):
+    """将当前页最后一行的 (排序值, fund_code) 编码为不透明的游标"""
+    value = getattr(row, sort_by)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort_by, sort_order, value, row.fund_code], ensure_ascii=False)
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor, sort_by, sort_order):
+    """解析游标，排序方式与游标不一致或格式错误时返回 None"""
+    try:
+        cursor_sort_by, cursor_order, value, fund_code = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        )
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if cursor_sort_by != sort_by or cursor_order != sort_order:
+        return None
+    if sort_by == 'updated_time' and value is not None:
+        value = datetime.fromisoformat(value)
+    return value, fund_code
+
+
+def _keyset_page(query, sort_column, sort_order, after, limit):
+    """
+    游标分页：按 (sort_column, fund_code) 取 after 之后的 limit 行
+    SQLite 降序时 NULL 排在最后、升序时排在最前，因此把结果分为非空段和 NULL 段分别查询，
+    每段都是 (列, fund_code) 复合索引上的范围查找，翻到多深耗时都不变
+    """
+    code = FundScreeningFlat.fund_code
+    if sort_order == 'desc':
+        segments = ['value', 'null']
+        order = (desc(sort_column), desc(code))
+    else:
+        segments = ['null', 'value']
+        order = (asc(sort_column), asc(code))
+    
+    rows = []
+    for segment in segments:
+        if len(rows) >= limit:
+            break
+        if segment == 'value':
+            segment_query = query.filter(sort_column.isnot(None))
+        else:
+            segment_query = query.filter(sort_column.is_(None))
+        
+        if after is not None:
+            value, fund_code = after
+            if segment == 'value' and value is not None:
+                key = tuple_(sort_column, code)
+                segment_query = segment_query.filter(key < (value, fund_code) if sort_order == 'desc'
+                                                     else key > (value, fund_code))
+            elif segment == 'null' and value is None:
+                segment_query = segment_query.filter(code < fund_code if sort_order == 'desc'
+                                                     else code > fund_code)
+            elif segments.index(segment) < segments.index('null' if value is None else 'value'):
+                # 游标所在段之前的段已全部返回
+                continue
+        
+        rows.extend(segment_query.order_by(*order).limit(limit - len(rows)).all())
+    return rows
+
+
+def _count_screening(query, filter_hash, count_mode):
+    """
+    计算筛选结果总数
+    exact: 精确计数（按筛选条件和数据版本缓存）
+    approx: 有缓存时返回精确值，否则最多数 APPROX_COUNT_LIMIT 行
+    none: 不计数
+    返回 (总数, 是否为近似值)
+    """
+    if count_mode == 'none':
+        return None, False
+    
+    version = get_screening_version()
+    cached = screening_count_cache.get(filter_hash, version)
+    if cached is not None:
+        return cached, False
+    
+    if count_mode == 'approx':
+        capped = query.with_entities(FundScreeningFlat.id).limit(APPROX_COUNT_LIMIT + 1).count()
+        if capped <= APPROX_COUNT_LIMIT:
+            screening_count_cache.put(filter_hash, version, capped)
+            return capped, False
+        return APPROX_COUNT_LIMIT, True
+    
+    total = query.count()
+    screening_count_cache.put(filter_hash, version, total)
+    return total, False
+
+
+def _query_screening_sql(db, strategy, filters, sort_column, sort_order, after, page, page_size, count_mode):
+    """
+    SQL 筛选查询（内存引擎关闭时使用）
+    返回 (当前页的行（多取一行用于判断是否还有下一页）, 总数, 总数是否为近似值)
+    """
+    query = _apply_screening_filters(db.query(FundScreeningFlat), strategy, filters)
+    
+    # 计算总数（按筛选条件哈希 + 数据版本缓存）
+    filter_hash = hashlib.blake2b(
+        json.dumps({'strategy': strategy, 'filters': filters}, sort_keys=True, ensure_ascii=False).encode('utf-8'),
+        digest_size=16
+    ).hexdigest()
+    total_count, total_is_approx = _count_screening(query, filter_hash, count_mode)
+    
+    # 分页：优先使用游标（keyset），未提供游标时兼容 OFFSET 分页
+    if after is not None or page <= 1:
+        results = _keyset_page(query, sort_column, sort_order, after, page_size + 1)
+    else:
+        if sort_order == 'desc':
+            query = query.order_by(desc(sort_column), desc(FundScreeningFlat.fund_code))
+        else:
+            query = query.order_by(asc(sort_column), asc(FundScreeningFlat.fund_code))
+        offset = (page - 1) * page_size
+        results = query.offset(offset).limit(page_size + 1).all()
+    return results, total_count, total_is_approx
+
+
+def _screening_facets_sql(db, strategy, filters):
+    """SQL 分面计数（内存引擎关闭时使用），口径与 ScreeningEngine._facets 一致"""
+    F = FundScreeningFlat
+    type_rows = _apply_screening_filters(
+        db.query(F.fund_type, func.count()), strategy, filters, ignore_quick_type=True
+    ).filter(F.fund_type.isnot(None), F.fund_type != '').group_by(F.fund_type).all()
+    
+    flag_counts = dict(_apply_screening_filters(
+        db.query(F.pass_4433, func.count()), strategy, filters
+    ).group_by(F.pass_4433).all())
+    
+    histograms = {}
+    for name, boundaries in FACET_HISTOGRAMS.items():
+        column = getattr(F, name)
+        bucket = case(*[(column < edge, i) for i, edge in enumerate(boundaries)], else_=len(boundaries))
+        bucket_counts = dict(_apply_screening_filters(
+            db.query(bucket, func.count()), strategy, filters
+        ).filter(column.isnot(None)).group_by(bucket).all())
+        histograms[name] = histogram_buckets(
+            boundaries, [bucket_counts.get(i, 0) for i in range(len(boundaries) + 1)]
+        )
+    
+    return {
+        'fund_types': {fund_type: count for fund_type, count in sorted(type_rows)},
+        'pass_4433': {
+            'pass': flag_counts.get(1, 0),
+            'fail': flag_counts.get(0, 0),
+            'unranked': flag_counts.get(None, 0),
+        },
+        'histograms': histograms,
+    }
+
+
+@app.route('/api/screening/recalculate-risk', methods=['POST'])
+def recalculate_risk():
+    """批量重新计算所有基金的风险指标"""
+    data = request.get_json() or {}
+    workers = data.get('workers', 1)
+    db = get_db()
+    try:
+        start = time.time()
+        count = recalculate_all_risk_metrics(db, workers=workers)
+        return jsonify({
+            'success': True,
+            'message': '风险指标计算完成',
+            'count': count,
+            'elapsed': round(time.time() - start, 2)
+        })
+    except Exception as e:
+        db.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 @app.route('/api/screening/available-types', methods=['POST'])
 def get_available_fund_types():
     """获取符合当前筛选条件的所有基金类型（用于快速筛选）"""
@@ -1670,47 +2202,20 @@ def get_available_fund_types():
     
     db = get_db()
     
-    # 基础查询
-    query = db.query(FundBasicInfo.fund_type).distinct()
+    # 只有预设策略时直接查策略成员位图
+    if not any(value not in (None, '', []) for key, value in filters.items() if key != 'quick_fund_type'):
+        strategy_membership.ensure_fresh(db)
+        return jsonify({'types': strategy_membership.fund_types(strategy)})
     
-    # 关联排名表（用于4433筛选）
-    if strategy == '4433':
-        query = query.join(
-            FundScreeningRank, FundBasicInfo.fund_code == FundScreeningRank.fund_code
-        ).filter(FundScreeningRank.pass_4433 == 1)
+    if SCREENING_ENGINE_ENABLED:
+        screening_engine.ensure_fresh(db)
+        return jsonify({'types': screening_engine.fund_types(strategy, filters)})
     
-    # 关联风险指标表（用于其他策略）
-    if strategy in ['high_sharpe', 'low_volatility', 'anti_fragile']:
-        query = query.join(
-            FundRiskMetrics, FundBasicInfo.fund_code == FundRiskMetrics.fund_code
-        )
-        
-        if strategy == 'high_sharpe':
-            query = query.filter(
-                FundRiskMetrics.sharpe_ratio_1y > 2,
-                FundRiskMetrics.volatility_1y < 25
-            )
-        elif strategy == 'low_volatility':
-            query = query.filter(
-                FundRiskMetrics.volatility_1y < 15,
-                FundRiskMetrics.max_drawdown_1y < 15
-            )
-        elif strategy == 'anti_fragile':
-            query = query.filter(
-                FundRiskMetrics.max_drawdown_1y < 20,
-                FundRiskMetrics.annual_return_1y > 0
-            )
-    
-    # 应用自定义类型筛选
-    if filters.get('fund_types'):
-        type_conditions = []
-        for t in filters['fund_types']:
-            type_conditions.append(FundBasicInfo.fund_type.like(f'%{t}%'))
-        if type_conditions:
-            query = query.filter(or_(*type_conditions))
+    query = db.query(FundScreeningFlat.fund_type).distinct()
+    query = _apply_screening_filters(query, strategy, filters, ignore_quick_type=True)
     
     # 获取所有符合条件的类型
-    result = query.filter(FundBasicInfo.fund_type != None).all()
+    result = query.filter(FundScreeningFlat.fund_type != None).all()
     types = sorted([r[0] for r in result if r[0]])
     
     return jsonify({'types': types})
@@ -1719,8 +2224,9 @@ def get_available_fund_types():
 @app.route('/api/screening/query', methods=['POST'])
 def query_screening_funds():
     """
-    高级基金筛选查询（使用 JOIN 关联查询）
-    数据来源：FundBasicInfo + FundRiskMetrics + FundScreeningRank
+    高级基金筛选查询
+    数据来源：FundScreeningFlat（收益率、风险指标、同类排名均为带索引的列）
+    默认由内存列式引擎（screening_engine）求值，关闭时直接查询 SQLite
     """
     data = request.get_json() or {}
     
@@ -1735,250 +2241,209 @@ def query_screening_funds():
     page = data.get('page', 1)
     page_size = data.get('page_size', 20)
     
+    # 游标分页与计数方式（exact / approx / none）
+    cursor = data.get('cursor')
+    count_mode = data.get('count_mode', 'exact')
+    
     # 预设策略
     strategy = data.get('strategy')
     
-    db = get_db()
+    # 是否同时返回分面计数（类型 / 4433 / 指标直方图）
+    with_facets = bool(data.get('facets'))
     
-    # 基础查询：JOIN 三个表
-    query = db.query(
-        FundBasicInfo,
-        FundRiskMetrics,
-        FundScreeningRank
-    ).outerjoin(
-        FundRiskMetrics, FundBasicInfo.fund_code == FundRiskMetrics.fund_code
-    ).outerjoin(
-        FundScreeningRank, FundBasicInfo.fund_code == FundScreeningRank.fund_code
-    )
-    
-    # 应用预设策略
-    if strategy == '4433':
-        query = query.filter(FundScreeningRank.pass_4433 == 1)
-    
-    elif strategy == 'high_sharpe':
-        query = query.filter(
-            FundRiskMetrics.sharpe_ratio_1y > 2,
-            FundRiskMetrics.volatility_1y < 25
-        )
-    
-    elif strategy == 'low_volatility':
-        query = query.filter(
-            FundRiskMetrics.volatility_1y < 15,
-            FundRiskMetrics.max_drawdown_1y < 15
-        )
+    db = get_db()
     
-    elif strategy == 'anti_fragile':
-        query = query.filter(
-            FundRiskMetrics.max_drawdown_1y < 20,
-            FundRiskMetrics.annual_return_1y > 0
+    # 排序（fund_code 作为第二排序键，与复合索引一致，保证分页稳定）
+    if sort_by not in SCREENING_SORT_FIELDS:
+        sort_by = 'sharpe_ratio_1y'
+    sort_order = 'asc' if sort_order == 'asc' else 'desc'
+    sort_column = SCREENING_SORT_FIELDS[sort_by]
+    after = _decode_cursor(cursor, sort_by, sort_order) if cursor else None
+    
+    if SCREENING_ENGINE_ENABLED:
+        # 内存列式引擎：掩码筛选 + partition 取页，总数总是精确的
+        screening_engine.ensure_fresh(db)
+        offset = 0 if after is not None else (max(page, 1) - 1) * page_size
+        results, total_count, facets = screening_engine.query(
+            strategy, filters, sort_by, sort_order, after, offset, page_size + 1, facets=with_facets
         )
-    
-    # 应用自定义筛选条件
-    if filters.get('fund_types'):
-        type_conditions = []
-        for t in filters['fund_types']:
-            type_conditions.append(FundBasicInfo.fund_type.like(f'%{t}%'))
-        if type_conditions:
-            query = query.filter(or_(*type_conditions))
-    
-    # 快速类型筛选（精确匹配）
-    if filters.get('quick_fund_type'):
-        query = query.filter(FundBasicInfo.fund_type == filters['quick_fund_type'])
-    
-    # 风险指标筛选
-    if filters.get('sharpe_min') is not None:
-        query = query.filter(FundRiskMetrics.sharpe_ratio_1y >= filters['sharpe_min'])
-    
-    if filters.get('volatility_max') is not None:
-        query = query.filter(FundRiskMetrics.volatility_1y <= filters['volatility_max'])
-    
-    if filters.get('max_drawdown_max') is not None:
-        query = query.filter(FundRiskMetrics.max_drawdown_1y <= filters['max_drawdown_max'])
-    
-    if filters.get('calmar_min') is not None:
-        query = query.filter(FundRiskMetrics.calmar_ratio_1y >= filters['calmar_min'])
-    
-    # 排名筛选
-    if filters.get('rank_1y_max') is not None:
-        query = query.filter(FundScreeningRank.rank_pct_1y <= filters['rank_1y_max'])
-    if filters.get('rank_3m_max') is not None:
-        query = query.filter(FundScreeningRank.rank_pct_3m <= filters['rank_3m_max'])
-    
-    # 排序（根据排序字段选择对应的表）
-    sort_map = {
-        'sharpe_ratio_1y': FundRiskMetrics.sharpe_ratio_1y,
-        'sharpe_ratio_3y': FundRiskMetrics.sharpe_ratio_3y,
-        'return_1y': FundBasicInfo.return_1y,
-        'volatility_1y': FundRiskMetrics.volatility_1y,
-        'max_drawdown_1y': FundRiskMetrics.max_drawdown_1y,
-        'calmar_ratio_1y': FundRiskMetrics.calmar_ratio_1y,
-        'rank_pct_1y': FundScreeningRank.rank_pct_1y,
-        'rank_pct_3m': FundScreeningRank.rank_pct_3m,
-        'fund_name': FundBasicInfo.fund_name,
-        'updated_time': FundBasicInfo.updated_time,
-    }
-    
-    sort_column = sort_map.get(sort_by, FundRiskMetrics.sharpe_ratio_1y)
-    if sort_order == 'desc':
-        query = query.order_by(desc(sort_column))
+        total_is_approx = False
+        if count_mode == 'none':
+            total_count = None
     else:
-        query = query.order_by(asc(sort_column))
-    
-    # 计算总数
-    total_count = query.count()
+        results, total_count, total_is_approx = _query_screening_sql(
+            db, strategy, filters, sort_column, sort_order, after, page, page_size, count_mode
+        )
+        facets = _screening_facets_sql(db, strategy, filters) if with_facets else None
     
-    # 分页
-    offset = (page - 1) * page_size
-    results = query.offset(offset).limit(page_size).all()
+    has_more = len(results) > page_size
+    results = results[:page_size]
+    next_cursor = _encode_cursor(sort_by, sort_order, results[-1]) if has_more else None
     
-    # 构建返回数据
-    fund_list = []
-    
-    # 脏数据自动清理标记（不立即清理，而是返回NULL，防止展示离谱数据）
-    # 如果用户需要修复，可以点击“更新数据”
-    for basic, risk, rank in results:
-        # 解析业绩数据
-        perf = _json_loads(basic.performance_json, {}) if basic else {}
-        
-        # 脏数据检测：如果波动率 > 1000%，视为无效数据
-        is_dirty_risk = risk and risk.volatility_1y and risk.volatility_1y > 1000
-        
-        fund_list.append({
-            'fund_code': basic.fund_code if basic else None,
-            'fund_name': basic.fund_name if basic else None,
-            'fund_type': basic.fund_type if basic else None,
-            # 业绩数据（来自 FundBasicInfo.performance_json）
-            'return_1m': perf.get('1_month_return'),
-            'return_3m': perf.get('3_month_return'),
-            'return_6m': perf.get('6_month_return'),
-            # 如果近1年收益率为 "0.00" 且实际上可能是空数据，则转为 None 或 "--"
-            'return_1y': perf.get('1_year_return') if perf.get('1_year_return') not in ['0.00', 0.0, 0, ''] else None,
-            'return_3y': perf.get('3_year_return') if perf.get('3_year_return') not in ['0.00', 0.0, 0, ''] else None,
-            # 风险指标（来自 FundRiskMetrics），如果脏数据则隐藏
-            'max_drawdown_1y': (risk.max_drawdown_1y if risk else None) if not is_dirty_risk else None,
-            'max_drawdown_3y': (risk.max_drawdown_3y if risk else None) if not is_dirty_risk else None,
-            'volatility_1y': (risk.volatility_1y if risk else None) if not is_dirty_risk else None,
-            'volatility_3y': (risk.volatility_3y if risk else None) if not is_dirty_risk else None,
-            'sharpe_ratio_1y': (risk.sharpe_ratio_1y if risk else None) if not is_dirty_risk else None,
-            'sharpe_ratio_3y': (risk.sharpe_ratio_3y if risk else None) if not is_dirty_risk else None,
-            'calmar_ratio_1y': (risk.calmar_ratio_1y if risk else None) if not is_dirty_risk else None,
-            'calmar_ratio_3y': (risk.calmar_ratio_3y if risk else None) if not is_dirty_risk else None,
-            # 排名数据（来自 FundScreeningRank）
-            'rank_pct_1m': rank.rank_pct_1m if rank else None,
-            'rank_pct_3m': rank.rank_pct_3m if rank else None,
-            'rank_pct_6m': rank.rank_pct_6m if rank else None,
-            'rank_pct_1y': rank.rank_pct_1y if rank else None,
-            'pass_4433': (rank.pass_4433 == 1) if rank else False,
-            # 时间戳
-            'updated_time': basic.updated_time.isoformat() if basic and basic.updated_time else None
-        })
+    # 构建返回数据（脏风险数据在宽表中已置为 NULL）
+    fund_list = [_screening_row_dict(row) for row in results]
     
     return jsonify({
         'total': total_count,
+        'total_is_approx': total_is_approx,
         'page': page,
         'page_size': page_size,
-        'total_pages': math.ceil(total_count / page_size) if total_count > 0 else 0,
-        'data': fund_list
+        'total_pages': math.ceil(total_count / page_size) if total_count else 0,
+        'has_more': has_more,
+        'next_cursor': next_cursor,
+        'data': fund_list,
+        **({'facets': facets} if with_facets else {})
     })
 
 
+@app.route('/api/screening/export', methods=['GET', 'POST'])
+def export_screening_funds():
+    """
+    导出全部筛选结果（不分页）
+    format: csv / ndjson / parquet（parquet 需要安装 pyarrow）
+    筛选条件、预设策略、排序与 /api/screening/query 相同：POST 放在 JSON 中，
+    GET 放在查询参数中（filters 为 JSON 字符串），浏览器可直接用链接下载
+    
+    响应为生成器：按 (排序列, fund_code) 游标每次读取 EXPORT_BATCH_SIZE 行、编码后立即发送，
+    内存占用与结果行数无关；每批是一次独立的短查询，下载较慢时也不会长时间持有数据库读锁
+    """
+    if request.method == 'POST':
+        data = request.get_json() or {}
+    else:
+        data = request.args.to_dict()
+        try:
+            data['filters'] = json.loads(data.get('filters') or '{}')
+        except ValueError:
+            return jsonify({'success': False, 'error': 'filters 不是合法的 JSON'}), 400
+    
+    export_format = (request.args.get('format') or data.get('format') or 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f'不支持的导出格式: {export_format}',
+            'formats': list(EXPORT_FORMATS)
+        }), 400
+    
+    filters = data.get('filters') or {}
+    if not isinstance(filters, dict):
+        return jsonify({'success': False, 'error': 'filters 必须是对象'}), 400
+    strategy = data.get('strategy') or None
+    sort_by = data.get('sort_by', 'sharpe_ratio_1y')
+    if sort_by not in SCREENING_SORT_FIELDS:
+        sort_by = 'sharpe_ratio_1y'
+    sort_order = 'asc' if data.get('sort_order') == 'asc' else 'desc'
+    sort_column = SCREENING_SORT_FIELDS[sort_by]
+    
+    def batches():
+        # 响应体在请求结束后才逐块生成，使用独立的会话而不是请求上下文中的 get_db()
+        db = SessionLocal()
+        try:
+            columns = [getattr(FundScreeningFlat, name) for name in dict.fromkeys(EXPORT_COLUMNS + [sort_by])]
+            query = _apply_screening_filters(db.query(*columns), strategy, filters)
+            after = None
+            while True:
+                rows = _keyset_page(query, sort_column, sort_order, after, EXPORT_BATCH_SIZE)
+                if rows:
+                    yield [_screening_row_dict(row) for row in rows]
+                if len(rows) < EXPORT_BATCH_SIZE:
+                    break
+                after = (getattr(rows[-1], sort_by), rows[-1].fund_code)
+        finally:
+            db.close()
+    
+    content_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"screening_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(
+        encode_export(export_format, batches()),
+        content_type=content_type,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
 @app.route('/api/screening/strategies', methods=['GET'])
 def get_screening_strategies():
-    """获取预设筛选策略列表"""
+    """获取预设筛选策略列表（含当前成员数）"""
+    strategy_membership.ensure_fresh(get_db())
     strategies = [
-        {
-            'id': '4433',
-            'name': '4433法则',
-            'description': '同类型基金中：近1/2/3年排名前25%，近3/6个月排名前33%',
-            'tags': ['经典策略', '同类排名', '业绩稳定']
-        },
-        {
-            'id': 'high_sharpe',
-            'name': '高夏普比率',
-            'description': '夏普比率 > 2，单位风险收益最优',
-            'tags': ['风险调整', '收益优化']
-        },
-        {
-            'id': 'low_volatility',
-            'name': '低波动策略',
-            'description': '波动率 < 15%，最大回撤 < 15%，稳健型',
-            'tags': ['低风险', '稳健']
-        },
-        {
-            'id': 'anti_fragile',
-            'name': '反脆弱策略',
-            'description': '在极端行情中表现稳健的基金',
-            'tags': ['抗跌', '极端行情']
-        },
-        {
-            'id': 'high_calmar',
-            'name': '高卡玛比率',
-            'description': '年化收益/最大回撤比值高，性价比最优',
-            'tags': ['风险调整', '性价比']
-        }
+        {**strategy.to_dict(), 'count': strategy_membership.count(strategy.id)}
+        for strategy in STRATEGIES.values()
     ]
     return jsonify({'strategies': strategies})
 
 
 @app.route('/api/screening/fund/<fund_code>', methods=['GET'])
 def get_screening_fund_detail(fund_code):
-    """获取单只基金的筛选详情数据（JOIN 查询）"""
+    """获取单只基金的筛选详情数据（查询筛选宽表）"""
     db = get_db()
     
-    # JOIN 查询
-    result = db.query(
-        FundBasicInfo,
-        FundRiskMetrics,
-        FundScreeningRank,
-        FundExtraData
-    ).outerjoin(
-        FundRiskMetrics, FundBasicInfo.fund_code == FundRiskMetrics.fund_code
-    ).outerjoin(
-        FundScreeningRank, FundBasicInfo.fund_code == FundScreeningRank.fund_code
-    ).outerjoin(
-        FundExtraData, FundBasicInfo.fund_code == FundExtraData.fund_code
-    ).filter(
-        FundBasicInfo.fund_code == fund_code
+    row = db.query(FundScreeningFlat).filter(
+        FundScreeningFlat.fund_code == fund_code
     ).first()
     
-    if not result:
+    if not row:
         return jsonify({'error': 'Fund not found'}), 404
     
-    basic, risk, rank, extra = result
-    perf = _json_loads(basic.performance_json, {})
-    
     return jsonify({
-        'fund_code': basic.fund_code,
-        'fund_name': basic.fund_name,
-        'fund_type': basic.fund_type,
-        'returns': {
-            '1m': perf.get('1_month_return'),
-            '3m': perf.get('3_month_return'),
-            '6m': perf.get('6_month_return'),
-            '1y': perf.get('1_year_return'),
-            '2y': perf.get('2_year_return'),
-            '3y': perf.get('3_year_return'),
-        },
+        'fund_code': row.fund_code,
+        'fund_name': row.fund_name,
+        'fund_type': row.fund_type,
+        'returns': {p: getattr(row, f'return_{p}') for p in SCREENING_PERIODS},
         'risk_metrics': {
-            'max_drawdown_1y': risk.max_drawdown_1y if risk else None,
-            'max_drawdown_3y': risk.max_drawdown_3y if risk else None,
-            'volatility_1y': risk.volatility_1y if risk else None,
-            'volatility_3y': risk.volatility_3y if risk else None,
-            'sharpe_ratio_1y': risk.sharpe_ratio_1y if risk else None,
-            'sharpe_ratio_3y': risk.sharpe_ratio_3y if risk else None,
-            'calmar_ratio_1y': risk.calmar_ratio_1y if risk else None,
-            'calmar_ratio_3y': risk.calmar_ratio_3y if risk else None
-        },
-        'rankings': {
-            '1m': rank.rank_pct_1m if rank else None,
-            '3m': rank.rank_pct_3m if rank else None,
-            '6m': rank.rank_pct_6m if rank else None,
-            '1y': rank.rank_pct_1y if rank else None,
-            '2y': rank.rank_pct_2y if rank else None,
-            '3y': rank.rank_pct_3y if rank else None,
+            'max_drawdown_1y': row.max_drawdown_1y,
+            'max_drawdown_3y': row.max_drawdown_3y,
+            'volatility_1y': row.volatility_1y,
+            'volatility_3y': row.volatility_3y,
+            'sharpe_ratio_1y': row.sharpe_ratio_1y,
+            'sharpe_ratio_3y': row.sharpe_ratio_3y,
+            'calmar_ratio_1y': row.calmar_ratio_1y,
+            'calmar_ratio_3y': row.calmar_ratio_3y,
+            **{key: getattr(row, key) for key in BENCHMARK_METRIC_KEYS}
         },
-        'pass_4433': (rank.pass_4433 == 1) if rank else False,
-        'updated_time': basic.updated_time.isoformat() if basic.updated_time else None
+        'rankings': {p: getattr(row, f'rank_pct_{p}') for p in SCREENING_PERIODS},
+        'risk_percentiles': _fund_risk_percentiles(db, row),
+        'pass_4433': row.pass_4433 == 1,
+        'strategies': _fund_strategies(db, row.fund_code),
+        'updated_time': row.updated_time.isoformat() if row.updated_time else None
+    })
+
+
+def _fund_strategies(db, fund_code):
+    """基金所属的预设策略（查策略成员位图）"""
+    strategy_membership.ensure_fresh(db)
+    return strategy_membership.fund_strategies(fund_code)
+
+
+def _fund_risk_percentiles(db, row, names=None):
+    """基金各风险指标在同类（fund_type）中的百分位与排名"""
+    if not row.fund_type:
+        return {}
+    metric_distributions.ensure_fresh(db)
+    return metric_distributions.fund_percentiles(
+        row.fund_type, {name: getattr(row, name) for name in DISTRIBUTION_METRICS}, names
+    )
+
+
+@app.route('/api/fund/<fund_code>/percentiles', methods=['GET'])
+def get_fund_risk_percentiles(fund_code):
+    """
+    获取基金风险指标的同类百分位
+    参数: metrics=逗号分隔的指标名（默认全部风险指标）
+    """
+    names = [m.strip() for m in request.args.get('metrics', '').split(',') if m.strip()] or None
+    if names:
+        unknown = [m for m in names if m not in DISTRIBUTION_METRICS]
+        if unknown:
+            return jsonify({'error': f"Unknown metrics: {','.join(unknown)}", 'available': DISTRIBUTION_METRICS}), 400
+    
+    db = get_db()
+    row = db.query(FundScreeningFlat).filter(FundScreeningFlat.fund_code == fund_code).first()
+    if not row:
+        return jsonify({'error': 'Fund not found'}), 404
+    
+    return jsonify({
+        'fund_code': fund_code,
+        'fund_type': row.fund_type,
+        'percentiles': _fund_risk_percentiles(db, row, names)
     })
 
 
@@ -2034,39 +2499,36 @@ def get_fund_data_versions(fund_code):
 
 @app.route('/api/data/stats', methods=['GET'])
 def get_data_stats():
-    """获取数据库统计信息"""
+    """获取数据库统计信息（基金数据计数与状态接口共用缓存，自选基金表很小，直接计数）"""
     db = get_db()
+    counts = stats_cache.get('fund_tables', lambda: _fund_table_counts(db))
     
     stats = {
-        'fund_basic_info': db.query(FundBasicInfo).count(),
-        'fund_trend': db.query(FundTrend).count(),
-        'fund_risk_metrics': db.query(FundRiskMetrics).filter(
-            FundRiskMetrics.sharpe_ratio_1y.isnot(None)
-        ).count(),
-        'fund_screening_rank': db.query(FundScreeningRank).count(),
+        'fund_basic_info': counts['basic_count'],
+        'fund_trend': counts['trend_count'],
+        'fund_risk_metrics': counts['risk_metrics_count'],
+        'fund_screening_rank': counts['ranking_count'],
         'fund_watchlist': db.query(FundWatchlist).count(),
-        'pass_4433_count': db.query(FundScreeningRank).filter(
-            FundScreeningRank.pass_4433 == 1
-        ).count(),
+        'pass_4433_count': counts['pass_4433_count'],
+        # 按类型统计
+        'by_type': counts['type_counts'],
     }
     
-    # 按类型统计
-    type_stats = db.query(
-        FundBasicInfo.fund_type,
-        func.count(FundBasicInfo.fund_code)
-    ).group_by(FundBasicInfo.fund_type).all()
-    
-    stats['by_type'] = {t: c for t, c in type_stats if t}
-    
     return jsonify(stats)
 
 
+@app.route('/api/upstream/status', methods=['GET'])
+def get_upstream_status():
+    """各上游主机的当前请求速率、熔断状态与请求统计"""
+    return jsonify({'hosts': upstream_client.status()})
+
+
 # ==================== 基金回测功能 ====================
 
 @app.route('/api/backtest/fixed-investment', methods=['POST'])
 def backtest_fixed_investment():
     """
-    基金定投回测
+    基金定投回测（按复权净值计算，分红视为再投资）
     
     请求参数：
     {
@@ -2138,11 +2600,11 @@ def backtest_fixed_investment():
         if not net_worth_data:
             return jsonify({'error': 'No net worth data available'}), 404
         
-        # 转换日期格式并排序
+        # 转换日期格式并排序（使用复权净值，即分红再投资）
         nav_dict = {}
         for item in net_worth_data:
             date_str = item.get('date')
-            nav = item.get('net_worth')
+            nav = nav_value(item)
             # 修改判断逻辑，允许 net_worth 为 0 (虽然少见) 但不能为空
             if date_str and nav is not None:
                 try:
@@ -2173,14 +2635,11 @@ def backtest_fixed_investment():
         except ValueError as e:
             return jsonify({'error': f'Invalid date format: {str(e)}'}), 400
         
-        filtered_dates = []
-        for d in sorted_dates:
-            try:
-                current_dt = datetime.strptime(d, '%Y-%m-%d')
-                if start_dt <= current_dt <= end_dt:
-                    filtered_dates.append(d)
-            except ValueError:
-                continue
+        # 日期一次性转换为日序号后按区间过滤（格式无法识别的日期为 INVALID_ORDINAL，不在区间内）
+        ordinals = to_ordinals(sorted_dates)
+        in_range = (ordinals >= to_ordinal(start_dt)) & (ordinals <= to_ordinal(end_dt))
+        filtered_dates = [d for d, keep in zip(sorted_dates, in_range.tolist()) if keep]
+        ordinals = ordinals[in_range]
 
         if len(filtered_dates) < 2:
             return jsonify({'error': f'Insufficient data in range {start_date} to {end_date}. Found {len(filtered_dates)} records.'}), 400
@@ -2194,7 +2653,8 @@ def backtest_fixed_investment():
             initial_amount=initial_amount,
             fee_rate=fee_rate,
             take_profit_rate=take_profit_rate,
-            stop_loss_rate=stop_loss_rate
+            stop_loss_rate=stop_loss_rate,
+            ordinals=ordinals
         )
         
         if 'error' in result:
@@ -2208,38 +2668,31 @@ def backtest_fixed_investment():
         return jsonify({'error': f'Backtest execution failed: {str(e)}'}), 500
 
 
-def _run_backtest(nav_dict, dates, investment_type, amount, initial_amount, fee_rate, take_profit_rate=None, stop_loss_rate=None):
+def _run_backtest(nav_dict, dates, investment_type, amount, initial_amount, fee_rate, take_profit_rate=None, stop_loss_rate=None,
+                  ordinals=None):
     """
     执行回测计算
+    ordinals: dates 对应的交易日序号（trading_calendar），未提供时由 dates 转换
     """
+    if ordinals is None:
+        ordinals = to_ordinals(dates)
     timeline = []
     total_invested = 0
     total_shares = 0
     
-    # 确定投资日期
-    investment_dates = []
+    # 确定投资日期（按下标标记，遍历时不再查找列表）
+    investment_days = [False] * len(dates)
     
     if investment_type == 'lump_sum':
         # 一次性投资：只在第一天
-        investment_dates = [dates[0]]
+        investment_days[0] = True
     elif investment_type == 'monthly':
         # 每月定投：每月第一个交易日
-        current_month = None
-        for date in dates:
-            dt = datetime.strptime(date, '%Y-%m-%d')
-            month_key = (dt.year, dt.month)
-            if month_key != current_month:
-                investment_dates.append(date)
-                current_month = month_key
+        investment_days = period_first_mask(ordinals, 'month').tolist()
     elif investment_type == 'weekly':
-        # 每周定投：每周第一个交易日
-        current_week = None
-        for date in dates:
-            dt = datetime.strptime(date, '%Y-%m-%d')
-            week_key = (dt.year, dt.isocalendar()[1])
-            if week_key != current_week:
-                investment_dates.append(date)
-                current_week = week_key
+        # 每周定投：每周第一个交易日（周一开始，跨年的一周只投一次）
+        investment_days = period_first_mask(ordinals, 'week').tolist()
+    investment_count = sum(investment_days)
     
     # 状态标记
     sold_out = False
@@ -2276,7 +2729,7 @@ def _run_backtest(nav_dict, dates, investment_type, amount, initial_amount, fee_
             
         # 2. 处理定投
         is_invest_day = False
-        if investment_type != 'lump_sum' and date in investment_dates:
+        if investment_type != 'lump_sum' and investment_days[i]:
             actual_amount = amount * (1 - fee_rate)
             shares_bought = actual_amount / nav
             total_shares += shares_bought
@@ -2357,9 +2810,7 @@ def _run_backtest(nav_dict, dates, investment_type, amount, initial_amount, fee_
                 max_drawdown = drawdown
     
     # 计算年化收益率
-    start_date = datetime.strptime(timeline[0]['date'], '%Y-%m-%d')
-    end_date = datetime.strptime(timeline[-1]['date'], '%Y-%m-%d')
-    days = (end_date - start_date).days
+    days = int(ordinals[-1] - ordinals[0])
     years = days / 365.25
     
     total_return_rate = final_record['return_rate'] / 100
@@ -2393,7 +2844,7 @@ def _run_backtest(nav_dict, dates, investment_type, amount, initial_amount, fee_
         'annual_return': round(annual_return, 2),
         'max_drawdown': round(-max_drawdown, 2),
         'sharpe_ratio': round(sharpe_ratio, 2),
-        'investment_count': len(investment_dates) + (1 if initial_amount > 0 else 0),
+        'investment_count': investment_count + (1 if initial_amount > 0 else 0),
         'days': days,
         'exit_reason': exit_reason,
         'exit_date': exit_date
@@ -0,0 +1,287 @@
+"""
+批量更新任务的持久化与续跑
+任务记录（BatchUpdateJob）保存基金列表快照、游标与计数，逐只结果（BatchUpdateJobFund）保存成功 / 失败原因 / 跳过。
+流水线每次提交时调用 JobCheckpoint，本批次结果与基金数据在同一事务中写入，
+进程中途退出最多丢失一个提交批次（commit_every 只基金）的进度。
+
+续跑时从游标处开始，跳过已成功或已跳过的基金，失败的基金重新尝试；
+每次开始（或续跑）时，最近 fresh_hours 小时内已更新过的基金直接记为跳过，不再请求上游
+
+运行中的任务记录所属进程（owner，主机名:进程号），updated_time 作为心跳由 JobHeartbeat 定期刷新；
+进程启动时只把心跳过期、或所属进程已退出的 running 任务标记为中断，多进程部署或重复导入时
+不会误判其他进程正在运行的任务。续跑通过条件更新（claim_job）抢占任务，同一任务不会被续跑两次
+"""
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import BatchUpdateJob, BatchUpdateJobFund, FundBasicInfo
+
+# 最近多少小时内更新过的基金视为足够新，批量更新时跳过（0 表示不跳过）
+BATCH_FRESH_HOURS = float(os.getenv('BATCH_FRESH_HOURS', '12'))
+
+# 可以续跑的任务状态（completed 但有失败基金时也可以续跑，只重试失败的基金）
+RESUMABLE_STATUS = ('stopped', 'failed', 'interrupted')
+
+# 运行中任务的心跳间隔，以及心跳超过多少秒未刷新视为所属进程已退出
+BATCH_JOB_HEARTBEAT = float(os.getenv('BATCH_JOB_HEARTBEAT', '30'))
+BATCH_JOB_STALE_SECONDS = float(os.getenv('BATCH_JOB_STALE_SECONDS', '180'))
+
+# 任务详情中最多返回的失败基金数
+MAX_FAILURES_LISTED = 200
+
+# 已处理完、续跑时不再尝试的结果
+_DONE_STATUS = ('success', 'skipped')
+
+
+def job_owner() -> str:
+    """当前进程的任务所属标识（主机名:进程号）"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """
+    任务所属进程是否可能仍在运行（其他主机或无法判断时视为仍在运行，只依赖心跳判断）
+    进程号被其他进程复用时已退出的任务也会被判为仍在运行，此时同样只能等心跳过期后恢复
+    """
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def create_job(db, funds: Sequence[Tuple[str, str]], fund_types: Optional[List[str]], params: dict) -> BatchUpdateJob:
+    """新建任务并保存基金列表快照 [(fund_code, fund_type), ...]"""
+    job = BatchUpdateJob(
+        status='running',
+        owner=job_owner(),
+        fund_types_json=json.dumps(fund_types, ensure_ascii=False),
+        params_json=json.dumps(params, ensure_ascii=False),
+        fund_list_json=json.dumps([list(item) for item in funds], ensure_ascii=False),
+        total=len(funds),
+        message='',
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def job_funds(job: BatchUpdateJob) -> List[Tuple[str, str]]:
+    """任务的基金列表快照"""
+    return [(code, fund_type) for code, fund_type in json.loads(job.fund_list_json or '[]')]
+
+
+def job_params(job: BatchUpdateJob) -> dict:
+    return json.loads(job.params_json or '{}')
+
+
+def is_resumable(job: BatchUpdateJob) -> bool:
+    return job.status in RESUMABLE_STATUS or (job.status == 'completed' and (job.fail_count or 0) > 0)
+
+
+def claim_job(db, job_id: int) -> bool:
+    """续跑前抢占任务：仅当任务仍可续跑时改为 running 并记录所属进程，返回是否抢占成功"""
+    count = db.query(BatchUpdateJob).filter(
+        BatchUpdateJob.id == job_id,
+        or_(BatchUpdateJob.status.in_(RESUMABLE_STATUS),
+            and_(BatchUpdateJob.status == 'completed', BatchUpdateJob.fail_count > 0)),
+    ).update({'status': 'running', 'owner': job_owner(), 'message': '', 'updated_time': datetime.now()},
+             synchronize_session=False)
+    db.commit()
+    return count > 0
+
+
+def fresh_fund_codes(db, fund_codes: Sequence[str], fresh_hours: float) -> List[str]:
+    """fund_codes 中最近 fresh_hours 小时内已更新过的基金"""
+    if not fresh_hours or fresh_hours <= 0 or not fund_codes:
+        return []
+    threshold = datetime.now() - timedelta(hours=fresh_hours)
+    # 基础信息表只有约两万行，取出全部新鲜基金再求交集，避免超长 IN 列表
+    fresh = {code for (code,) in db.query(FundBasicInfo.fund_code).filter(
+        FundBasicInfo.updated_time >= threshold
+    )}
+    return [code for code in fund_codes if code in fresh]
+
+
+def finish_job(db, job_id: int, status: str, message: str = ''):
+    """更新任务最终状态（stopped / completed / failed）"""
+    values = {'status': status, 'message': message[:200], 'updated_time': datetime.now()}
+    if status == 'completed':
+        values['finished_time'] = datetime.now()
+    db.query(BatchUpdateJob).filter(BatchUpdateJob.id == job_id).update(values)
+    db.commit()
+
+
+def recover_interrupted_jobs(db, stale_seconds: float = BATCH_JOB_STALE_SECONDS) -> int:
+    """
+    进程启动时调用：仍为 running、但心跳超过 stale_seconds 秒未刷新或所属进程已退出的任务
+    标记为 interrupted，返回任务数；其他进程正在运行（心跳新鲜）的任务不受影响
+    """
+    threshold = datetime.now() - timedelta(seconds=stale_seconds)
+    running = db.query(BatchUpdateJob.id, BatchUpdateJob.owner, BatchUpdateJob.updated_time).filter(
+        BatchUpdateJob.status == 'running'
+    ).all()
+    dead_owners = {owner for _, owner, _ in running if owner and not _owner_alive(owner)}
+    stale = [job_id for job_id, owner, updated_time in running
+             if updated_time is None or updated_time < threshold or owner in dead_owners]
+    count = 0
+    if stale:
+        # 条件中再次检查心跳，查询之后刚被刷新的任务（所属进程仍存活）不会被改掉
+        count = db.query(BatchUpdateJob).filter(
+            BatchUpdateJob.id.in_(stale), BatchUpdateJob.status == 'running',
+            or_(BatchUpdateJob.updated_time.is_(None), BatchUpdateJob.updated_time < threshold,
+                BatchUpdateJob.owner.in_(dead_owners)),
+        ).update({'status': 'interrupted', 'message': '进程退出，任务中断'}, synchronize_session=False)
+        db.commit()
+    if count:
+        print(f"[批量更新] {count} 个任务在上次退出时中断，可通过 /api/screening/jobs/<id>/resume 续跑")
+    return count
+
+
+def job_to_dict(job: BatchUpdateJob, db=None) -> dict:
+    """任务摘要；传入 db 时附带失败基金列表（最多 MAX_FAILURES_LISTED 条）"""
+    result = {
+        'job_id': job.id,
+        'status': job.status,
+        'fund_types': json.loads(job.fund_types_json or 'null'),
+        'params': job_params(job),
+        'total': job.total,
+        'cursor': job.cursor,
+        'success_count': job.success_count,
+        'fail_count': job.fail_count,
+        'skipped_count': job.skipped_count,
+        'message': job.message,
+        'owner': job.owner,
+        'resumable': is_resumable(job),
+        'created_time': job.created_time.isoformat() if job.created_time else None,
+        'updated_time': job.updated_time.isoformat() if job.updated_time else None,
+        'finished_time': job.finished_time.isoformat() if job.finished_time else None,
+    }
+    if db is not None:
+        failures = db.query(BatchUpdateJobFund).filter(
+            BatchUpdateJobFund.job_id == job.id, BatchUpdateJobFund.status == 'failed'
+        ).order_by(BatchUpdateJobFund.fund_code).limit(MAX_FAILURES_LISTED).all()
+        result['failures'] = [{
+            'fund_code': item.fund_code,
+            'reason': item.reason,
+            'updated_time': item.updated_time.isoformat() if item.updated_time else None,
+        } for item in failures]
+    return result
+
+
+class JobCheckpoint:
+    """
+    单次运行（新建或续跑）的任务检查点
+    内存中维护每只基金的结果、游标与计数；作为流水线的 checkpoint 回调，在写库会话中与基金数据一起提交
+    """
+
+    def __init__(self, db, job: BatchUpdateJob):
+        self.job_id = job.id
+        self.funds = job_funds(job)
+        rows = db.query(BatchUpdateJobFund.fund_code, BatchUpdateJobFund.status).filter(
+            BatchUpdateJobFund.job_id == job.id
+        ).all()
+        self.status: Dict[str, str] = {code: status for code, status in rows}
+        self.counts = {'success': 0, 'failed': 0, 'skipped': 0}
+        for status in self.status.values():
+            self.counts[status] += 1
+        self.cursor = job.cursor or 0
+        self._advance()
+
+    def _advance(self):
+        # 游标只越过已处理完的基金（并发抓取时完成顺序与列表顺序不同）
+        while self.cursor < len(self.funds) and self.status.get(self.funds[self.cursor][0]) in _DONE_STATUS:
+            self.cursor += 1
+
+    @property
+    def processed(self) -> int:
+        return sum(self.counts.values())
+
+    def pending(self) -> List[Tuple[str, str]]:
+        """还需要处理的基金（游标之后、未成功且未跳过的，包括此前失败的）"""
+        return [item for item in self.funds[self.cursor:] if self.status.get(item[0]) not in _DONE_STATUS]
+
+    def record(self, db, rows: List[Tuple[str, str, Optional[str]]]):
+        """写入 [(fund_code, status, reason), ...] 并更新任务游标与计数（不提交）"""
+        if not rows:
+            return
+        now = datetime.now()
+        values = {}
+        for fund_code, status, reason in rows:
+            previous = self.status.get(fund_code)
+            if previous:
+                self.counts[previous] -= 1
+            self.status[fund_code] = status
+            self.counts[status] += 1
+            values[fund_code] = {'job_id': self.job_id, 'fund_code': fund_code, 'status': status,
+                                 'reason': reason[:200] if reason else None, 'updated_time': now}
+        stmt = sqlite_insert(BatchUpdateJobFund)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['job_id', 'fund_code'],
+            set_={key: stmt.excluded[key] for key in ('status', 'reason', 'updated_time')}
+        )
+        db.execute(stmt, list(values.values()))
+        self._advance()
+        db.query(BatchUpdateJob).filter(BatchUpdateJob.id == self.job_id).update({
+            'cursor': self.cursor,
+            'success_count': self.counts['success'],
+            'fail_count': self.counts['failed'],
+            'skipped_count': self.counts['skipped'],
+            'updated_time': now,
+        })
+
+    def __call__(self, db, results: List[Tuple[str, bool, Optional[str]]]):
+        """流水线检查点回调：results 为 [(fund_code, ok, reason), ...]"""
+        self.record(db, [(code, 'success' if ok else 'failed', reason) for code, ok, reason in results])
+
+
+class JobHeartbeat:
+    """
+    运行中任务的心跳：后台线程每 interval 秒刷新一次 updated_time（独立会话），
+    抓取长时间等待或排名、索引重建等阶段没有检查点提交时，任务也不会被其他进程判为中断
+    """
+
+    def __init__(self, session_factory, job_id: int, interval: float = BATCH_JOB_HEARTBEAT):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _beat(self):
+        db = self.session_factory()
+        try:
+            db.query(BatchUpdateJob).filter(
+                BatchUpdateJob.id == self.job_id, BatchUpdateJob.status == 'running'
+            ).update({'updated_time': datetime.now()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[批量更新] 任务 {self.job_id} 心跳刷新失败: {e}")
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._beat()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'batch-job-heartbeat-{self.job_id}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
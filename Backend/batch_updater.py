@@ -0,0 +1,350 @@
+"""
+批量更新流水线
+把逐只串行的「请求 → 解析 → 写库 → sleep」拆成三个并行阶段，阶段之间用有界队列连接：
+
+    抓取（fetch_workers 个线程，共用令牌桶限流）
+        → 解析清洗（parse_workers 个进程，JS 文本解析与数据清洗是纯 CPU 计算）
+        → 写库（单线程、单会话，每 commit_every 只基金提交一次）
+
+队列有界，下游变慢时上游自动阻塞（背压），内存中最多只有 queue_size 份原始响应；
+请求频率由令牌桶控制，不再在每只基金后固定 sleep；令牌桶是本次任务的速率上限，
+实际发往各上游主机的速率还受 upstream 的 AIMD 限流约束，上游熔断时抓取线程暂停等待恢复后重试，
+不会把剩余基金全部计为失败；每只基金最多等待重试 unavailable_retries 次，上游持续不可用超过
+max_unavailable_wait 秒后不再等待，剩余基金直接计为失败（可通过任务续跑重试）。
+每个阶段分别统计处理数、失败数、忙碌时间与吞吐量（StageStats），运行中可随时读取
+
+写库回调 save_fund(db, fund_code, fund_data) 由调用方提供（app.py 中保存各表与增量风险指标），
+流水线本身不依赖 Flask。
+可选的检查点回调 checkpoint(db, results) 在每次提交前调用，与基金数据在同一事务中写入本批次
+每只基金的结果 [(fund_code, ok, reason), ...]（batch_jobs 用它持久化任务进度，中断后可续跑）
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from fund_api import FundAPI, parse_fund_payloads
+from rate_limiter import TokenBucket
+from upstream import UpstreamUnavailable
+
+# 默认配置（可通过环境变量调整，单次更新也可在 /api/screening/update 请求中指定 workers、rate）
+DEFAULT_FETCH_WORKERS = int(os.getenv('BATCH_FETCH_WORKERS', '8'))
+DEFAULT_PARSE_WORKERS = int(os.getenv('BATCH_PARSE_WORKERS', '2'))
+# 每秒最多开始抓取的基金数（每只基金两个请求：详细数据 + 实时估值），
+# 上游实际承受的速率由 upstream 的自适应限流决定，这里只是单次任务的上限
+DEFAULT_RATE_LIMIT = float(os.getenv('BATCH_RATE_LIMIT', '20'))
+# 上游熔断时单只基金最多等待重试的次数，以及上游持续不可用多少秒后不再等待
+DEFAULT_UNAVAILABLE_RETRIES = int(os.getenv('BATCH_UNAVAILABLE_RETRIES', '3'))
+DEFAULT_UNAVAILABLE_WAIT = float(os.getenv('BATCH_UNAVAILABLE_WAIT', '600'))
+
+# 队列结束标记
+_DONE = object()
+
+
+class StageStats:
+    """单个阶段的计数与耗时（各工作线程共用，加锁累加）"""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        # 各工作线程实际处理的时间之和（不含等待上游/下游队列的时间）
+        self.busy = 0.0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool = True):
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter() - seconds
+            self.processed += 1
+            if not ok:
+                self.failed += 1
+            self.busy += seconds
+
+    def finish(self):
+        with self._lock:
+            self.finished = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            end = self.finished or time.perf_counter()
+            elapsed = end - self.started if self.started is not None else 0.0
+            return {
+                'name': self.name,
+                'workers': self.workers,
+                'processed': self.processed,
+                'failed': self.failed,
+                # 阶段吞吐量：处理数 / 阶段运行时长
+                'throughput': round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+                # 平均单只耗时与工作线程利用率（接近 1 表示该阶段是瓶颈）
+                'avg_ms': round(self.busy / self.processed * 1000, 1) if self.processed else 0.0,
+                'utilization': round(self.busy / (elapsed * self.workers), 2) if elapsed > 0 else 0.0,
+            }
+
+
+class BatchUpdatePipeline:
+    """
+    三阶段批量更新流水线
+    save_fund: 写库回调 (db, fund_code, fund_data) -> bool
+    session_factory: 创建写库会话（写库阶段独占一个会话）
+    parse_workers: 解析进程数，0 表示在解析线程内直接解析（不创建进程池）
+    rate: 每秒最多开始抓取的基金数（令牌桶速率），burst 为允许的突发量
+    checkpoint: 提交前回调 (db, [(fund_code, ok, reason), ...])，写入的内容与本批次基金数据一起提交
+    unavailable_retries / max_unavailable_wait: 上游熔断时单只基金的最多重试次数 / 持续不可用的最长等待秒数
+    """
+
+    def __init__(self, save_fund: Callable, session_factory: Callable,
+                 fetch_workers: int = 8, parse_workers: int = 2, rate: float = 5.0,
+                 burst: Optional[float] = None, commit_every: int = 20, queue_size: int = 64,
+                 fund_api: Optional[FundAPI] = None,
+                 should_stop: Optional[Callable[[], bool]] = None,
+                 on_progress: Optional[Callable[[str, bool], None]] = None,
+                 checkpoint: Optional[Callable[[object, List[Tuple[str, bool, Optional[str]]]], None]] = None,
+                 unavailable_retries: int = DEFAULT_UNAVAILABLE_RETRIES,
+                 max_unavailable_wait: float = DEFAULT_UNAVAILABLE_WAIT):
+        self.save_fund = save_fund
+        self.session_factory = session_factory
+        self.fetch_workers = max(1, int(fetch_workers))
+        self.parse_workers = max(0, int(parse_workers))
+        self.limiter = TokenBucket(rate, burst)
+        self.commit_every = max(1, int(commit_every))
+        self.queue_size = max(1, int(queue_size))
+        self.fund_api = fund_api or FundAPI()
+        self.should_stop = should_stop or (lambda: False)
+        self.on_progress = on_progress
+        self.checkpoint = checkpoint
+        self.unavailable_retries = max(0, int(unavailable_retries))
+        self.max_unavailable_wait = float(max_unavailable_wait)
+        # 各基金因上游熔断已重试的次数，以及本次连续不可用的开始时间（任一基金抓取成功后清空）
+        self._unavailable_attempts: Dict[str, int] = {}
+        self._unavailable_since: Optional[float] = None
+        self._unavailable_lock = threading.Lock()
+        self._aborted = False
+        self.stats = {
+            'fetch': StageStats('fetch', self.fetch_workers),
+            'parse': StageStats('parse', max(1, self.parse_workers)),
+            'write': StageStats('write', 1),
+        }
+
+    def stage_stats(self) -> List[dict]:
+        """各阶段当前的统计（运行中可调用）"""
+        return [stats.to_dict() for stats in self.stats.values()]
+
+    def _fetch_worker(self, funds: 'queue.Queue', parse_queue: 'queue.Queue', write_queue: 'queue.Queue'):
+        # 每个抓取线程一个 Session，复用到上游的连接
+        session = requests.Session()
+        try:
+            while not self._aborted and not self.should_stop():
+                try:
+                    fund_code, fund_type = funds.get_nowait()
+                except queue.Empty:
+                    return
+                self.limiter.acquire()
+                start = time.perf_counter()
+                try:
+                    payloads = self.fund_api.fetch_payloads(fund_code, session=session)
+                except UpstreamUnavailable as e:
+                    if not self._should_retry_unavailable(fund_code):
+                        # 超过重试次数或上游长时间不可用：计为失败，不再等待
+                        self.stats['fetch'].record(time.perf_counter() - start, False)
+                        write_queue.put((fund_code, None, f'upstream unavailable: {e.reason}'))
+                        continue
+                    # 上游熔断：等到可以探测时重试这只基金
+                    self._wait(max(e.retry_after, 1.0))
+                    funds.put((fund_code, fund_type))
+                    continue
+                self._unavailable_since = None
+                self.stats['fetch'].record(time.perf_counter() - start, payloads is not None)
+                if payloads is None:
+                    # 抓取失败直接交给写库阶段计为失败，保证进度计数完整
+                    write_queue.put((fund_code, None, 'fetch failed'))
+                else:
+                    parse_queue.put((fund_code, fund_type, payloads))
+        finally:
+            session.close()
+
+    def _should_retry_unavailable(self, fund_code: str) -> bool:
+        """上游熔断时这只基金是否继续等待重试（同时累计重试次数与连续不可用时长）"""
+        with self._unavailable_lock:
+            now = time.monotonic()
+            if self._unavailable_since is None:
+                self._unavailable_since = now
+            attempts = self._unavailable_attempts.get(fund_code, 0) + 1
+            self._unavailable_attempts[fund_code] = attempts
+            return (attempts <= self.unavailable_retries
+                    and now - self._unavailable_since < self.max_unavailable_wait)
+
+    def _wait(self, seconds: float):
+        """分段 sleep，期间可被停止 / 中止打断"""
+        deadline = time.monotonic() + seconds
+        while not self._aborted and not self.should_stop():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(0.5, remaining))
+
+    def _parse_worker(self, pool: Optional[ProcessPoolExecutor], parse_queue: 'queue.Queue',
+                      write_queue: 'queue.Queue'):
+        while True:
+            item = parse_queue.get()
+            if item is _DONE:
+                return
+            fund_code, fund_type, (detail_text, realtime_text) = item
+            start = time.perf_counter()
+            reason = None
+            try:
+                if pool is not None:
+                    fund_data = pool.submit(parse_fund_payloads, fund_code, detail_text,
+                                            realtime_text, fund_type).result()
+                else:
+                    fund_data = parse_fund_payloads(fund_code, detail_text, realtime_text, fund_type)
+                if not fund_data:
+                    reason = 'no data'
+            except Exception as e:
+                print(f"Error parsing data for {fund_code}: {e}")
+                fund_data = None
+                reason = f'parse error: {e}'
+            self.stats['parse'].record(time.perf_counter() - start, fund_data is not None)
+            write_queue.put((fund_code, fund_data, reason))
+
+    def _replay(self, db, items: List[Tuple[str, dict]]) -> Tuple[List[Tuple[str, dict]], Dict[str, str]]:
+        """回滚后重新写入本批次中此前已成功的基金，返回 (重放成功的部分, {重放失败的基金: 原因})"""
+        dropped: Dict[str, str] = {}
+        while True:
+            for i, (fund_code, fund_data) in enumerate(items):
+                try:
+                    self.save_fund(db, fund_code, fund_data)
+                except Exception as e:
+                    print(f"Error replaying data for {fund_code}: {e}")
+                    db.rollback()
+                    dropped[fund_code] = f'save error: {e}'
+                    items = items[:i] + items[i + 1:]
+                    break
+            else:
+                return items, dropped
+
+    def _commit(self, db, results: List[Tuple[str, bool, Optional[str]]]) -> Tuple[int, int]:
+        """
+        提交本批次（检查点与基金数据在同一事务中），提交成功后才对本批次每只基金回调 on_progress，
+        重放时被丢弃的基金已在 results 中改为失败，进度计数与数据库一致；返回本批次 (成功数, 失败数)
+        """
+        if self.checkpoint and results:
+            self.checkpoint(db, results)
+        db.commit()
+        success = 0
+        for fund_code, ok, _ in results:
+            success += ok
+            if self.on_progress:
+                self.on_progress(fund_code, ok)
+        return success, len(results) - success
+
+    def _write(self, write_queue: 'queue.Queue') -> Tuple[int, int]:
+        """写库阶段（在 run() 的调用线程中执行），返回 (成功数, 失败数)"""
+        success = fail = 0
+        # 上次提交之后已写入会话、尚未提交的基金，以及本批次每只基金的结果（提交时交给检查点）
+        pending: List[Tuple[str, dict]] = []
+        results: List[Tuple[str, bool, Optional[str]]] = []
+        db = self.session_factory()
+        try:
+            while True:
+                item = write_queue.get()
+                if item is _DONE:
+                    break
+                fund_code, fund_data, reason = item
+                start = time.perf_counter()
+                ok = False
+                if fund_data:
+                    try:
+                        ok = bool(self.save_fund(db, fund_code, fund_data))
+                        reason = None if ok else 'save failed'
+                    except Exception as e:
+                        print(f"Error updating data for {fund_code}: {e}")
+                        reason = f'save error: {e}'
+                        # 回滚会一并丢弃本批次中此前写入的基金，逐只重放
+                        db.rollback()
+                        pending, dropped = self._replay(db, pending)
+                        if dropped:
+                            results = [(result[0], False, dropped[result[0]]) if result[0] in dropped else result
+                                       for result in results]
+                    if ok:
+                        pending.append((fund_code, fund_data))
+                results.append((fund_code, ok, reason))
+                if len(results) >= self.commit_every:
+                    committed = self._commit(db, results)
+                    success, fail = success + committed[0], fail + committed[1]
+                    pending, results = [], []
+                self.stats['write'].record(time.perf_counter() - start, ok)
+            committed = self._commit(db, results)
+            success, fail = success + committed[0], fail + committed[1]
+        finally:
+            db.close()
+        return success, fail
+
+    def run(self, funds: Iterable[Tuple[str, str]]) -> Dict:
+        """
+        更新基金 [(fund_code, fund_type), ...]，阻塞到全部完成或 should_stop() 为真，
+        返回 {'success', 'fail', 'elapsed', 'stages'}
+        """
+        start = time.perf_counter()
+        fund_queue: 'queue.Queue' = queue.Queue()
+        for item in funds:
+            fund_queue.put(item)
+        parse_queue: 'queue.Queue' = queue.Queue(maxsize=self.queue_size)
+        write_queue: 'queue.Queue' = queue.Queue(maxsize=self.queue_size)
+
+        pool = ProcessPoolExecutor(max_workers=self.parse_workers) if self.parse_workers else None
+        fetchers = [threading.Thread(target=self._fetch_worker, args=(fund_queue, parse_queue, write_queue),
+                                     name=f'batch-fetch-{i}', daemon=True)
+                    for i in range(self.fetch_workers)]
+        parsers = [threading.Thread(target=self._parse_worker, args=(pool, parse_queue, write_queue),
+                                    name=f'batch-parse-{i}', daemon=True)
+                   for i in range(max(1, self.parse_workers))]
+
+        def close_stages():
+            # 上游全部结束后向下游发送结束标记
+            for thread in fetchers:
+                thread.join()
+            self.stats['fetch'].finish()
+            for _ in parsers:
+                parse_queue.put(_DONE)
+            for thread in parsers:
+                thread.join()
+            self.stats['parse'].finish()
+            write_queue.put(_DONE)
+
+        closer = threading.Thread(target=close_stages, name='batch-close', daemon=True)
+        self._aborted = False
+        self._unavailable_attempts, self._unavailable_since = {}, None
+        for thread in fetchers + parsers:
+            thread.start()
+        closer.start()
+        try:
+            success, fail = self._write(write_queue)
+            self.stats['write'].finish()
+        except BaseException:
+            # 写库失败：停止抓取，并清空写库队列让上游线程退出
+            self._aborted = True
+            while closer.is_alive():
+                try:
+                    write_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            closer.join()
+            if pool is not None:
+                pool.shutdown()
+
+        return {
+            'success': success,
+            'fail': fail,
+            'elapsed': round(time.perf_counter() - start, 2),
+            'stages': self.stage_stats(),
+        }
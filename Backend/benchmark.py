@@ -0,0 +1,839 @@
+"""
+性能基准测试脚本
+用法: python benchmark.py <command>
+"""
+import json
+import math
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from analytics_service import SimilarityIndex, calculate_correlation
+from database import DATABASE_PATH
+from json_codec import compress_json_text, decompress_json_text
+from risk_engine import (calculate_risk_metrics, calculate_risk_metrics_batch,
+                         calculate_rolling_metrics, prepare_series)
+from risk_state import build_risk_state, update_risk_state
+from trading_calendar import TradingCalendar, period_first_mask, to_ordinals
+
+
+def _timeit(func, repeat=5):
+    """多次执行取最快耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def make_net_worth_trend(length, seed=0, end_date=None):
+    """生成模拟的净值走势数据（格式与 FundDataCleaner 输出一致）"""
+    rng = random.Random(seed)
+    end_date = end_date or datetime.now()
+    nav = 1.0
+    trend = []
+    day = end_date - timedelta(days=int(length * 7 / 5))
+    while len(trend) < length:
+        day += timedelta(days=1)
+        if day.weekday() >= 5:
+            continue
+        change = rng.gauss(0.0004, 0.012)
+        nav = max(nav * (1 + change), 0.01)
+        trend.append({
+            'date': day.strftime('%Y-%m-%d'),
+            'net_worth': round(nav, 4),
+            'equity_return': round(change * 100, 2),
+            'dividend': None
+        })
+    return trend
+
+
+def _load_blob_samples(limit):
+    """从数据库读取 JSON 大字段样本，数据库为空时使用模拟数据"""
+    samples = []
+    if os.path.exists(DATABASE_PATH):
+        conn = sqlite3.connect(DATABASE_PATH)
+        try:
+            cursor = conn.execute(
+                "SELECT net_worth_trend_json, ranking_trend_json, total_return_trend_json "
+                "FROM fund_trend LIMIT ?", (limit,)
+            )
+            for row in cursor.fetchall():
+                samples.extend(decompress_json_text(v) for v in row if v)
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+    if not samples:
+        print("数据库中没有走势数据，使用模拟数据")
+        samples = [
+            json.dumps(make_net_worth_trend(length, seed=i), ensure_ascii=False)
+            for i, length in enumerate([250, 750, 1500, 3000] * (limit // 4 or 1))
+        ]
+    return samples
+
+
+def bench_blob_compression(limit=200):
+    """JSON 大字段压缩：存储大小、压缩耗时、解压耗时与 json.loads 耗时对比"""
+    samples = _load_blob_samples(limit)
+    raw = [s.encode('utf-8') for s in samples]
+    packed = [compress_json_text(s) for s in samples]
+
+    raw_size = sum(len(b) for b in raw)
+    packed_size = sum(len(b) for b in packed)
+    compress_time = _timeit(lambda: [compress_json_text(s) for s in samples], repeat=3)
+    decompress_time = _timeit(lambda: [decompress_json_text(b) for b in packed])
+    parse_time = _timeit(lambda: [json.loads(s) for s in samples])
+
+    n = len(samples)
+    print("=" * 60)
+    print(f"JSON 大字段压缩基准（{n} 个字段）")
+    print("=" * 60)
+    print(f"原始大小:   {raw_size / 1024:.1f} KB")
+    print(f"压缩后大小: {packed_size / 1024:.1f} KB ({packed_size / raw_size * 100:.1f}%)")
+    print(f"压缩耗时:   {compress_time / n * 1e6:.1f} us/字段")
+    print(f"解压耗时:   {decompress_time / n * 1e6:.1f} us/字段")
+    print(f"json.loads: {parse_time / n * 1e6:.1f} us/字段（对比参考）")
+
+
+def _python_risk_metrics(net_worth_trend, now):
+    """逐点循环的风险指标计算（risk_engine 向量化之前的实现，作为基准与结果对照）"""
+    if not net_worth_trend or len(net_worth_trend) < 30:
+        return None
+    
+    # 按日期排序
+    sorted_data = sorted(net_worth_trend, key=lambda x: x.get('date', ''))
+    
+    # 转换为净值数组和日期数组
+    dates = []
+    values = []
+    for item in sorted_data:
+        if item.get('net_worth') is not None:
+            dates.append(item.get('date'))
+            values.append(float(item.get('net_worth')))
+    
+    # 过滤首日异常数据（如面值1.0与实际净值100+差异巨大）
+    # 这种情况会导致波动率和回撤计算极其离谱
+    if len(values) >= 2:
+        v0 = values[0]
+        v1 = values[1]
+        if v0 > 0 and abs((v1 - v0) / v0) > 0.5:
+            values.pop(0)
+            dates.pop(0)
+    
+    if len(values) < 30:
+        return None
+    
+    def get_period_data(months):
+        """获取指定时间段的数据"""
+        if months == 'all':
+            return values, dates
+        
+        cutoff_date = (now - timedelta(days=months * 30)).strftime('%Y-%m-%d')
+        period_values = []
+        period_dates = []
+        for i, d in enumerate(dates):
+            if d >= cutoff_date:
+                period_values.append(values[i])
+                period_dates.append(d)
+        return period_values, period_dates
+    
+    def calc_max_drawdown(period_values):
+        """计算最大回撤"""
+        if len(period_values) < 2:
+            return None
+        
+        peak = period_values[0]
+        max_dd = 0
+        
+        for value in period_values:
+            if value > peak:
+                peak = value
+            drawdown = (peak - value) / peak * 100
+            if drawdown > max_dd:
+                max_dd = drawdown
+        
+        return round(max_dd, 2)
+    
+    def calc_daily_returns(period_values):
+        """计算日收益率序列"""
+        if len(period_values) < 2:
+            return []
+        returns = []
+        for i in range(1, len(period_values)):
+            if period_values[i-1] != 0:
+                ret = (period_values[i] - period_values[i-1]) / period_values[i-1]
+                returns.append(ret)
+        return returns
+    
+    def calc_annual_return(period_values, trading_days):
+        """计算年化收益率"""
+        if len(period_values) < 2 or period_values[0] == 0:
+            return None
+        total_return = (period_values[-1] - period_values[0]) / period_values[0]
+        if trading_days <= 0:
+            return None
+        annual_return = ((1 + total_return) ** (252 / trading_days) - 1) * 100
+        return round(annual_return, 2)
+    
+    def calc_volatility(daily_returns):
+        """计算年化波动率"""
+        if len(daily_returns) < 10:
+            return None
+        mean_return = sum(daily_returns) / len(daily_returns)
+        variance = sum((r - mean_return) ** 2 for r in daily_returns) / len(daily_returns)
+        daily_vol = math.sqrt(variance)
+        annual_vol = daily_vol * math.sqrt(252) * 100
+        return round(annual_vol, 2)
+    
+    def calc_sharpe_ratio(annual_return, volatility, risk_free_rate=2.0):
+        """计算夏普比率，假设无风险利率为2%"""
+        if volatility is None or volatility == 0 or annual_return is None:
+            return None
+        sharpe = (annual_return - risk_free_rate) / volatility
+        return round(sharpe, 2)
+    
+    result = {}
+    
+    # 计算不同时间段的最大回撤
+    for period, months in [('3m', 3), ('6m', 6), ('1y', 12), ('3y', 36), ('all', 'all')]:
+        period_values, _ = get_period_data(months)
+        result[f'max_drawdown_{period}'] = calc_max_drawdown(period_values)
+    
+    # 计算1年和3年的年化收益率、波动率、夏普比率
+    # 重要：对于数据不足的周期，不计算指标（返回None），避免年化放大产生误导性数据
+    min_trading_days = {
+        '1y': 200,  # 至少200个交易日才计算1年期指标（约10个月）
+        '3y': 600,  # 至少600个交易日才计算3年期指标（约2.5年）
+    }
+    
+    for period, months in [('1y', 12), ('3y', 36)]:
+        period_values, period_dates = get_period_data(months)
+        trading_days = len(period_values)
+        
+        # 检查数据是否充足
+        min_days = min_trading_days.get(period, 30)
+        if trading_days < min_days:
+            # 数据不足，不计算该周期的指标
+            result[f'annual_return_{period}'] = None
+            result[f'volatility_{period}'] = None
+            result[f'sharpe_ratio_{period}'] = None
+            result[f'calmar_ratio_{period}'] = None
+            continue
+        
+        daily_returns = calc_daily_returns(period_values)
+        annual_return = calc_annual_return(period_values, trading_days)
+        volatility = calc_volatility(daily_returns)
+        sharpe = calc_sharpe_ratio(annual_return, volatility)
+        
+        # 额外检查：如果波动率异常大（>500%），说明数据有问题，放弃该计算结果
+        if volatility is not None and volatility > 500:
+            result[f'annual_return_{period}'] = None
+            result[f'volatility_{period}'] = None
+            result[f'sharpe_ratio_{period}'] = None
+            result[f'calmar_ratio_{period}'] = None
+            continue
+        
+        result[f'annual_return_{period}'] = annual_return
+        result[f'volatility_{period}'] = volatility
+        result[f'sharpe_ratio_{period}'] = sharpe
+        
+        # 计算卡玛比率
+        max_dd = result.get(f'max_drawdown_{period}')
+        if annual_return is not None and max_dd is not None and max_dd > 0:
+            result[f'calmar_ratio_{period}'] = round(annual_return / max_dd, 2)
+        else:
+            result[f'calmar_ratio_{period}'] = None
+    
+    return result
+
+
+def bench_risk_metrics():
+    """风险指标计算：逐点循环实现 vs NumPy 向量化实现"""
+    now = datetime.now()
+    print("=" * 60)
+    print("风险指标计算基准")
+    print("=" * 60)
+    print(f"{'序列长度':>8}  {'循环实现':>12}  {'向量化':>12}  {'加速比':>8}  {'最大差异':>8}")
+    for length in [250, 750, 2500, 5000, 20000]:
+        trends = [make_net_worth_trend(length, seed=i, end_date=now) for i in range(20)]
+        loop_time = _timeit(lambda: [_python_risk_metrics(t, now) for t in trends], repeat=3)
+        numpy_time = _timeit(lambda: [calculate_risk_metrics(t, now) for t in trends], repeat=3)
+
+        max_diff = 0.0
+        for t in trends:
+            expected = _python_risk_metrics(t, now)
+            actual = calculate_risk_metrics(t, now)
+            for key, value in expected.items():
+                if value is None or actual[key] is None:
+                    if value != actual[key]:
+                        max_diff = float('inf')
+                    continue
+                max_diff = max(max_diff, abs(value - actual[key]))
+
+        n = len(trends)
+        print(f"{length:>8}  {loop_time / n * 1000:>10.3f}ms  {numpy_time / n * 1000:>10.3f}ms  "
+              f"{loop_time / numpy_time:>7.1f}x  {max_diff:>8.2f}")
+
+
+def bench_risk_batch(fund_count=3000):
+    """全市场风险指标重算：逐只计算 vs 批量矩阵计算（含 JSON 解压解析）"""
+    now = datetime.now()
+    rng = random.Random(42)
+    trends = {
+        f'{i:06d}': compress_json_text(json.dumps(
+            make_net_worth_trend(rng.choice([250, 750, 1500, 3000]), seed=i, end_date=now), ensure_ascii=False
+        ))
+        for i in range(fund_count)
+    }
+    workers = os.cpu_count() or 1
+
+    def per_fund():
+        return {code: calculate_risk_metrics(json.loads(decompress_json_text(blob)), now)
+                for code, blob in trends.items()}
+
+    loop_time = _timeit(per_fund, repeat=1)
+    batch_time = _timeit(lambda: calculate_risk_metrics_batch(trends, now), repeat=1)
+    pool_time = _timeit(lambda: calculate_risk_metrics_batch(trends, now, workers=workers), repeat=1)
+
+    print("=" * 60)
+    print(f"全市场风险指标重算基准（{fund_count} 只基金）")
+    print("=" * 60)
+    print(f"逐只计算:          {loop_time:.2f} 秒")
+    print(f"批量矩阵计算:      {batch_time:.2f} 秒")
+    print(f"批量 + {workers} 进程:     {pool_time:.2f} 秒")
+
+
+def bench_risk_incremental(fund_count=1000):
+    """每日刷新：全量重算 vs 基于运行状态的增量更新（含状态 JSON 读写）"""
+    now = datetime.now()
+    rng = random.Random(7)
+    trends = [make_net_worth_trend(rng.choice([750, 1500, 3000]), seed=i, end_date=now) for i in range(fund_count)]
+    states = [json.dumps(build_risk_state(t[:-1], now - timedelta(days=1))[1]) for t in trends]
+
+    full_time = _timeit(lambda: [calculate_risk_metrics(t, now) for t in trends], repeat=3)
+    incremental_time = _timeit(lambda: [
+        json.dumps(update_risk_state(t, json.loads(s), now)[1]) for t, s in zip(trends, states)
+    ], repeat=3)
+
+    print("=" * 60)
+    print(f"每日风险指标刷新基准（{fund_count} 只基金，各追加 1 个净值点）")
+    print("=" * 60)
+    print(f"全量重算: {full_time * 1000:.1f} ms ({full_time / fund_count * 1e6:.0f} us/只)")
+    print(f"增量更新: {incremental_time * 1000:.1f} ms ({incremental_time / fund_count * 1e6:.0f} us/只)")
+    print(f"加速比:   {full_time / incremental_time:.1f}x")
+
+
+def _naive_rolling_metrics(net_worth_trend, window):
+    """逐窗口重新计算的滚动指标（O(n·w)，作为基准）"""
+    _, values = prepare_series(net_worth_trend)
+    values = values.tolist()
+    vols, drawdowns = [], []
+    for end in range(window - 1, len(values)):
+        segment = values[end - window + 1:end + 1]
+        returns = [(segment[i] - segment[i - 1]) / segment[i - 1] for i in range(1, len(segment))]
+        mean = sum(returns) / len(returns)
+        vols.append(math.sqrt(sum((r - mean) ** 2 for r in returns) / len(returns)) * math.sqrt(252) * 100)
+        peak = max(segment)
+        drawdowns.append((peak - segment[-1]) / peak * 100)
+    return vols, drawdowns
+
+
+def bench_rolling_metrics():
+    """滚动窗口指标：逐窗口重算 vs 累积和 + 单调队列"""
+    print("=" * 60)
+    print("滚动窗口指标基准（window=252，指标: vol/sharpe/drawdown/return）")
+    print("=" * 60)
+    for length in [750, 3000, 6000]:
+        trend = make_net_worth_trend(length, seed=length)
+        naive_time = _timeit(lambda: _naive_rolling_metrics(trend, 252), repeat=1)
+        fast_time = _timeit(lambda: calculate_rolling_metrics(trend, 252))
+        print(f"{length:>6} 点: 逐窗口 {naive_time * 1000:>8.1f} ms, O(n) {fast_time * 1000:>6.2f} ms "
+              f"({naive_time / fast_time:.0f}x)")
+
+
+def bench_correlation():
+    """相关性矩阵 + 聚类：不同基金数量下的耗时（含走势解析）"""
+    print("=" * 60)
+    print("相关性矩阵与层次聚类基准（每只基金 1500 个净值点，回看1年）")
+    print("=" * 60)
+    for fund_count in [10, 50, 100, 200]:
+        trends = {f'{i:06d}': make_net_worth_trend(1500, seed=i) for i in range(fund_count)}
+        elapsed = _timeit(lambda: calculate_correlation(trends), repeat=3)
+        print(f"{fund_count:>4} 只基金: {elapsed * 1000:>7.1f} ms")
+
+
+def bench_similarity(fund_count=10000):
+    """相似基金索引：构建耗时与单次查询耗时（分块矩阵-向量乘法）"""
+    print("=" * 60)
+    print(f"相似基金索引基准（{fund_count} 只基金，每只 400 个净值点）")
+    print("=" * 60)
+    trends = {f'{i:06d}': make_net_worth_trend(400, seed=i) for i in range(fund_count)}
+    index = SimilarityIndex()
+    start = time.perf_counter()
+    size = index.build(trends)
+    print(f"构建索引: {size} 只基金，{time.perf_counter() - start:.2f} 秒")
+    query_time = _timeit(lambda: index.query('000001', 20), repeat=20)
+    print(f"单次查询 top-20: {query_time * 1000:.2f} ms")
+
+
+def bench_trading_calendar(fund_count=500):
+    """日期处理：逐个 strptime / 字符串比较 vs 日序号向量化"""
+    print("=" * 60)
+    print(f"交易日历基准（{fund_count} 只基金，每只 1500 个净值点）")
+    print("=" * 60)
+    date_lists = [[item['date'] for item in make_net_worth_trend(1500, seed=i)] for i in range(fund_count)]
+    dates = date_lists[0]
+
+    def parse_loop():
+        return [datetime.strptime(d, '%Y-%m-%d') for d in dates]
+
+    def weekly_loop():
+        result, current = [], None
+        for d in dates:
+            dt = datetime.strptime(d, '%Y-%m-%d')
+            key = (dt.year, dt.isocalendar()[1])
+            if key != current:
+                result.append(d)
+                current = key
+        return result
+
+    loop_time = _timeit(parse_loop)
+    vector_time = _timeit(lambda: to_ordinals(dates))
+    print(f"日期解析:     strptime {loop_time * 1000:.2f} ms, 向量化 {vector_time * 1000:.3f} ms "
+          f"({loop_time / vector_time:.0f}x)")
+    loop_time = _timeit(weekly_loop)
+    vector_time = _timeit(lambda: period_first_mask(to_ordinals(dates), 'week'))
+    print(f"每周首个交易日: 循环 {loop_time * 1000:.2f} ms, 向量化 {vector_time * 1000:.3f} ms "
+          f"({loop_time / vector_time:.0f}x)")
+
+    string_time = _timeit(lambda: np.unique(np.concatenate([np.array(d) for d in date_lists])), repeat=3)
+    ordinal_time = _timeit(lambda: TradingCalendar.union([to_ordinals(d) for d in date_lists]), repeat=3)
+    print(f"日历并集:     字符串 {string_time * 1000:.1f} ms, 日序号（含解析） {ordinal_time * 1000:.1f} ms")
+
+
+def bench_rankings(fund_count=20000):
+    """同类排名：集合 SQL（窗口函数 + 批量 upsert）耗时，使用内存数据库与随机业绩数据"""
+    from sqlalchemy import create_engine, text
+    from models import Base
+    from screening_table import RANK_SYNC_SQL, RANKING_SQL, REBUILD_SQL
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    rng = random.Random(11)
+    fund_types = ['股票型', '混合型', '债券型', '指数型', 'QDII', 'FOF']
+    keys = ['1_month_return', '3_month_return', '6_month_return', '1_year_return', '2_year_return', '3_year_return']
+    rows = [{
+        'fund_code': f'{i:06d}', 'fund_name': f'基金{i}', 'fund_type': rng.choice(fund_types),
+        'performance_json': json.dumps({key: round(rng.gauss(5, 20), 2) for key in keys if rng.random() > 0.1}),
+    } for i in range(fund_count)]
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO fund_basic_info (fund_code, fund_name, fund_type, performance_json) "
+            "VALUES (:fund_code, :fund_name, :fund_type, :performance_json)"
+        ), rows)
+        conn.execute(text(REBUILD_SQL))
+
+    print("=" * 60)
+    print(f"同类排名重算基准（{fund_count} 只基金，{len(fund_types)} 个类型）")
+    print("=" * 60)
+    for label in ('首次计算', '数据未变化'):
+        with engine.begin() as conn:
+            start = time.perf_counter()
+            conn.execute(text(RANKING_SQL), {'now': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')})
+            rank_time = time.perf_counter() - start
+            changed = conn.execute(text(RANK_SYNC_SQL)).rowcount
+            total_time = time.perf_counter() - start
+        print(f"{label}: 排名 SQL {rank_time * 1000:.0f} ms，写回宽表 {changed} 行，合计 {total_time * 1000:.0f} ms")
+
+    # 单只基金收益小幅变动：只重排其所在类型中名次受影响的基金
+    from sqlalchemy.orm import Session
+    from rank_index import SameTypeRankIndex
+    from screening_table import refresh_screening_fund
+
+    samples = rng.sample(rows, 50)
+    with Session(engine) as db:
+        index = SameTypeRankIndex()
+        start = time.perf_counter()
+        index.build(db)
+        build_time = time.perf_counter() - start
+        timings, written = [], []
+        for row in samples:
+            performance = {key: round(value + rng.uniform(-0.3, 0.3), 2)
+                           for key, value in json.loads(row['performance_json']).items()}
+            db.execute(text("UPDATE fund_basic_info SET performance_json = :performance_json WHERE fund_code = :fund_code"),
+                       {'performance_json': json.dumps(performance), 'fund_code': row['fund_code']})
+            refresh_screening_fund(db, row['fund_code'])
+            start = time.perf_counter()
+            written.append(index.rerank_fund(db, row['fund_code']))
+            timings.append(time.perf_counter() - start)
+            db.commit()
+    print(f"增量排名: 索引构建 {build_time * 1000:.0f} ms，单只更新中位数 {np.median(timings) * 1000:.1f} ms，"
+          f"平均改写 {np.mean(written):.0f} 只基金")
+
+
+def bench_screening_engine(fund_count=20000, repeat=30):
+    """筛选查询：SQLite 宽表查询 vs 内存列式引擎，使用内存数据库与随机指标"""
+    from sqlalchemy import create_engine, desc
+    from sqlalchemy.orm import Session
+    from models import Base, FundScreeningFlat
+    from screening_engine import NUMERIC_COLUMNS, ScreeningEngine
+    from screening_strategies import get_strategy, range_conditions
+
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    rng = random.Random(5)
+    fund_types = ['股票型', '混合型-偏股', '混合型-平衡', '债券型', '指数型', 'QDII']
+    rows = [{
+        'fund_code': f'{i:06d}', 'fund_name': f'基金{i}', 'fund_type': rng.choice(fund_types),
+        'updated_time': datetime(2024, 6, 1) + timedelta(minutes=i),
+        **{name: (None if rng.random() < 0.1 else round(rng.gauss(8, 10), 2)) for name in NUMERIC_COLUMNS},
+    } for i in range(fund_count)]
+    for row in rows:
+        row['pass_4433'] = int(rng.random() < 0.05)
+    with engine.begin() as conn:
+        conn.execute(FundScreeningFlat.__table__.insert(), rows)
+
+    queries = [
+        ('high_sharpe', {'return_1y_min': 0}, 'return_1y'),
+        (None, {'fund_types': ['混合'], 'volatility_max': 15}, 'sharpe_ratio_1y'),
+        ('4433', {}, 'max_drawdown_1y'),
+        (None, {'sharpe_min': 0.5, 'rank_1y_max': 50}, 'fund_name'),
+    ]
+    F = FundScreeningFlat
+
+    def sql_query(db, strategy, filters, sort_by):
+        query = db.query(F)
+        preset = get_strategy(strategy)
+        if preset:
+            query = query.filter(*preset.sql_filters(F))
+        if filters.get('fund_types'):
+            query = query.filter(F.fund_type.like(f"%{filters['fund_types'][0]}%"))
+        query = query.filter(*[condition.to_sql(F) for condition in range_conditions(filters)])
+        total = query.count()
+        page = query.order_by(desc(getattr(F, sort_by)), desc(F.fund_code)).limit(21).all()
+        return page, total
+
+    print("=" * 60)
+    print(f"筛选查询基准（{fund_count} 只基金，每种查询 {repeat} 次）")
+    print("=" * 60)
+    with Session(engine) as db:
+        screening = ScreeningEngine()
+        start = time.perf_counter()
+        screening.build(db)
+        print(f"内存引擎构建: {(time.perf_counter() - start) * 1000:.0f} ms")
+        for strategy, filters, sort_by in queries:
+            sql_times, engine_times = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                sql_page, sql_total = sql_query(db, strategy, filters, sort_by)
+                sql_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                engine_page, engine_total, _ = screening.query(strategy, filters, sort_by, 'desc', None, 0, 21)
+                engine_times.append(time.perf_counter() - start)
+            same = (sql_total == engine_total
+                    and [row.fund_code for row in sql_page] == [row.fund_code for row in engine_page])
+            print(f"{strategy or '-':<12} 排序 {sort_by:<16} 命中 {engine_total:>5}: "
+                  f"SQL {np.median(sql_times) * 1000:6.2f} ms，内存引擎 {np.median(engine_times) * 1000:5.2f} ms，"
+                  f"结果一致: {same}")
+
+
+# 回放用的上游响应目录：<基金代码>.js 为 pingzhongdata 脚本，<基金代码>.rt.js 为实时估值脚本
+REPLAY_DIR = os.getenv('REPLAY_DIR', str(DATABASE_PATH.parent / 'replay'))
+
+
+def make_pingzhong_payload(fund_code, length, seed=0):
+    """生成模拟的 pingzhongdata 脚本与实时估值脚本（变量与真实接口一致）"""
+    rng = random.Random(seed)
+    trend = make_net_worth_trend(length, seed=seed)
+    points = [{
+        'x': int(datetime.strptime(item['date'], '%Y-%m-%d').timestamp() * 1000),
+        'y': item['net_worth'], 'equityReturn': item['equity_return'], 'unitMoney': '',
+    } for item in trend]
+    accumulated = [[point['x'], round(point['y'] + 0.1, 4)] for point in points]
+    variables = {
+        'fS_name': f'"模拟基金{fund_code}"', 'fS_code': f'"{fund_code}"',
+        'fund_sourceRate': '"1.50"', 'fund_Rate': '"0.15"', 'fund_minsg': '"10"', 'ishb': 'false',
+        'syl_1n': f'"{rng.gauss(5, 20):.2f}"', 'syl_6y': f'"{rng.gauss(3, 10):.2f}"',
+        'syl_3y': f'"{rng.gauss(1, 6):.2f}"', 'syl_1y': f'"{rng.gauss(0.5, 3):.2f}"',
+        'stockCodes': json.dumps([f'{600000 + i}1' for i in range(10)]),
+        'Data_netWorthTrend': json.dumps(points),
+        'Data_ACWorthTrend': json.dumps(accumulated),
+        'Data_grandTotal': json.dumps([{'name': '本基金', 'data': [[p['x'], round(p['y'] - 1, 4)] for p in points]}]),
+        'Data_rateInSimilarType': json.dumps([{'x': p['x'], 'y': rng.randint(1, 900), 'sc': '1000'}
+                                              for p in points[::20]]),
+    }
+    detail = ''.join(f'var {name} = {value};' for name, value in variables.items())
+    realtime = 'jsonpgz(' + json.dumps({
+        'fundcode': fund_code, 'name': f'模拟基金{fund_code}', 'jzrq': trend[-1]['date'],
+        'dwjz': str(trend[-1]['net_worth']), 'gsz': str(trend[-1]['net_worth']), 'gszzl': '0.12',
+        'gztime': trend[-1]['date'] + ' 15:00',
+    }, ensure_ascii=False) + ');'
+    return detail, realtime
+
+
+def _load_replay_payloads(fund_count):
+    """读取录制的上游响应（REPLAY_DIR），没有录制数据时生成模拟响应"""
+    payloads = {}
+    if os.path.isdir(REPLAY_DIR):
+        for name in sorted(os.listdir(REPLAY_DIR)):
+            if name.endswith('.js') and not name.endswith('.rt.js'):
+                code = name[:-3]
+                with open(os.path.join(REPLAY_DIR, name), encoding='utf-8') as f:
+                    detail = f.read()
+                realtime_path = os.path.join(REPLAY_DIR, f'{code}.rt.js')
+                realtime = None
+                if os.path.exists(realtime_path):
+                    with open(realtime_path, encoding='utf-8') as f:
+                        realtime = f.read()
+                payloads[code] = (detail, realtime)
+    if payloads:
+        # 录制的基金不足时循环使用，保证基准规模一致
+        recorded = list(payloads.items())
+        return {f'{i:06d}': recorded[i % len(recorded)][1] for i in range(fund_count)}, True
+    return {f'{i:06d}': make_pingzhong_payload(f'{i:06d}', random.Random(i).choice([250, 750, 1500]), seed=i)
+            for i in range(fund_count)}, False
+
+
+def record_upstream_payloads(limit=50):
+    """从真实上游接口录制基金响应到 REPLAY_DIR（需要网络），供 batch-update 回放"""
+    from fund_api import FundAPI
+
+    cache_path = DATABASE_PATH.parent / 'fund_list_cache.json'
+    with open(cache_path, encoding='utf-8') as f:
+        codes = [fund['CODE'] for fund in json.load(f).get('funds', []) if fund.get('CODE')][:limit]
+    os.makedirs(REPLAY_DIR, exist_ok=True)
+    api = FundAPI()
+    recorded = 0
+    for code in codes:
+        payloads = api.fetch_payloads(code)
+        if not payloads or not payloads[0]:
+            continue
+        with open(os.path.join(REPLAY_DIR, f'{code}.js'), 'w', encoding='utf-8') as f:
+            f.write(payloads[0])
+        if payloads[1]:
+            with open(os.path.join(REPLAY_DIR, f'{code}.rt.js'), 'w', encoding='utf-8') as f:
+                f.write(payloads[1])
+        recorded += 1
+        time.sleep(0.3)
+    print(f"已录制 {recorded} 只基金的上游响应到 {REPLAY_DIR}")
+
+
+def _start_replay_server(payloads, latency, capacity=None):
+    """
+    本地替身上游：按录制内容响应 /pingzhongdata/<code>.js 与 /js/<code>.js，每个请求延迟 latency 秒
+    capacity: 上游每秒能承受的请求数，超出的请求立即返回 514（Frequency Capped），None 表示不限流
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from rate_limiter import TokenBucket
+
+    bucket = TokenBucket(capacity, max(1.0, capacity / 4)) if capacity else None
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if bucket is not None and bucket.try_acquire() > 0:
+                self.send_response(514)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(latency)
+            kind, _, name = self.path.strip('/').rpartition('/')
+            detail, realtime = payloads.get(name[:-3], (None, None))
+            body = detail if kind == 'pingzhongdata' else realtime
+            if body is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/javascript; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_batch_update(fund_count=300, serial_count=30, latency=0.08):
+    """
+    批量更新：串行（请求 + 解析 + 写库 + sleep 0.3）vs 三阶段流水线
+    上游为本地替身服务（回放录制的响应，每个请求模拟 latency 秒网络延迟），写入临时数据库
+    """
+    import tempfile
+    from sqlalchemy import create_engine
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from sqlalchemy.orm import sessionmaker
+
+    from batch_updater import BatchUpdatePipeline
+    from fund_api import FundAPI
+    from rate_limiter import AdaptiveRateLimiter
+    from upstream import get_upstream_client
+    from models import Base, FundBasicInfo, FundTrend
+
+    payloads, recorded = _load_replay_payloads(fund_count)
+    server = _start_replay_server(payloads, latency)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    api = FundAPI()
+    api.DETAIL_URL = base_url + '/pingzhongdata/{code}.js'
+    api.REALTIME_URL = base_url + '/js/{code}.js'
+    # 替身上游不限流，放开该主机的自适应限流，只比较流水线本身
+    get_upstream_client().host(base_url).limiter = AdaptiveRateLimiter(200, 1, 200)
+
+    def save_fund(db, fund_code, fund_data):
+        # 与 app._save_fund_data_to_db 相同的两张主表 upsert（JSON 大字段压缩存储）
+        basic = fund_data['basic_info']
+        for model, values in (
+            (FundBasicInfo, {'fund_code': fund_code, 'fund_name': basic.get('fund_name'),
+                             'fund_type': basic.get('fund_type'),
+                             'performance_json': json.dumps(fund_data.get('performance', {}), ensure_ascii=False)}),
+            (FundTrend, {'fund_code': fund_code,
+                         'net_worth_trend_json': json.dumps(fund_data.get('net_worth_trend', []), ensure_ascii=False),
+                         'accumulated_net_worth_json': json.dumps(fund_data.get('accumulated_net_worth', []),
+                                                                  ensure_ascii=False)}),
+        ):
+            stmt = sqlite_insert(model).values(**values)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=['fund_code'],
+                set_={key: stmt.excluded[key] for key in values if key != 'fund_code'}
+            ))
+        return True
+
+    print("=" * 60)
+    print(f"批量更新基准（{'录制' if recorded else '模拟'}响应，上游延迟 {latency * 1000:.0f} ms/请求）")
+    print("=" * 60)
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}",
+                               connect_args={'check_same_thread': False})
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+        codes = list(payloads)
+
+        # 原实现：逐只 get_fund_data + 写库，每 10 只提交一次，每只之后 sleep 0.3 秒
+        db = session_factory()
+        start = time.perf_counter()
+        for i, code in enumerate(codes[:serial_count]):
+            fund_data = api.get_fund_data(code)
+            if fund_data:
+                save_fund(db, code, fund_data)
+            if (i + 1) % 10 == 0:
+                db.commit()
+            time.sleep(0.3)
+        db.commit()
+        db.close()
+        serial_rate = serial_count / (time.perf_counter() - start)
+        print(f"串行: {serial_rate:.2f} 只/秒，15000 只预计 {15000 / serial_rate / 3600:.1f} 小时")
+
+        cpu = os.cpu_count() or 1
+        for fetch_workers, parse_workers, rate in ((8, min(2, cpu), 5), (16, min(4, cpu), 50)):
+            pipeline = BatchUpdatePipeline(save_fund, session_factory, fetch_workers=fetch_workers,
+                                           parse_workers=parse_workers, rate=rate, fund_api=api)
+            count = min(fund_count, int(rate * 20)) if rate < 20 else fund_count
+            result = pipeline.run([(code, '混合型') for code in codes[:count]])
+            print(f"流水线（抓取 {fetch_workers} 线程，解析 {parse_workers} 进程，限速 {rate}/秒）: "
+                  f"{count} 只 {result['elapsed']:.1f} 秒，{count / result['elapsed']:.2f} 只/秒，"
+                  f"15000 只预计 {15000 / (count / result['elapsed']) / 3600:.2f} 小时")
+            for stage in result['stages']:
+                print(f"    {stage['name']:<6} 处理 {stage['processed']:>4}（失败 {stage['failed']}），"
+                      f"{stage['throughput']:7.2f} 只/秒，平均 {stage['avg_ms']:7.1f} ms，利用率 {stage['utilization']:.2f}")
+    server.shutdown()
+
+
+def bench_upstream(fund_count=200, capacity=20, latency=0.05, workers=8):
+    """
+    上游限流：替身上游每秒只承受 capacity 个请求（超出返回 514），workers 个线程并发抓取，比较
+    固定保守速率 / 固定激进速率 / AIMD 自适应速率的吞吐量与失败数（三者都带退避重试与熔断）
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from fund_api import FundAPI
+    from rate_limiter import AdaptiveRateLimiter
+    from upstream import UpstreamHost, UpstreamUnavailable, get_upstream_client
+
+    payloads, _ = _load_replay_payloads(fund_count)
+    server = _start_replay_server(payloads, latency, capacity=capacity)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    api = FundAPI()
+    api.DETAIL_URL = base_url + '/pingzhongdata/{code}.js'
+    api.REALTIME_URL = base_url + '/js/{code}.js'
+    client = get_upstream_client()
+
+    def fetch(code):
+        # 与批量更新抓取线程相同：熔断时等待后重试同一只基金
+        while True:
+            try:
+                return api.fetch_payloads(code)
+            except UpstreamUnavailable as e:
+                time.sleep(max(e.retry_after, 0.1))
+
+    print("=" * 60)
+    print(f"上游限流基准（替身上游承受 {capacity} 请求/秒，每只基金 2 个请求，{fund_count} 只，{workers} 线程）")
+    print("=" * 60)
+    # 固定速率通过 min_rate == max_rate 关闭自适应
+    modes = (
+        ('固定 5 请求/秒', AdaptiveRateLimiter(5, 5, 5)),
+        (f'固定 {capacity * 2} 请求/秒', AdaptiveRateLimiter(capacity * 2, capacity * 2, capacity * 2)),
+        ('AIMD 5 → 100 请求/秒', AdaptiveRateLimiter(5, 0.5, 100)),
+    )
+    for name, limiter in modes:
+        # 每种模式使用新的主机状态（计数、熔断器清零）
+        host = UpstreamHost(client.host(base_url).host)
+        host.limiter = limiter
+        client._hosts[host.host] = host
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(fetch, payloads))
+        elapsed = time.perf_counter() - start
+        stats = host.to_dict()
+        success = sum(1 for payloads in results if payloads is not None)
+        # 实时估值被限流时该只基金缺少估值数据
+        complete = sum(1 for payloads in results if payloads is not None and payloads[1] is not None)
+        print(f"{name:<20} 成功 {success:>4}（估值完整 {complete:>4}），失败 {len(results) - success:>3}，"
+              f"{complete / elapsed:6.2f} 只/秒，"
+              f"请求 {stats['requests']}，被限流 {stats['throttled']}，熔断 {stats['opened_count']} 次，"
+              f"结束速率 {stats['rate']} 请求/秒")
+    server.shutdown()
+
+
+COMMANDS = {
+    'blob-compression': (bench_blob_compression, 'JSON 大字段压缩大小与编解码耗时'),
+    'risk-metrics': (bench_risk_metrics, '风险指标计算：循环实现 vs 向量化实现'),
+    'risk-batch': (bench_risk_batch, '全市场风险指标重算：逐只 vs 批量/多进程'),
+    'risk-incremental': (bench_risk_incremental, '每日刷新：全量重算 vs 增量更新'),
+    'rolling': (bench_rolling_metrics, '滚动窗口指标：逐窗口重算 vs O(n) 滑动窗口'),
+    'correlation': (bench_correlation, '多基金相关性矩阵与聚类耗时'),
+    'similarity': (bench_similarity, '相似基金索引构建与查询耗时'),
+    'ranking': (bench_rankings, '同类排名：窗口函数集合 SQL 与单只增量重排耗时'),
+    'screening': (bench_screening_engine, '筛选查询：SQLite 宽表 vs 内存列式引擎'),
+    'calendar': (bench_trading_calendar, '日期解析与交易日历对齐：字符串 vs 日序号'),
+    'batch-update': (bench_batch_update, '批量更新：串行 vs 三阶段流水线（本地替身上游回放录制响应）'),
+    'batch-record': (record_upstream_payloads, '录制真实上游响应到 REPLAY_DIR，供 batch-update 回放'),
+    'upstream': (bench_upstream, '上游限流：固定速率 vs AIMD 自适应限流 + 退避重试 + 熔断'),
+}
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]][0]()
+    else:
+        print("可用命令:")
+        for name, (_, description) in COMMANDS.items():
+            print(f"  {name:<18} - {description}")
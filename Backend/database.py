@@ -1,6 +1,6 @@
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
-from models import Base
+from models import Base, FundScreeningFlat
 from pathlib import Path
 
 # 获取当前文件所在目录（Backend/）
@@ -45,6 +45,50 @@ def migrate_db():
         except Exception as e:
             print(f"Migration check for daily_market_summary: {e}")
 
+        # 检查并添加 batch_update_job.owner 列
+        try:
+            result = conn.execute(text("PRAGMA table_info(batch_update_job)"))
+            columns = [row[1] for row in result.fetchall()]
+            if columns and 'owner' not in columns:
+                conn.execute(text("ALTER TABLE batch_update_job ADD COLUMN owner VARCHAR(100)"))
+                conn.commit()
+                print("Migration: Added owner column to batch_update_job table")
+        except Exception as e:
+            print(f"Migration check for batch_update_job: {e}")
+
+        # 检查并添加相对基准指标列（风险指标表与筛选宽表）
+        flat_columns_added = False
+        try:
+            from risk_engine import BENCHMARK_METRIC_KEYS
+            for table in ('fund_risk_metrics', 'fund_screening_flat'):
+                result = conn.execute(text(f"PRAGMA table_info({table})"))
+                columns = [row[1] for row in result.fetchall()]
+                missing = [name for name in BENCHMARK_METRIC_KEYS if name not in columns]
+                for name in missing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} FLOAT"))
+                if missing:
+                    conn.commit()
+                    flat_columns_added = flat_columns_added or table == 'fund_screening_flat'
+                    print(f"Migration: Added {len(missing)} benchmark metric columns to {table} table")
+            if flat_columns_added:
+                for index in FundScreeningFlat.__table__.indexes:
+                    index.create(bind=conn, checkfirst=True)
+                conn.commit()
+        except Exception as e:
+            print(f"Migration check for benchmark metric columns: {e}")
+
+        # 筛选宽表为空但已有基金数据时（新建表）或新增了列时，从现有数据全量构建
+        try:
+            flat_count = conn.execute(text("SELECT COUNT(*) FROM fund_screening_flat")).scalar()
+            basic_count = conn.execute(text("SELECT COUNT(*) FROM fund_basic_info")).scalar()
+            if (flat_count == 0 or flat_columns_added) and basic_count > 0:
+                from screening_table import rebuild_screening_table
+                rows = rebuild_screening_table(conn)
+                conn.commit()
+                print(f"Migration: Built fund_screening_flat table ({rows} rows)")
+        except Exception as e:
+            print(f"Migration check for fund_screening_flat: {e}")
+
 def init_db():
     # 确保 Data 目录存在
     (PROJECT_ROOT / "Data").mkdir(exist_ok=True)
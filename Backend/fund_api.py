@@ -1,9 +1,61 @@
-import requests
 import json
+import os
 import re
 from datetime import datetime
-from typing import Dict, List, Any, Union
+from typing import Dict, List, Any, Optional, Tuple, Union
+
+import numpy as np
+
 from stock_service import StockService
+from upstream import UpstreamUnavailable, get_upstream_client
+
+# 分红/拆分说明文本，如 "分红：每份派现金0.0500元"、"拆分：每份基金份额折算1.0234份"
+_CASH_DIVIDEND_PATTERN = re.compile(r'派现金\s*([\d.]+)\s*元')
+_SPLIT_PATTERN = re.compile(r'(?:折算|分拆)\s*([\d.]+)\s*份')
+
+
+def parse_dividend(text: Any) -> Tuple[float, float]:
+    """解析单位分红说明，返回 (每份派现金额, 拆分折算比例)，无分红/拆分时为 (0, 1)"""
+    if not text or not isinstance(text, str):
+        return 0.0, 1.0
+    cash = _CASH_DIVIDEND_PATTERN.search(text)
+    split = _SPLIT_PATTERN.search(text)
+    try:
+        return (float(cash.group(1)) if cash else 0.0,
+                float(split.group(1)) if split else 1.0)
+    except ValueError:
+        return 0.0, 1.0
+
+
+def add_adjusted_net_worth(trend: List[dict]) -> List[dict]:
+    """
+    为净值走势计算复权净值 adjusted_net_worth（分红再投资、拆分折算），原地写入并返回
+    除权日的复权涨幅 = (当日单位净值 + 每份派现) × 折算比例 / 前一日单位净值，
+    整条序列一次累乘得到，起点与首个单位净值相同
+    没有任何分红/拆分的基金复权净值与单位净值相同，不重复存储
+    """
+    events = [parse_dividend(item.get('dividend')) for item in trend]
+    if not any(cash or split != 1.0 for cash, split in events):
+        return trend
+
+    values = np.array([item.get('net_worth') for item in trend], dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(values))
+    if len(valid) == 0:
+        return trend
+    nav = values[valid]
+    cash = np.array([events[i][0] for i in valid])
+    split = np.array([events[i][1] for i in valid])
+
+    ratios = np.ones(len(nav))
+    prev = nav[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios[1:] = np.where(prev > 0, (nav[1:] + cash[1:]) * split[1:] / prev, 1.0)
+    adjusted = nav[0] * np.cumprod(ratios)
+
+    for i, value in zip(valid.tolist(), np.round(adjusted, 6).tolist()):
+        trend[i]['adjusted_net_worth'] = value
+    return trend
+
 
 # --- 数据清洗器 (原 api_handler.py) ---
 
@@ -85,7 +137,8 @@ class FundDataCleaner:
                 except (ValueError, TypeError):
                     pass
             
-            return cleaned
+            # 复权净值（分红再投资），风险指标、回测等计算统一使用
+            return add_adjusted_net_worth(cleaned)
             
         elif data_type == 'position':
             # 处理股票仓位数据
@@ -332,6 +385,10 @@ class FundDataCleaner:
 # --- 基金 API 客户端 ---
 
 class FundAPI:
+    # 上游接口地址（可通过环境变量指向本地回放服务，见 benchmark.py batch-update）
+    DETAIL_URL = os.getenv('FUND_DETAIL_URL', 'https://fund.eastmoney.com/pingzhongdata/{code}.js')
+    REALTIME_URL = os.getenv('FUND_REALTIME_URL', 'http://fundgz.1234567.com.cn/js/{code}.js')
+    
     def __init__(self):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
@@ -369,12 +426,17 @@ class FundAPI:
         包括基本信息、业绩、持仓、净值走势等。
         """
         raw_data = self._fetch_raw_data(fund_code)
-        if not raw_data:
-            return None
         
         # 从本地缓存获取基金类型
         fund_type_cache = self._load_fund_type_cache()
-        fund_type = fund_type_cache.get(fund_code, '')
+        return self.clean_raw_data(fund_code, raw_data, fund_type_cache.get(fund_code, ''))
+    
+    def clean_raw_data(self, fund_code: str, raw_data: Union[Dict[str, Any], None],
+                       fund_type: str = '') -> Union[Dict[str, Any], None]:
+        """清洗原始基金数据，fund_type 为基金列表缓存中的类型"""
+        if not raw_data:
+            return None
+        
         if fund_type:
             raw_data['fund_type_from_cache'] = fund_type
         
@@ -395,7 +457,7 @@ class FundAPI:
             'key': keyword
         }
         try:
-            response = requests.get(url, params=params, headers=self.headers, timeout=5)
+            response = get_upstream_client().get(url, params=params, headers=self.headers, timeout=5)
             if response.status_code == 200:
                 data = response.json()
                 if 'Datas' in data:
@@ -480,27 +542,58 @@ class FundAPI:
                 end_pos += 1
             return js_content[pos:end_pos].strip(), end_pos
     
-    def _fetch_raw_data(self, fund_code: str) -> Union[Dict[str, Any], None]:
+    def fetch_payloads(self, fund_code: str, session=None) -> Optional[Tuple[Optional[str], Optional[str]]]:
         """
-        获取原始基金数据（字典形式），包含所有JS变量。
+        只抓取原始响应文本（不解析），返回 (pingzhongdata 脚本, 实时估值脚本)
+        请求经过 upstream 限流、重试与熔断；详细数据请求失败时返回 None，
+        上游熔断中时抛出 UpstreamUnavailable（由调用方决定等待还是使用缓存）；
+        实时估值获取失败不影响整体（对应位置为 None）
+        session: 可选的 requests.Session（批量更新时每个抓取线程复用连接）
         """
-        data = {}
+        client = get_upstream_client()
         
         # 1. 抓取 pingzhongdata 详细数据
-        url = f"https://fund.eastmoney.com/pingzhongdata/{fund_code}.js"
+        detail_text = None
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = client.get(self.DETAIL_URL.format(code=fund_code), session=session,
+                                  headers=self.headers, timeout=10)
             if response.status_code == 200:
-                js_content = response.text
-                
+                detail_text = response.text
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error fetching detail for {fund_code}: {e}")
+            return None
+        
+        # 2. 抓取实时估值数据 (可选，用于补充实时信息)
+        realtime_text = None
+        try:
+            response = client.get(self.REALTIME_URL.format(code=fund_code), session=session,
+                                  headers=self.headers, timeout=3, retries=0)
+            if response.status_code == 200:
+                realtime_text = response.text
+        except Exception:
+            pass # 实时数据获取失败不影响整体
+        
+        return detail_text, realtime_text
+    
+    def parse_payloads(self, fund_code: str, detail_text: Optional[str],
+                       realtime_text: Optional[str]) -> Union[Dict[str, Any], None]:
+        """
+        把原始响应文本解析为字典，包含所有JS变量（纯计算，不发请求）
+        """
+        data = {}
+        
+        if detail_text:
+            try:
                 # 查找所有 var xxx = 声明
                 var_pattern = re.compile(r'var\s+(\w+)\s*=\s*')
-                for match in var_pattern.finditer(js_content):
+                for match in var_pattern.finditer(detail_text):
                     var_name = match.group(1)
                     value_start = match.end()
                     
                     # 解析值
-                    raw_value, _ = self._parse_js_value(js_content, value_start)
+                    raw_value, _ = self._parse_js_value(detail_text, value_start)
                     
                     if raw_value:
                         try:
@@ -518,25 +611,21 @@ class FundAPI:
                         except json.JSONDecodeError:
                             # 如果 JSON 解析失败，保留原始字符串
                             data[var_name] = raw_value
-                        
-        except Exception as e:
-            print(f"Error fetching detail for {fund_code}: {e}")
-            return None
-
-        # 2. 抓取实时估值数据 (可选，用于补充实时信息)
-        try:
-            real_time_url = f"http://fundgz.1234567.com.cn/js/{fund_code}.js"
-            response = requests.get(real_time_url, headers=self.headers, timeout=3)
-            if response.status_code == 200:
-                match = re.search(r"jsonpgz\((.*?)\);", response.text)
+            except Exception as e:
+                print(f"Error parsing detail for {fund_code}: {e}")
+                return None
+        
+        if realtime_text:
+            try:
+                match = re.search(r"jsonpgz\((.*?)\);", realtime_text)
                 if match:
                     rt_data = json.loads(match.group(1))
                     if rt_data:
                         # 这里的 key 可能和 pingzhongdata 不一样，如果需要合并，要注意 key 冲突
                         # 暂时作为一个子字段，或者直接合并
                         data.update(rt_data)
-        except Exception:
-            pass # 实时数据获取失败不影响整体
+            except Exception:
+                pass
             
         if not data:
             return None
@@ -546,6 +635,39 @@ class FundAPI:
             data['fS_code'] = fund_code
             
         return data
+    
+    def _fetch_raw_data(self, fund_code: str) -> Union[Dict[str, Any], None]:
+        """
+        获取原始基金数据（字典形式），包含所有JS变量。
+        """
+        try:
+            payloads = self.fetch_payloads(fund_code)
+        except UpstreamUnavailable as e:
+            # 上游熔断中：快速失败，调用方使用数据库中的缓存数据
+            print(f"Skip fetching {fund_code}: {e}")
+            return None
+        if payloads is None:
+            return None
+        return self.parse_payloads(fund_code, *payloads)
+
+
+# 进程池中解析用的实例（每个工作进程创建一次）
+_payload_parser = None
+
+
+def parse_fund_payloads(fund_code: str, detail_text: Optional[str], realtime_text: Optional[str],
+                        fund_type: str = '') -> Union[Dict[str, Any], None]:
+    """
+    解析并清洗 fetch_payloads() 抓取的原始响应，返回与 get_fund_data() 相同的数据
+    模块级函数，可直接提交到 ProcessPoolExecutor（批量更新流水线的解析阶段）
+    """
+    global _payload_parser
+    if _payload_parser is None:
+        _payload_parser = FundAPI()
+    return _payload_parser.clean_raw_data(
+        fund_code, _payload_parser.parse_payloads(fund_code, detail_text, realtime_text), fund_type
+    )
+
 
 if __name__ == "__main__":
     # 测试代码
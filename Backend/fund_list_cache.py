@@ -2,13 +2,14 @@
 基金列表本地缓存服务
 从天天基金获取全部基金列表并存储到本地，支持快速本地搜索
 """
-import requests
 import json
 import os
 import re
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 
+from upstream import get_upstream_client
+
 # 获取项目根目录下的 Data 文件夹路径
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'Data')
@@ -64,7 +65,7 @@ class FundRankingFetcher:
         }
         
         try:
-            response = requests.get(url, params=params, headers=self.headers, timeout=30)
+            response = get_upstream_client().get(url, params=params, headers=self.headers, timeout=30)
             if response.status_code != 200:
                 return {'success': False, 'error': f'请求失败: {response.status_code}'}
             
@@ -199,7 +200,7 @@ class FundListCache:
         try:
             # 天天基金全部基金列表API
             url = "http://fund.eastmoney.com/js/fundcode_search.js"
-            response = requests.get(url, headers=self.headers, timeout=30)
+            response = get_upstream_client().get(url, headers=self.headers, timeout=30)
             
             if response.status_code != 200:
                 return {"success": False, "error": f"API请求失败: {response.status_code}"}
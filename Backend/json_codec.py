@@ -0,0 +1,60 @@
+"""
+大字段 JSON 压缩编解码
+FundTrend / FundExtraData / FundPortfolio 的 *_json 列存储的是高度重复的 JSON
+（日期字符串、重复的键名），使用 zlib + 共享预置字典压缩后以 BLOB 形式存储
+
+存储格式: MAGIC(3字节) + zlib 压缩数据
+未压缩的历史数据（str）读取时原样返回，因此迁移前后均可正常读取
+"""
+import zlib
+from typing import Optional, Union
+
+# 压缩数据标记：合法的 JSON 文本不会以 NUL 开头
+MAGIC = b'\x00Z1'
+COMPRESS_LEVEL = 6
+# 短文本（如 "[]"、"{}"）压缩后反而更大，保持原样存储
+MIN_COMPRESS_SIZE = 64
+
+# 共享预置字典：各类走势/扩展数据中最常出现的片段
+# zlib 对字典末尾的内容匹配代价更低，因此出现频率最高的片段放在最后
+_DICTIONARY_PARTS = [
+    '"categories": [', '"series": [', '"yAxis": ', '"type": null, ',
+    '"ability_assessment": {"average_score": ', '"scores": [', '"assessment_date": "',
+    '"performance": {"categories": [', '"photo_url": "', '"star_rating": ',
+    '"work_experience": "', '"managed_fund_size": "', '"id": "', '"name": "',
+    '"code": "', '"original_code": "', '"market": "', '"ratio": 0}, ',
+    '"return_rate": ', '股票占净比', '债券占净比', '现金占净比', '净资产',
+    '机构持有比例', '个人持有比例', '内部持有比例', '同类平均', '沪深300',
+    '{"name": "', '"data": [', ', "value": ', '"rank": ', ', "total_funds": ',
+    ', "position_percentage": ', '"dividend": null}, ', ', "equity_return": ',
+    ', "net_worth": ', '}, {"date": "2024-', '}, {"date": "2025-', '}, {"date": "2026-',
+    '}, {"date": "2023-', '}, {"date": "2022-', '}, {"date": "2021-', '}, {"date": "20',
+]
+DICTIONARY = ''.join(_DICTIONARY_PARTS).encode('utf-8')
+
+
+def compress_json_text(text: Optional[str]) -> Union[str, bytes, None]:
+    """压缩 JSON 文本，短文本原样返回"""
+    if text is None or len(text) < MIN_COMPRESS_SIZE:
+        return text
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zdict=DICTIONARY)
+    return MAGIC + compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+
+def decompress_json_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """
+    解压为 JSON 文本
+    兼容未压缩的历史数据（str 或未带标记的 bytes）
+    """
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not value.startswith(MAGIC):
+        return value.decode('utf-8')
+    decompressor = zlib.decompressobj(zdict=DICTIONARY)
+    return (decompressor.decompress(value[len(MAGIC):]) + decompressor.flush()).decode('utf-8')
+
+
+def is_compressed(value) -> bool:
+    """判断存储值是否已压缩"""
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:len(MAGIC)]) == MAGIC
@@ -0,0 +1,136 @@
+"""
+同类风险指标分布
+按 fund_type 为每个风险指标维护一份排好序的数值数组，查询任意基金（或任意数值）在同类中的
+百分位时只需一次二分查找（O(log n)），不必重新查询整个类型
+
+数据来源: fund_screening_flat（脏数据已置为 NULL）
+- 批量更新/风险指标重算/排名重算完成后整体重建
+- 单只基金刷新只会递增宽表数据版本，查询时若版本变化且距上次构建超过 REFRESH_INTERVAL 秒则重建
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+from screening_table import RISK_COLUMNS, get_screening_version
+
+# 各指标的优劣方向：True=越大越好，False=越小越好，None=无优劣（只给出分位，不给排名）
+METRIC_DIRECTIONS = {
+    'max_drawdown_3m': False, 'max_drawdown_6m': False, 'max_drawdown_1y': False,
+    'max_drawdown_3y': False, 'max_drawdown_all': False,
+    'sharpe_ratio_1y': True, 'sharpe_ratio_3y': True,
+    'volatility_1y': False, 'volatility_3y': False,
+    'annual_return_1y': True, 'annual_return_3y': True,
+    'calmar_ratio_1y': True, 'calmar_ratio_3y': True,
+    'alpha_1y': True, 'beta_1y': None,
+    'tracking_error_1y': False, 'information_ratio_1y': True,
+    'up_capture_1y': True, 'down_capture_1y': False,
+    'sortino_ratio_1y': True,
+    'peer_tracking_error_1y': False, 'peer_information_ratio_1y': True,
+}
+DISTRIBUTION_METRICS = [name for name in RISK_COLUMNS if name in METRIC_DIRECTIONS]
+
+# 单只基金刷新后，最多多久重建一次分布（秒）
+REFRESH_INTERVAL = 300
+
+
+class MetricDistributions:
+    """按基金类型分组的指标有序数组，重建时整体替换，查询不加锁"""
+
+    def __init__(self, refresh_interval: int = REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        # {基金类型: {指标: 升序数组}}
+        self._sorted: Dict[str, Dict[str, np.ndarray]] = {}
+        self._version: Optional[int] = None
+        self._built_at = 0.0
+        self._build_lock = threading.Lock()
+
+    @property
+    def is_built(self) -> bool:
+        return self._version is not None
+
+    def build(self, db) -> int:
+        """从筛选宽表重建全部分布，返回基金类型数"""
+        with self._build_lock:
+            version = get_screening_version()
+            rows = db.execute(text(
+                f"SELECT fund_type, {', '.join(DISTRIBUTION_METRICS)} FROM fund_screening_flat "
+                f"WHERE fund_type IS NOT NULL AND fund_type <> '' ORDER BY fund_type"
+            )).fetchall()
+
+            distributions = {}
+            if rows:
+                types = np.array([row[0] for row in rows])
+                values = np.array([row[1:] for row in rows], dtype=np.float64)
+                # 行已按类型排序，每个类型是一段连续区间
+                boundaries = np.flatnonzero(types[1:] != types[:-1]) + 1
+                starts = np.concatenate(([0], boundaries))
+                ends = np.concatenate((boundaries, [len(rows)]))
+                for start, end in zip(starts, ends):
+                    block = values[start:end]
+                    distributions[str(types[start])] = {
+                        name: np.sort(column[~np.isnan(column)])
+                        for name, column in zip(DISTRIBUTION_METRICS, block.T)
+                    }
+
+            self._sorted = distributions
+            self._version = version
+            self._built_at = time.time()
+            return len(distributions)
+
+    def ensure_fresh(self, db):
+        """未构建时构建；宽表数据已变化且距上次构建超过刷新间隔时重建"""
+        if not self.is_built:
+            self.build(db)
+        elif (self._version != get_screening_version()
+              and time.time() - self._built_at > self.refresh_interval):
+            self.build(db)
+
+    def percentile(self, fund_type: str, metric: str, value: Optional[float]) -> Optional[dict]:
+        """
+        数值在同类中的位置
+        返回 percentile（同类中小于等于该值的比例，0~100）、rank / rank_pct（按指标优劣方向，
+        与 FundScreeningRank 口径一致：1 为最好、百分比越小越好）、total（同类有效基金数）
+        """
+        if value is None or metric not in METRIC_DIRECTIONS:
+            return None
+        values = self._sorted.get(fund_type, {}).get(metric)
+        if values is None or len(values) == 0:
+            return None
+
+        total = len(values)
+        below_or_equal = int(np.searchsorted(values, value, side='right'))
+        result = {
+            'value': value,
+            'percentile': round(below_or_equal / total * 100, 2),
+            'total': total,
+        }
+        higher_is_better = METRIC_DIRECTIONS[metric]
+        if higher_is_better is not None:
+            if higher_is_better:
+                rank = total - below_or_equal + 1
+            else:
+                rank = int(np.searchsorted(values, value, side='left')) + 1
+            rank = min(rank, total)
+            result['rank'] = rank
+            result['rank_pct'] = round(rank / total * 100, 2)
+        return result
+
+    def fund_percentiles(self, fund_type: str, metrics: Dict[str, Optional[float]],
+                         names: Optional[List[str]] = None) -> Dict[str, Optional[dict]]:
+        """批量计算一只基金各指标的同类百分位"""
+        names = names or DISTRIBUTION_METRICS
+        return {name: self.percentile(fund_type, name, metrics.get(name)) for name in names}
+
+
+# 单例模式
+_metric_distributions = None
+
+def get_metric_distributions() -> MetricDistributions:
+    """获取同类指标分布单例"""
+    global _metric_distributions
+    if _metric_distributions is None:
+        _metric_distributions = MetricDistributions()
+    return _metric_distributions
@@ -1,8 +1,11 @@
 import sqlite3
 import os
 import json
-import math
-from datetime import datetime, timedelta
+from datetime import datetime
+from fund_api import add_adjusted_net_worth
+from json_codec import compress_json_text, decompress_json_text, is_compressed
+from risk_engine import calculate_risk_metrics_batch, RISK_METRIC_KEYS, BENCHMARK_METRIC_KEYS
+from screening_table import RANK_SYNC_SQL, RANKING_SQL, REBUILD_SQL
 
 # Database path
 DB_PATH = r'c:\Users\Sebastian\Desktop\GoFundBot\MyBot\Data\funds.db'
@@ -28,7 +31,7 @@ def migrate_database():
             ('calmar_ratio_3y', 'FLOAT'),
             ('annual_return_1y', 'FLOAT'),
             ('annual_return_3y', 'FLOAT')
-        ]
+        ] + [(name, 'FLOAT') for name in BENCHMARK_METRIC_KEYS]
         
         for col_name, col_type in columns_to_add:
             if col_name not in columns:
@@ -135,7 +138,7 @@ def clean_dirty_data():
 def recalculate_all_risk_metrics():
     """
     重新计算所有基金的风险指标
-    基于 fund_trend 表中的净值数据
+    基于 fund_trend 表中的净值数据和累计收益率走势（相对基准指标）
     """
     if not os.path.exists(DB_PATH):
         print(f"Database not found at {DB_PATH}")
@@ -151,7 +154,7 @@ def recalculate_all_risk_metrics():
         
         # 获取所有有净值数据的基金
         cursor.execute("""
-            SELECT fund_code, net_worth_trend_json 
+            SELECT fund_code, net_worth_trend_json, total_return_trend_json
             FROM fund_trend 
             WHERE net_worth_trend_json IS NOT NULL
         """)
@@ -159,54 +162,28 @@ def recalculate_all_risk_metrics():
         
         print(f"共有 {len(funds)} 只基金需要计算")
         
-        success_count = 0
-        skip_count = 0
-        
-        for i, (fund_code, trend_json) in enumerate(funds, 1):
-            if i % 100 == 0:
-                print(f"进度: {i}/{len(funds)} ({i*100//len(funds)}%)")
-            
-            try:
-                net_worth_trend = json.loads(trend_json) if trend_json else []
-                if not net_worth_trend or len(net_worth_trend) < 30:
-                    skip_count += 1
-                    continue
-                
-                # 计算风险指标
-                risk_metrics = _calculate_risk_metrics(net_worth_trend)
-                if not risk_metrics:
-                    skip_count += 1
-                    continue
-                
-                # 更新数据库
-                cursor.execute("""
-                    INSERT OR REPLACE INTO fund_risk_metrics 
-                    (fund_code, max_drawdown_3m, max_drawdown_6m, max_drawdown_1y, max_drawdown_3y, max_drawdown_all,
-                     sharpe_ratio_1y, sharpe_ratio_3y, volatility_1y, volatility_3y,
-                     annual_return_1y, annual_return_3y, calmar_ratio_1y, calmar_ratio_3y, updated_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    fund_code,
-                    risk_metrics.get('max_drawdown_3m'),
-                    risk_metrics.get('max_drawdown_6m'),
-                    risk_metrics.get('max_drawdown_1y'),
-                    risk_metrics.get('max_drawdown_3y'),
-                    risk_metrics.get('max_drawdown_all'),
-                    risk_metrics.get('sharpe_ratio_1y'),
-                    risk_metrics.get('sharpe_ratio_3y'),
-                    risk_metrics.get('volatility_1y'),
-                    risk_metrics.get('volatility_3y'),
-                    risk_metrics.get('annual_return_1y'),
-                    risk_metrics.get('annual_return_3y'),
-                    risk_metrics.get('calmar_ratio_1y'),
-                    risk_metrics.get('calmar_ratio_3y'),
-                    datetime.now().isoformat()
-                ))
-                success_count += 1
-                
-            except Exception as e:
-                print(f"Error processing {fund_code}: {e}")
-                skip_count += 1
+        # 批量计算：JSON 解压/解析和指标计算在进程池中按分片并行完成
+        workers = os.cpu_count() or 1
+        start = datetime.now()
+        results = calculate_risk_metrics_batch(
+            {code: trend for code, trend, _ in funds}, workers=workers,
+            total_return_trends={code: total for code, _, total in funds}
+        )
+        elapsed = (datetime.now() - start).total_seconds()
+        print(f"计算完成，耗时 {elapsed:.1f} 秒（{workers} 个进程）")
+        
+        # 批量写入数据库
+        columns = ['fund_code'] + RISK_METRIC_KEYS + ['updated_time']
+        now = datetime.now().isoformat()
+        cursor.executemany(f"""
+            INSERT OR REPLACE INTO fund_risk_metrics ({', '.join(columns)})
+            VALUES ({', '.join('?' * len(columns))})
+        """, [
+            (fund_code, *(metrics.get(key) for key in RISK_METRIC_KEYS), now)
+            for fund_code, metrics in results.items()
+        ])
+        success_count = len(results)
+        skip_count = len(funds) - success_count
         
         conn.commit()
         print("=" * 60)
@@ -221,7 +198,8 @@ def recalculate_all_risk_metrics():
 
 def recalculate_all_rankings():
     """
-    重新计算所有基金的同类型排名百分位和4433法则
+    重新计算所有基金的同类型排名百分位和4433法则（与后端共用同一条 RANKING_SQL），并写回筛选宽表
+    排名基于宽表中的收益率列，调用前需先重建宽表
     """
     if not os.path.exists(DB_PATH):
         print(f"Database not found at {DB_PATH}")
@@ -235,114 +213,8 @@ def recalculate_all_rankings():
         print("开始重新计算同类型排名...")
         print("=" * 60)
         
-        # 获取所有基金类型
-        cursor.execute("""
-            SELECT DISTINCT fund_type FROM fund_basic_info 
-            WHERE fund_type IS NOT NULL AND fund_type != ''
-        """)
-        fund_types = [row[0] for row in cursor.fetchall()]
-        
-        print(f"发现 {len(fund_types)} 种基金类型")
-        
-        for fund_type in fund_types:
-            # 获取该类型的所有基金
-            cursor.execute("""
-                SELECT fund_code, performance_json 
-                FROM fund_basic_info 
-                WHERE fund_type = ? AND performance_json IS NOT NULL
-            """, (fund_type,))
-            funds = cursor.fetchall()
-            
-            if len(funds) < 2:
-                continue
-            
-            print(f"处理 {fund_type}: {len(funds)} 只基金")
-            
-            # 解析业绩数据
-            fund_performances = []
-            for fund_code, perf_json in funds:
-                try:
-                    perf = json.loads(perf_json) if perf_json else {}
-                    fund_performances.append({
-                        'fund_code': fund_code,
-                        'return_1m': perf.get('1_month_return'),
-                        'return_3m': perf.get('3_month_return'),
-                        'return_6m': perf.get('6_month_return'),
-                        'return_1y': perf.get('1_year_return'),
-                        'return_2y': perf.get('2_year_return'),
-                        'return_3y': perf.get('3_year_return'),
-                    })
-                except:
-                    pass
-            
-            # 计算排名
-            periods = [
-                ('return_1m', 'rank_pct_1m'),
-                ('return_3m', 'rank_pct_3m'),
-                ('return_6m', 'rank_pct_6m'),
-                ('return_1y', 'rank_pct_1y'),
-                ('return_2y', 'rank_pct_2y'),
-                ('return_3y', 'rank_pct_3y'),
-            ]
-            
-            fund_ranks = {fp['fund_code']: {} for fp in fund_performances}
-            
-            for return_field, rank_field in periods:
-                # 排除无效数据（None, 0, "0.00" 等）
-                def is_valid_return(val):
-                    if val is None:
-                        return False
-                    try:
-                        num_val = float(val)
-                        if abs(num_val) < 0.01:  # 接近0视为缺失数据
-                            return False
-                        return True
-                    except:
-                        return False
-                
-                funds_with_data = [(fp['fund_code'], float(fp[return_field])) for fp in fund_performances 
-                                   if is_valid_return(fp[return_field])]
-                
-                if len(funds_with_data) < 2:
-                    continue
-                
-                # 按收益率降序排序
-                funds_with_data.sort(key=lambda x: x[1], reverse=True)
-                total = len(funds_with_data)
-                
-                # 计算排名百分位
-                for rank_idx, (fc, _) in enumerate(funds_with_data, 1):
-                    rank_pct = round((rank_idx / total) * 100, 2)
-                    fund_ranks[fc][rank_field] = rank_pct
-            
-            # 更新数据库
-            for fund_code, ranks in fund_ranks.items():
-                # 计算4433法则
-                pass_4433 = _check_4433_rule(
-                    ranks.get('rank_pct_1y'),
-                    ranks.get('rank_pct_2y'),
-                    ranks.get('rank_pct_3y'),
-                    None,
-                    ranks.get('rank_pct_6m'),
-                    ranks.get('rank_pct_3m')
-                )
-                
-                cursor.execute("""
-                    INSERT OR REPLACE INTO fund_screening_rank 
-                    (fund_code, rank_pct_1m, rank_pct_3m, rank_pct_6m, rank_pct_1y, rank_pct_2y, rank_pct_3y, pass_4433, updated_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    fund_code,
-                    ranks.get('rank_pct_1m'),
-                    ranks.get('rank_pct_3m'),
-                    ranks.get('rank_pct_6m'),
-                    ranks.get('rank_pct_1y'),
-                    ranks.get('rank_pct_2y'),
-                    ranks.get('rank_pct_3y'),
-                    1 if pass_4433 else 0,
-                    datetime.now().isoformat()
-                ))
-        
+        cursor.execute(RANKING_SQL, {'now': datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')})
+        cursor.execute(RANK_SYNC_SQL)
         conn.commit()
         
         # 统计结果
@@ -361,161 +233,6 @@ def recalculate_all_rankings():
         conn.close()
 
 
-def _calculate_risk_metrics(net_worth_trend):
-    """计算基金风险指标（独立版本，用于批量计算）"""
-    if not net_worth_trend or len(net_worth_trend) < 30:
-        return None
-    
-    # 按日期排序
-    sorted_data = sorted(net_worth_trend, key=lambda x: x.get('date', ''))
-    
-    dates = []
-    values = []
-    for item in sorted_data:
-        if item.get('net_worth') is not None:
-            dates.append(item.get('date'))
-            values.append(float(item.get('net_worth')))
-    
-    # 过滤首日异常数据
-    if len(values) >= 2:
-        v0 = values[0]
-        v1 = values[1]
-        if v0 > 0 and abs((v1 - v0) / v0) > 0.5:
-            values.pop(0)
-            dates.pop(0)
-    
-    if len(values) < 30:
-        return None
-    
-    now = datetime.now()
-    
-    def get_period_data(months):
-        if months == 'all':
-            return values, dates
-        cutoff_date = (now - timedelta(days=months * 30)).strftime('%Y-%m-%d')
-        period_values = []
-        period_dates = []
-        for i, d in enumerate(dates):
-            if d >= cutoff_date:
-                period_values.append(values[i])
-                period_dates.append(d)
-        return period_values, period_dates
-    
-    def calc_max_drawdown(period_values):
-        if len(period_values) < 2:
-            return None
-        peak = period_values[0]
-        max_dd = 0
-        for value in period_values:
-            if value > peak:
-                peak = value
-            drawdown = (peak - value) / peak * 100
-            if drawdown > max_dd:
-                max_dd = drawdown
-        return round(max_dd, 2)
-    
-    def calc_daily_returns(period_values):
-        if len(period_values) < 2:
-            return []
-        returns = []
-        for i in range(1, len(period_values)):
-            if period_values[i-1] != 0:
-                ret = (period_values[i] - period_values[i-1]) / period_values[i-1]
-                returns.append(ret)
-        return returns
-    
-    def calc_annual_return(period_values, trading_days):
-        if len(period_values) < 2 or period_values[0] == 0 or trading_days <= 0:
-            return None
-        total_return = (period_values[-1] - period_values[0]) / period_values[0]
-        annual_return = ((1 + total_return) ** (252 / trading_days) - 1) * 100
-        return round(annual_return, 2)
-    
-    def calc_volatility(daily_returns):
-        if len(daily_returns) < 10:
-            return None
-        mean_return = sum(daily_returns) / len(daily_returns)
-        variance = sum((r - mean_return) ** 2 for r in daily_returns) / len(daily_returns)
-        daily_vol = math.sqrt(variance)
-        annual_vol = daily_vol * math.sqrt(252) * 100
-        return round(annual_vol, 2)
-    
-    def calc_sharpe_ratio(annual_return, volatility, risk_free_rate=2.0):
-        if volatility is None or volatility == 0 or annual_return is None:
-            return None
-        sharpe = (annual_return - risk_free_rate) / volatility
-        return round(sharpe, 2)
-    
-    result = {}
-    
-    # 计算不同时间段的最大回撤
-    for period, months in [('3m', 3), ('6m', 6), ('1y', 12), ('3y', 36), ('all', 'all')]:
-        period_values, _ = get_period_data(months)
-        result[f'max_drawdown_{period}'] = calc_max_drawdown(period_values)
-    
-    # 计算1年和3年的指标（需要足够的数据）
-    min_trading_days = {'1y': 200, '3y': 600}
-    
-    for period, months in [('1y', 12), ('3y', 36)]:
-        period_values, period_dates = get_period_data(months)
-        trading_days = len(period_values)
-        
-        min_days = min_trading_days.get(period, 30)
-        if trading_days < min_days:
-            result[f'annual_return_{period}'] = None
-            result[f'volatility_{period}'] = None
-            result[f'sharpe_ratio_{period}'] = None
-            result[f'calmar_ratio_{period}'] = None
-            continue
-        
-        daily_returns = calc_daily_returns(period_values)
-        annual_return = calc_annual_return(period_values, trading_days)
-        volatility = calc_volatility(daily_returns)
-        sharpe = calc_sharpe_ratio(annual_return, volatility)
-        
-        # 检查异常值
-        if volatility is not None and volatility > 500:
-            result[f'annual_return_{period}'] = None
-            result[f'volatility_{period}'] = None
-            result[f'sharpe_ratio_{period}'] = None
-            result[f'calmar_ratio_{period}'] = None
-            continue
-        
-        result[f'annual_return_{period}'] = annual_return
-        result[f'volatility_{period}'] = volatility
-        result[f'sharpe_ratio_{period}'] = sharpe
-        
-        max_dd = result.get(f'max_drawdown_{period}')
-        if annual_return is not None and max_dd is not None and max_dd > 0:
-            result[f'calmar_ratio_{period}'] = round(annual_return / max_dd, 2)
-        else:
-            result[f'calmar_ratio_{period}'] = None
-    
-    return result
-
-
-def _check_4433_rule(rank_1y, rank_2y, rank_3y, rank_5y, rank_6m, rank_3m):
-    """检查是否符合4433法则"""
-    if rank_1y is None or rank_1y > 25:
-        return False
-    
-    long_term_available = [r for r in [rank_2y, rank_3y] if r is not None]
-    if long_term_available:
-        for rank in long_term_available:
-            if rank > 25:
-                return False
-    
-    if rank_5y is not None and rank_5y > 25:
-        return False
-    
-    if rank_6m is None or rank_6m > 33.33:
-        return False
-    if rank_3m is None or rank_3m > 33.33:
-        return False
-    
-    return True
-
-
 def print_data_stats():
     """打印数据库统计信息"""
     if not os.path.exists(DB_PATH):
@@ -714,6 +431,167 @@ def migrate_add_return_1y():
         conn.close()
 
 
+# 需要压缩存储的大字段 JSON 列（与 models.CompressedJSONText 对应）
+COMPRESSED_JSON_COLUMNS = {
+    'fund_trend': [
+        'net_worth_trend_json', 'accumulated_net_worth_json', 'position_trend_json',
+        'total_return_trend_json', 'ranking_trend_json', 'ranking_percentage_json',
+        'scale_fluctuation_json'
+    ],
+    'fund_portfolio': [
+        'stock_codes_json', 'bond_codes_json', 'stock_codes_new_json', 'bond_codes_new_json'
+    ],
+    'fund_extra_data': [
+        'holder_structure_json', 'asset_allocation_json', 'performance_evaluation_json',
+        'fund_managers_json', 'subscription_redemption_json', 'same_type_funds_json'
+    ],
+}
+
+
+def compress_json_blobs(batch_size=500):
+    """
+    将现有的未压缩 JSON 大字段转换为压缩存储，完成后执行 VACUUM 回收空间
+    已压缩的数据会被跳过，可重复执行
+    """
+    if not os.path.exists(DB_PATH):
+        print(f"Database not found at {DB_PATH}")
+        return
+    
+    size_before = os.path.getsize(DB_PATH)
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    try:
+        print("=" * 60)
+        print("开始压缩 JSON 大字段...")
+        print("=" * 60)
+        
+        for table, columns in COMPRESSED_JSON_COLUMNS.items():
+            row_count = 0
+            raw_bytes = 0
+            packed_bytes = 0
+            last_id = 0
+            
+            # 按主键分批读取（keyset），内存中只保留一批大字段，每批处理完立即提交
+            while True:
+                cursor.execute(
+                    f"SELECT id, {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                row_count += len(rows)
+                updates = []
+                
+                for row in rows:
+                    values = []
+                    changed = False
+                    for value in row[1:]:
+                        if value is not None and not is_compressed(value):
+                            text_value = decompress_json_text(value)
+                            packed_value = compress_json_text(text_value)
+                            if isinstance(packed_value, bytes):
+                                raw_bytes += len(text_value.encode('utf-8'))
+                                packed_bytes += len(packed_value)
+                                value = packed_value
+                                changed = True
+                        values.append(value)
+                    if changed:
+                        updates.append(values + [row[0]])
+                
+                if updates:
+                    cursor.executemany(
+                        f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                        updates
+                    )
+                conn.commit()
+            
+            ratio = f"{packed_bytes / raw_bytes * 100:.1f}%" if raw_bytes else "-"
+            print(f"{table}: {row_count} 行, {raw_bytes / 1024 / 1024:.2f} MB -> {packed_bytes / 1024 / 1024:.2f} MB ({ratio})")
+        
+        print("执行 VACUUM 回收空间...")
+        conn.execute("VACUUM")
+        size_after = os.path.getsize(DB_PATH)
+        print(f"数据库文件: {size_before / 1024 / 1024:.2f} MB -> {size_after / 1024 / 1024:.2f} MB")
+        
+    except Exception as e:
+        print(f"Error during compression: {str(e)}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def add_adjusted_net_worth_all(batch_size=200):
+    """
+    为已入库的净值走势补充复权净值 adjusted_net_worth（新入库数据在清洗时已计算）
+    只改写存在分红/拆分的基金，可重复执行；完成后需重算风险指标
+    """
+    if not os.path.exists(DB_PATH):
+        print(f"Database not found at {DB_PATH}")
+        return
+    
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    
+    try:
+        print("=" * 60)
+        print("开始补充复权净值...")
+        print("=" * 60)
+        
+        cursor.execute("SELECT id, net_worth_trend_json FROM fund_trend WHERE net_worth_trend_json IS NOT NULL")
+        updates = []
+        adjusted_count = 0
+        for row_id, value in cursor.fetchall():
+            trend = json.loads(decompress_json_text(value) or '[]')
+            if not trend or 'adjusted_net_worth' in trend[-1]:
+                continue
+            add_adjusted_net_worth(trend)
+            if 'adjusted_net_worth' not in trend[-1]:
+                continue
+            updates.append((compress_json_text(json.dumps(trend, ensure_ascii=False)), row_id))
+            adjusted_count += 1
+            if len(updates) >= batch_size:
+                cursor.executemany("UPDATE fund_trend SET net_worth_trend_json = ? WHERE id = ?", updates)
+                updates = []
+        if updates:
+            cursor.executemany("UPDATE fund_trend SET net_worth_trend_json = ? WHERE id = ?", updates)
+        
+        conn.commit()
+        print(f"复权净值补充完成：{adjusted_count} 只基金存在分红/拆分")
+        
+    except Exception as e:
+        print(f"Error during NAV adjustment: {str(e)}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
+def rebuild_screening_flat():
+    """
+    全量重建筛选宽表 fund_screening_flat
+    风险指标、排名或基金类型被脚本直接修改后需要执行，否则筛选接口读到的是旧数据
+    """
+    print("=" * 60)
+    print("开始重建筛选宽表...")
+    print("=" * 60)
+    
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute("DELETE FROM fund_screening_flat")
+        conn.execute(REBUILD_SQL)
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM fund_screening_flat").fetchone()[0]
+        print(f"筛选宽表重建完成，共 {count} 只基金")
+    except sqlite3.OperationalError as e:
+        # 宽表由后端启动时创建，尚未启动过新版本后端时跳过
+        print(f"跳过筛选宽表重建: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+
 if __name__ == '__main__':
     import sys
     
@@ -723,12 +601,16 @@ if __name__ == '__main__':
             migrate_database()
         elif command == 'clean':
             clean_dirty_data()
+            rebuild_screening_flat()
         elif command == 'recalc-risk':
             recalculate_all_risk_metrics()
+            rebuild_screening_flat()
         elif command == 'recalc-rank':
+            rebuild_screening_flat()
             recalculate_all_rankings()
         elif command == 'update-types':
             update_fund_types_from_cache()
+            rebuild_screening_flat()
         elif command == 'stats':
             print_data_stats()
         elif command == 'all':
@@ -738,17 +620,30 @@ if __name__ == '__main__':
             clean_dirty_data()
             update_fund_types_from_cache()  # 先更新类型
             recalculate_all_risk_metrics()
+            rebuild_screening_flat()
             recalculate_all_rankings()
             print_data_stats()
         elif command == 'fix-rank':
             # 仅修复排名（更新类型后重算排名）
             print("开始修复排名数据...")
             update_fund_types_from_cache()
+            rebuild_screening_flat()
             recalculate_all_rankings()
             print_data_stats()
         elif command == 'add-return':
             # 添加 return_1y 字段
             migrate_add_return_1y()
+        elif command == 'compress-blobs':
+            # 压缩现有的 JSON 大字段
+            compress_json_blobs()
+        elif command == 'rebuild-flat':
+            # 重建筛选宽表
+            rebuild_screening_flat()
+        elif command == 'adjust-nav':
+            # 补充复权净值后重算风险指标
+            add_adjusted_net_worth_all()
+            recalculate_all_risk_metrics()
+            rebuild_screening_flat()
         else:
             print(f"未知命令: {command}")
             print("可用命令:")
@@ -761,6 +656,9 @@ if __name__ == '__main__':
             print("  all          - 执行完整修复流程")
             print("  fix-rank     - 修复排名（更新类型+重算排名）")
             print("  add-return   - 添加return_1y字段用于排序")
+            print("  compress-blobs - 压缩现有的JSON大字段")
+            print("  rebuild-flat - 重建筛选宽表")
+            print("  adjust-nav   - 补充复权净值并重算风险指标")
     else:
         # 默认执行迁移
         migrate_database()
@@ -773,3 +671,6 @@ if __name__ == '__main__':
         print("  python migrate_db.py all         - 执行完整修复流程")
         print("  python migrate_db.py fix-rank    - 修复排名数据")
         print("  python migrate_db.py add-return  - 添加return_1y字段")
+        print("  python migrate_db.py compress-blobs - 压缩JSON大字段")
+        print("  python migrate_db.py rebuild-flat - 重建筛选宽表")
+        print("  python migrate_db.py adjust-nav  - 补充复权净值并重算风险指标")
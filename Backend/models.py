@@ -1,9 +1,27 @@
-from sqlalchemy import Column, String, Float, Text, DateTime, Integer
+from sqlalchemy import Column, String, Float, Text, DateTime, Integer, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+from json_codec import compress_json_text, decompress_json_text
 
 Base = declarative_base()
 
+
+class CompressedJSONText(TypeDecorator):
+    """
+    透明压缩的 JSON 文本列
+    写入时压缩为 BLOB，读取时解压为 JSON 文本；未压缩的历史数据原样读取
+    列类型仍为 TEXT，现有表结构无需变更
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_json_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_json_text(value)
+
 """
 数据库表结构设计说明
 ====================
@@ -17,21 +35,27 @@ Base = declarative_base()
    - FundExtraData: 持有人结构、资产配置、基金经理
    - FundEstimate: 实时估值
    - FundPortfolio: 持仓信息
+   - FundTrend / FundExtraData / FundPortfolio 的 *_json 大字段使用 CompressedJSONText 压缩存储
 
 2. 计算指标表 - 基于原始数据计算
    - FundRiskMetrics: 风险指标（回撤、波动率、夏普等）
+   - FundRiskState: 风险指标增量计算的中间状态（由 risk_state 模块维护）
 
 3. 筛选专用表 - 存储同类排名等筛选特有数据
    - FundScreeningRank: 同类排名百分位、4433标记
+   - FundScreeningFlat: 筛选宽表（物化视图），由 screening_table 模块维护
 
 4. 用户数据表
    - FundWatchlist: 自选基金
    - FundWatchlistGroup: 自选分组
 
+5. 任务表
+   - BatchUpdateJob / BatchUpdateJobFund: 批量更新任务的进度检查点与逐只结果（由 batch_jobs 模块维护）
+
 使用方式：
 - 基金详情：FundBasicInfo + FundTrend + FundExtraData + FundRiskMetrics
 - 基金对比：同上
-- 基金筛选：FundBasicInfo + FundRiskMetrics + FundScreeningRank
+- 基金筛选：FundScreeningFlat（由 FundBasicInfo + FundRiskMetrics + FundScreeningRank 展开）
 """
 
 
@@ -68,13 +92,13 @@ class FundTrend(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     fund_code = Column(String(6), unique=True, nullable=False, index=True)
-    net_worth_trend_json = Column(Text)              # 单位净值走势
-    accumulated_net_worth_json = Column(Text)        # 累计净值走势
-    position_trend_json = Column(Text)               # 仓位变动趋势
-    total_return_trend_json = Column(Text)           # 总收益率走势
-    ranking_trend_json = Column(Text)                # 同类排名走势
-    ranking_percentage_json = Column(Text)           # 排名百分位走势
-    scale_fluctuation_json = Column(Text)            # 规模变动数据
+    net_worth_trend_json = Column(CompressedJSONText)          # 单位净值走势
+    accumulated_net_worth_json = Column(CompressedJSONText)    # 累计净值走势
+    position_trend_json = Column(CompressedJSONText)           # 仓位变动趋势
+    total_return_trend_json = Column(CompressedJSONText)       # 总收益率走势
+    ranking_trend_json = Column(CompressedJSONText)            # 同类排名走势
+    ranking_percentage_json = Column(CompressedJSONText)       # 排名百分位走势
+    scale_fluctuation_json = Column(CompressedJSONText)        # 规模变动数据
     updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
@@ -105,10 +129,10 @@ class FundPortfolio(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     fund_code = Column(String(6), unique=True, nullable=False, index=True)
-    stock_codes_json = Column(Text)         # 股票持仓
-    bond_codes_json = Column(Text)          # 债券持仓
-    stock_codes_new_json = Column(Text)     # 最新股票持仓
-    bond_codes_new_json = Column(Text)      # 最新债券持仓
+    stock_codes_json = Column(CompressedJSONText)              # 股票持仓
+    bond_codes_json = Column(CompressedJSONText)               # 债券持仓
+    stock_codes_new_json = Column(CompressedJSONText)          # 最新股票持仓
+    bond_codes_new_json = Column(CompressedJSONText)           # 最新债券持仓
     updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
@@ -121,12 +145,12 @@ class FundExtraData(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     fund_code = Column(String(6), unique=True, nullable=False, index=True)
-    holder_structure_json = Column(Text)         # 持有人结构
-    asset_allocation_json = Column(Text)         # 资产配置
-    performance_evaluation_json = Column(Text)   # 业绩评价
-    fund_managers_json = Column(Text)            # 基金经理信息
-    subscription_redemption_json = Column(Text)  # 申购赎回状态
-    same_type_funds_json = Column(Text)          # 同类型基金
+    holder_structure_json = Column(CompressedJSONText)         # 持有人结构
+    asset_allocation_json = Column(CompressedJSONText)         # 资产配置
+    performance_evaluation_json = Column(CompressedJSONText)   # 业绩评价
+    fund_managers_json = Column(CompressedJSONText)            # 基金经理信息
+    subscription_redemption_json = Column(CompressedJSONText)  # 申购赎回状态
+    same_type_funds_json = Column(CompressedJSONText)          # 同类型基金
     updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
@@ -135,7 +159,7 @@ class FundExtraData(Base):
 class FundRiskMetrics(Base):
     """
     基金风险指标表
-    数据来源: 根据 FundTrend.net_worth_trend 计算
+    数据来源: 根据 FundTrend.net_worth_trend、FundTrend.total_return_trend 计算
     """
     __tablename__ = 'fund_risk_metrics'
 
@@ -165,6 +189,31 @@ class FundRiskMetrics(Base):
     calmar_ratio_1y = Column(Float)     # 近1年
     calmar_ratio_3y = Column(Float)     # 近3年
     
+    # 相对基准指标（近1年，根据 FundTrend.total_return_trend 计算，基准为沪深300）
+    alpha_1y = Column(Float)                    # 年化阿尔法（百分比）
+    beta_1y = Column(Float)                     # 贝塔
+    tracking_error_1y = Column(Float)           # 跟踪误差（百分比）
+    information_ratio_1y = Column(Float)        # 信息比率
+    up_capture_1y = Column(Float)               # 上行捕获率（百分比）
+    down_capture_1y = Column(Float)             # 下行捕获率（百分比）
+    sortino_ratio_1y = Column(Float)            # 索提诺比率
+    peer_tracking_error_1y = Column(Float)      # 相对同类平均的跟踪误差（百分比）
+    peer_information_ratio_1y = Column(Float)   # 相对同类平均的信息比率
+    
+    updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class FundRiskState(Base):
+    """
+    风险指标增量计算状态表
+    存储各周期窗口边界、滚动峰值、最大回撤、Welford 均值/方差累加器
+    新增净值点时基于该状态增量更新 FundRiskMetrics，无需全量重算
+    """
+    __tablename__ = 'fund_risk_state'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    fund_code = Column(String(6), unique=True, nullable=False, index=True)
+    state_json = Column(Text)                   # 状态JSON（格式见 risk_state 模块）
     updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
@@ -195,6 +244,83 @@ class FundScreeningRank(Base):
     updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+# 筛选宽表中可排序的指标列（每列建立 (列, fund_code) 复合索引）
+SCREENING_SORT_COLUMNS = [
+    'return_1m', 'return_3m', 'return_6m', 'return_1y', 'return_2y', 'return_3y',
+    'max_drawdown_3m', 'max_drawdown_6m', 'max_drawdown_1y', 'max_drawdown_3y', 'max_drawdown_all',
+    'sharpe_ratio_1y', 'sharpe_ratio_3y', 'volatility_1y', 'volatility_3y',
+    'annual_return_1y', 'annual_return_3y', 'calmar_ratio_1y', 'calmar_ratio_3y',
+    'alpha_1y', 'beta_1y', 'tracking_error_1y', 'information_ratio_1y',
+    'up_capture_1y', 'down_capture_1y', 'sortino_ratio_1y',
+    'peer_tracking_error_1y', 'peer_information_ratio_1y',
+    'rank_pct_1m', 'rank_pct_3m', 'rank_pct_6m', 'rank_pct_1y', 'rank_pct_2y', 'rank_pct_3y',
+    'fund_name', 'updated_time',
+]
+
+
+class FundScreeningFlat(Base):
+    """
+    基金筛选宽表（物化）
+    把业绩 JSON 中的收益率、风险指标、同类排名展开为类型化、带索引的列
+    数据来源: FundBasicInfo + FundRiskMetrics + FundScreeningRank
+    由 screening_table 模块在基金数据/排名变更时增量刷新，筛选接口直接查询本表
+    """
+    __tablename__ = 'fund_screening_flat'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    fund_code = Column(String(6), unique=True, nullable=False, index=True)
+    fund_name = Column(String(100))
+    fund_type = Column(String(50), index=True)
+
+    # 阶段收益率（百分比，来自 FundBasicInfo.performance_json）
+    return_1m = Column(Float)
+    return_3m = Column(Float)
+    return_6m = Column(Float)
+    return_1y = Column(Float)
+    return_2y = Column(Float)
+    return_3y = Column(Float)
+
+    # 风险指标（来自 FundRiskMetrics，脏数据已置空）
+    max_drawdown_3m = Column(Float)
+    max_drawdown_6m = Column(Float)
+    max_drawdown_1y = Column(Float)
+    max_drawdown_3y = Column(Float)
+    max_drawdown_all = Column(Float)
+    sharpe_ratio_1y = Column(Float)
+    sharpe_ratio_3y = Column(Float)
+    volatility_1y = Column(Float)
+    volatility_3y = Column(Float)
+    annual_return_1y = Column(Float)
+    annual_return_3y = Column(Float)
+    calmar_ratio_1y = Column(Float)
+    calmar_ratio_3y = Column(Float)
+    alpha_1y = Column(Float)
+    beta_1y = Column(Float)
+    tracking_error_1y = Column(Float)
+    information_ratio_1y = Column(Float)
+    up_capture_1y = Column(Float)
+    down_capture_1y = Column(Float)
+    sortino_ratio_1y = Column(Float)
+    peer_tracking_error_1y = Column(Float)
+    peer_information_ratio_1y = Column(Float)
+
+    # 同类排名百分位（来自 FundScreeningRank）
+    rank_pct_1m = Column(Float)
+    rank_pct_3m = Column(Float)
+    rank_pct_6m = Column(Float)
+    rank_pct_1y = Column(Float)
+    rank_pct_2y = Column(Float)
+    rank_pct_3y = Column(Float)
+    pass_4433 = Column(Integer, index=True)     # 无排名记录时为 NULL
+
+    updated_time = Column(DateTime)             # 基金数据更新时间（FundBasicInfo.updated_time）
+
+    __table_args__ = tuple(
+        Index(f'ix_fund_screening_flat_{name}_code', name, 'fund_code')
+        for name in SCREENING_SORT_COLUMNS
+    )
+
+
 # ==================== 用户数据表 ====================
 
 class FundWatchlistGroup(Base):
@@ -243,3 +369,44 @@ class DailyMarketSummary(Base):
     error_message = Column(Text)                    # 错误信息（如有）
     created_time = Column(DateTime, default=datetime.now)
     updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+# ==================== 任务表 ====================
+
+class BatchUpdateJob(Base):
+    """
+    批量更新任务表
+    保存任务的基金列表快照与进度检查点，进程重启后可从检查点继续
+    """
+    __tablename__ = 'batch_update_job'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String(20), default='running')  # running / stopped / completed / failed / interrupted
+    owner = Column(String(100))                     # 运行任务的进程（主机名:进程号），updated_time 为其心跳
+    fund_types_json = Column(Text)                  # 更新的基金类型
+    params_json = Column(Text)                      # 抓取线程数、速率、新鲜度阈值等参数
+    fund_list_json = Column(CompressedJSONText)     # 基金列表快照 [[代码, 类型], ...]
+    total = Column(Integer, default=0)
+    cursor = Column(Integer, default=0)             # 基金列表中此位置之前的基金都已处理完
+    success_count = Column(Integer, default=0)
+    fail_count = Column(Integer, default=0)
+    skipped_count = Column(Integer, default=0)      # 数据足够新而跳过的基金
+    message = Column(String(200))
+    created_time = Column(DateTime, default=datetime.now)
+    updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    finished_time = Column(DateTime)
+
+
+class BatchUpdateJobFund(Base):
+    """批量更新任务中每只基金的处理结果（成功 / 失败及原因 / 跳过）"""
+    __tablename__ = 'batch_update_job_fund'
+    __table_args__ = (
+        Index('ix_batch_update_job_fund_job_code', 'job_id', 'fund_code', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(Integer, nullable=False)
+    fund_code = Column(String(6), nullable=False)
+    status = Column(String(10), nullable=False)     # success / failed / skipped
+    reason = Column(String(200))                    # 失败原因
+    updated_time = Column(DateTime, default=datetime.now, onupdate=datetime.now)
@@ -0,0 +1,212 @@
+"""
+同类排名增量维护
+每个基金类型、每个收益周期维护一个有序数组（收益率降序，收益相同按入库顺序，与 RANKING_SQL 口径一致），
+单只基金收益变化时只在其类型的数组中二分定位、删除旧键并插入新键：
+- 有效基金数不变时，只有名次落在新旧位置之间的基金百分位发生变化，只改写这些基金
+- 有效基金数变化（新基金入库、周期数据从无到有、类型变更）时分母改变，该类型该周期的百分位全部改写
+- 与 RANKING_SQL 一致，同类不足 2 只的类型、以及不再参与排名的基金不改写，保留原有排名
+
+全量排名重算（calculate_same_type_rankings）后索引作废，下次单只更新时从筛选宽表重建
+"""
+import bisect
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from screening_table import (RANK_COLUMNS, RETURN_COLUMNS, MIN_VALID_RETURN,
+                             RULE_4433_LONG_PCT, RULE_4433_SHORT_PCT, write_screening_ranks)
+
+# (宽表收益率列, 排名列)
+PERIODS = [(col, rank) for (col, _), rank in zip(RETURN_COLUMNS, RANK_COLUMNS)]
+
+# 与 RANKING_SQL 相同的数据来源：宽表中已解析的收益率，只包含有业绩数据、有类型的基金
+_SOURCE_SQL = f"""
+    SELECT b.id, f.fund_code, f.fund_type, {', '.join(f'f.{col}' for col, _ in PERIODS)}
+    FROM fund_screening_flat f
+    JOIN fund_basic_info b ON b.fund_code = f.fund_code
+    WHERE f.fund_type IS NOT NULL AND f.fund_type <> '' AND b.performance_json IS NOT NULL
+"""
+_ALL_STMT = text(_SOURCE_SQL)
+_ONE_STMT = text(_SOURCE_SQL + " AND f.fund_code = :fund_code")
+
+# 排序键: (-收益率, 入库 id, 基金代码)，升序即收益率降序
+RankKey = Tuple[float, int, str]
+
+
+def _sort_key(value: Optional[float], fund_id: int, fund_code: str) -> Optional[RankKey]:
+    """有效收益率的排序键，绝对值过小（视为缺失）或为空时返回 None"""
+    if value is None or abs(value) < MIN_VALID_RETURN:
+        return None
+    return (-value, fund_id, fund_code)
+
+
+def passes_4433(ranks: Dict[str, Optional[float]]) -> bool:
+    """4433 法则（与 RANKING_SQL 中的判断一致）"""
+    def within(name, limit, required):
+        value = ranks.get(name)
+        return not required if value is None else value <= limit
+    return (within('rank_pct_1y', RULE_4433_LONG_PCT, True)
+            and within('rank_pct_2y', RULE_4433_LONG_PCT, False)
+            and within('rank_pct_3y', RULE_4433_LONG_PCT, False)
+            and within('rank_pct_6m', RULE_4433_SHORT_PCT, True)
+            and within('rank_pct_3m', RULE_4433_SHORT_PCT, True))
+
+
+class SameTypeRankIndex:
+    """按基金类型、周期组织的有序收益率数组"""
+
+    def __init__(self):
+        # {基金类型: {排名列: 有序键数组}}
+        self._buckets: Dict[str, Dict[str, List[RankKey]]] = {}
+        # {基金类型: 基金代码集合}
+        self._members: Dict[str, Set[str]] = {}
+        # {基金代码: (基金类型, {排名列: 排序键})}
+        self._funds: Dict[str, Tuple[str, Dict[str, Optional[RankKey]]]] = {}
+        self._built = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_built(self) -> bool:
+        return self._built
+
+    def invalidate(self):
+        """全量排名重算或批量更新后作废，下次使用时重建"""
+        with self._lock:
+            self._built = False
+
+    def build(self, db) -> int:
+        """从筛选宽表重建索引，返回基金数"""
+        rows = db.execute(_ALL_STMT).fetchall()
+        buckets, members, funds = {}, {}, {}
+        for row in rows:
+            fund_id, fund_code, fund_type = row[0], row[1], row[2]
+            keys = {rank: _sort_key(value, fund_id, fund_code) for (_, rank), value in zip(PERIODS, row[3:])}
+            funds[fund_code] = (fund_type, keys)
+            members.setdefault(fund_type, set()).add(fund_code)
+            type_buckets = buckets.setdefault(fund_type, {rank: [] for rank in RANK_COLUMNS})
+            for rank, key in keys.items():
+                if key is not None:
+                    type_buckets[rank].append(key)
+        for type_buckets in buckets.values():
+            for keys in type_buckets.values():
+                keys.sort()
+
+        with self._lock:
+            self._buckets, self._members, self._funds = buckets, members, funds
+            self._built = True
+        return len(funds)
+
+    def _rank_pct(self, fund_type: str, rank: str, key: Optional[RankKey]) -> Optional[float]:
+        """排名百分位 = 名次 / 有效基金数 × 100，同类不足 2 只或有效基金不足 2 只时为 None"""
+        if key is None or len(self._members.get(fund_type, ())) < 2:
+            return None
+        keys = self._buckets[fund_type][rank]
+        total = len(keys)
+        if total < 2:
+            return None
+        return round((bisect.bisect_left(keys, key) + 1) / total * 100, 2)
+
+    def fund_ranks(self, fund_code: str) -> Dict[str, Optional[float]]:
+        """基金当前各周期的排名百分位（不在索引中时全部为 None）"""
+        fund_type, keys = self._funds.get(fund_code, (None, {}))
+        return {rank: self._rank_pct(fund_type, rank, keys.get(rank)) if fund_type else None
+                for rank in RANK_COLUMNS}
+
+    def _remove(self, fund_code: str) -> Set[str]:
+        """从所属类型中移除基金，返回该类型中百分位受影响的基金"""
+        fund_type, keys = self._funds.pop(fund_code)
+        self._members[fund_type].discard(fund_code)
+        for rank, key in keys.items():
+            if key is not None:
+                bucket = self._buckets[fund_type][rank]
+                del bucket[bisect.bisect_left(bucket, key)]
+        # 分母变化（以及同类数量可能跌破 2），整个类型都要改写
+        return set(self._members[fund_type])
+
+    def _add(self, fund_code: str, fund_type: str, keys: Dict[str, Optional[RankKey]]) -> Set[str]:
+        """把基金加入类型，返回该类型中百分位受影响的基金"""
+        self._funds[fund_code] = (fund_type, keys)
+        self._members.setdefault(fund_type, set()).add(fund_code)
+        type_buckets = self._buckets.setdefault(fund_type, {rank: [] for rank in RANK_COLUMNS})
+        for rank, key in keys.items():
+            if key is not None:
+                bisect.insort(type_buckets[rank], key)
+        return set(self._members[fund_type])
+
+    def _move(self, fund_type: str, rank: str, old: Optional[RankKey], new: Optional[RankKey]) -> Set[str]:
+        """同类型内一个周期的键变化，返回百分位受影响的基金"""
+        bucket = self._buckets[fund_type][rank]
+        if old is not None:
+            i = bisect.bisect_left(bucket, old)
+            del bucket[i]
+        if new is not None:
+            j = bisect.bisect_left(bucket, new)
+            bucket.insert(j, new)
+        if old is None or new is None:
+            # 有效基金数变化，该周期全部百分位都变
+            return {key[2] for key in bucket} | {(old or new)[2]}
+        # 名次在新旧位置之间的基金各移动一位
+        lo, hi = min(i, j), max(i, j)
+        return {key[2] for key in bucket[lo:hi + 1]}
+
+    def _rankable(self, fund_code: str) -> bool:
+        """基金是否参与排名（RANKING_SQL 中同类不足 2 只的类型整个跳过）"""
+        fund_type = self._funds.get(fund_code, (None, {}))[0]
+        return fund_type is not None and len(self._members.get(fund_type, ())) >= 2
+
+    def update_fund(self, fund_code: str, fund_type: Optional[str], fund_id: Optional[int],
+                    returns: Dict[str, Optional[float]]) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        应用一只基金的最新数据，返回 {受影响且参与排名的基金代码: 各周期排名百分位}
+        fund_type 为空表示该基金不再参与排名（无类型或无业绩数据），与 RANKING_SQL 一样不改写其排名
+        returns: {宽表收益率列: 收益率}
+        """
+        with self._lock:
+            new_keys = {rank: _sort_key(returns.get(col), fund_id, fund_code) for col, rank in PERIODS} \
+                if fund_type else {}
+            affected = {fund_code}
+            old_type, old_keys = self._funds.get(fund_code, (None, {}))
+
+            if old_type != fund_type:
+                if old_type is not None:
+                    affected |= self._remove(fund_code)
+                if fund_type:
+                    affected |= self._add(fund_code, fund_type, new_keys)
+            elif fund_type:
+                self._funds[fund_code] = (fund_type, new_keys)
+                for rank in RANK_COLUMNS:
+                    if old_keys.get(rank) != new_keys[rank]:
+                        affected |= self._move(fund_type, rank, old_keys.get(rank), new_keys[rank])
+
+            return {code: self.fund_ranks(code) for code in affected if self._rankable(code)}
+
+    def rerank_fund(self, db, fund_code: str) -> int:
+        """
+        单只基金数据保存后（宽表行已刷新）增量更新其所在类型的排名，
+        写入排名表与宽表（不提交事务），返回改写的基金数
+        """
+        if hasattr(db, 'flush'):
+            db.flush()
+        if not self._built:
+            self.build(db)
+        row = db.execute(_ONE_STMT, {'fund_code': fund_code}).first()
+        if row is None:
+            changes = self.update_fund(fund_code, None, None, {})
+        else:
+            changes = self.update_fund(fund_code, row[2], row[0], dict(zip([col for col, _ in PERIODS], row[3:])))
+        return write_screening_ranks(db, {
+            code: {**ranks, 'pass_4433': 1 if passes_4433(ranks) else 0}
+            for code, ranks in changes.items()
+        })
+
+
+# 单例模式
+_rank_index = None
+
+def get_rank_index() -> SameTypeRankIndex:
+    """获取同类排名索引单例"""
+    global _rank_index
+    if _rank_index is None:
+        _rank_index = SameTypeRankIndex()
+    return _rank_index
@@ -0,0 +1,105 @@
+"""
+上游请求限流
+令牌桶：按 rate（个/秒）匀速补充令牌，最多积攒 capacity 个（允许的突发量），
+每次请求前取一个令牌，取不到时等待到令牌补足，多个抓取线程共用同一个桶
+
+AdaptiveRateLimiter 在令牌桶上按 AIMD 调整速率：请求成功时加性增加，
+被限流 / 超时 / 5xx 时乘性减小，速率稳定在上游能承受的上限附近
+"""
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """线程安全的令牌桶限流器"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        尝试取出令牌：成功返回 0，否则不取出并返回还需等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """阻塞直到取得令牌；超过 timeout 秒仍未取得时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def set_rate(self, rate: float):
+        """调整补充速率（已积攒的令牌按旧速率结算）"""
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = float(rate)
+
+
+class AdaptiveRateLimiter:
+    """
+    AIMD 自适应限流器（线程安全）
+    - 每次成功速率增加 additive / rate，即持续成功时每秒约增加 additive 个/秒
+    - 每次被限流速率乘以 decrease；cooldown 秒内只减一次，避免并发请求同时失败时速率被连续减半
+    """
+
+    def __init__(self, initial_rate: float, min_rate: float, max_rate: float,
+                 additive: float = 1.0, decrease: float = 0.5, cooldown: float = 1.0):
+        if not 0 < min_rate <= initial_rate <= max_rate:
+            raise ValueError('require 0 < min_rate <= initial_rate <= max_rate')
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.additive = float(additive)
+        self.decrease = float(decrease)
+        self.cooldown = float(cooldown)
+        # 突发量为 1：速率下调后立即生效，不会先放出积攒的令牌
+        self._bucket = TokenBucket(initial_rate, capacity=1)
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._bucket.rate
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        return self._bucket.acquire(timeout=timeout)
+
+    def on_success(self):
+        with self._lock:
+            rate = self._bucket.rate
+            if rate < self.max_rate:
+                self._bucket.set_rate(min(self.max_rate, rate + self.additive / rate))
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._bucket.set_rate(max(self.min_rate, self._bucket.rate * self.decrease))
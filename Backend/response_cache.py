@@ -0,0 +1,150 @@
+"""
+基金接口响应缓存
+按 (基金代码, 接口, 数据版本) 缓存预编码、可选预压缩的响应字节，并生成强 ETag
+基金数据重新保存时调用 invalidate() 使该基金的全部缓存失效；
+在 ORM 会话中写入时使用 invalidate_on_commit()，提交成功后才失效（after_commit），回滚时丢弃，
+避免提交前的并发请求把旧数据写入新版本的缓存
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+@dataclass
+class CachedResponse:
+    """预编码的响应"""
+    body: bytes                             # 原始 JSON 字节
+    etag: str                               # 强 ETag（不含引号）
+    gzip_body: Optional[bytes] = None       # 预压缩字节（小响应不压缩）
+    data_time: Optional[datetime] = None    # 数据更新时间，用于调用方判断新鲜度
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip_body or b'')
+
+
+def build_cached_response(body: bytes, gzip_min_size: int = 1024,
+                          data_time: Optional[datetime] = None) -> CachedResponse:
+    """构建预编码响应：计算强 ETag，超过 gzip_min_size 的响应预压缩"""
+    return CachedResponse(
+        body=body,
+        etag=hashlib.blake2b(body, digest_size=16).hexdigest(),
+        gzip_body=gzip.compress(body, compresslevel=6) if len(body) >= gzip_min_size else None,
+        data_time=data_time
+    )
+
+
+class ResponseCache:
+    """线程安全的 LRU 响应缓存（按字节数限制容量）"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, gzip_min_size: int = 1024):
+        self.max_bytes = max_bytes
+        self.gzip_min_size = gzip_min_size
+        self._entries: 'OrderedDict[Tuple[str, str, int], CachedResponse]' = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def get_version(self, fund_code: str) -> int:
+        """获取基金当前的数据版本"""
+        with self._lock:
+            return self._versions.get(fund_code, 0)
+
+    def invalidate(self, fund_code: str):
+        """基金数据已变更：版本号 +1，并清除该基金的全部缓存"""
+        with self._lock:
+            self._versions[fund_code] = self._versions.get(fund_code, 0) + 1
+            for key in [k for k in self._entries if k[0] == fund_code]:
+                self._size -= self._entries.pop(key).size
+
+    def get(self, fund_code: str, endpoint: str, version: Optional[int] = None) -> Optional[CachedResponse]:
+        """获取缓存的响应，version 为空时使用当前版本"""
+        with self._lock:
+            if version is None:
+                version = self._versions.get(fund_code, 0)
+            entry = self._entries.get((fund_code, endpoint, version))
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end((fund_code, endpoint, version))
+            self._hits += 1
+            return entry
+
+    def put(self, fund_code: str, endpoint: str, body: bytes, version: int,
+            data_time: Optional[datetime] = None) -> CachedResponse:
+        """
+        缓存响应字节
+        version 应为构建响应之前通过 get_version() 取得的版本，
+        若期间数据已被重新保存，则只返回响应而不写入缓存
+        """
+        entry = build_cached_response(body, self.gzip_min_size, data_time)
+        if entry.size > self.max_bytes:
+            return entry
+
+        with self._lock:
+            if self._versions.get(fund_code, 0) != version:
+                return entry
+            key = (fund_code, endpoint, version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+        return entry
+
+    def get_stats(self) -> Dict[str, int]:
+        """缓存统计"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+
+# 单例模式
+_response_cache = None
+
+def get_response_cache() -> ResponseCache:
+    """获取响应缓存单例"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+
+_PENDING_KEY = 'response_cache_pending_invalidations'
+
+
+def invalidate_on_commit(db: Session, fund_codes: Union[str, Iterable[str]]):
+    """会话中改动了这些基金的数据：提交成功后才使其缓存失效"""
+    if isinstance(fund_codes, str):
+        fund_codes = (fund_codes,)
+    db.info.setdefault(_PENDING_KEY, set()).update(fund_codes)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    fund_codes = session.info.pop(_PENDING_KEY, None)
+    if fund_codes:
+        cache = get_response_cache()
+        for fund_code in fund_codes:
+            cache.invalidate(fund_code)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
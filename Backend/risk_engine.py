@@ -0,0 +1,533 @@
+"""
+风险指标计算引擎（NumPy 向量化）
+净值序列只转换一次为数组，各周期起点用二分查找定位，
+回撤用 maximum.accumulate、收益率与波动率用 diff / std 计算
+
+日期统一转换为 trading_calendar 的整数日序号，排序、对齐、周期起点定位都在整数数组上完成
+
+净值优先使用复权净值 adjusted_net_worth（分红再投资、拆分折算，入库时计算），
+没有复权净值的点使用单位净值 net_worth
+
+计算口径与原逐点循环实现保持一致：
+- 周期起点: 日期 >= 当前时间 - 月数 × 30 天
+- 最大回撤: 周期内以首个净值为初始峰值
+- 波动率: 日收益率总体标准差 × √252
+- 夏普比率、卡玛比率基于保留两位小数后的年化收益率、波动率、最大回撤计算
+
+calculate_benchmark_metrics() 基于累计收益率走势（本基金/同类平均/沪深300）计算
+阿尔法、贝塔、跟踪误差、信息比率、上/下行捕获率、索提诺比率
+
+calculate_risk_metrics_batch() 将多只基金对齐为 基金×交易日 的矩阵，整批一次性计算
+calculate_rolling_metrics() 计算滚动窗口指标序列（累积和 + 单调队列，O(n)）
+"""
+import json
+import math
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from json_codec import decompress_json_text
+from trading_calendar import INVALID_ORDINAL, TradingCalendar, cutoff_ordinal, to_date_strings, to_ordinals
+
+# 回撤计算的周期（月数，None 表示成立以来）
+DRAWDOWN_PERIODS = [('3m', 3), ('6m', 6), ('1y', 12), ('3y', 36), ('all', None)]
+# 收益/波动/夏普/卡玛计算的周期
+RETURN_PERIODS = [('1y', 12), ('3y', 36)]
+# 对于数据不足的周期不计算指标，避免年化放大产生误导性数据
+MIN_TRADING_DAYS = {'1y': 200, '3y': 600}
+# 年化波动率超过该值说明数据有问题，放弃该周期的结果
+MAX_VOLATILITY = 500
+RISK_FREE_RATE = 2.0
+TRADING_DAYS_PER_YEAR = 252
+
+
+def nav_value(item: dict):
+    """净值点的计算用净值：复权净值优先，没有时使用单位净值"""
+    value = item.get('adjusted_net_worth')
+    return item.get('net_worth') if value is None else value
+
+
+def prepare_series(net_worth_trend: List[dict]):
+    """
+    将净值走势转换为 (日序号数组, 净值数组)，按日期排序并过滤首日异常数据
+    数据不足 30 个点时返回 None
+    """
+    if not net_worth_trend or len(net_worth_trend) < 30:
+        return None
+
+    # 一次性转换为数组：None 净值转为 NaN 后过滤，按日期稳定排序（与 sorted() 行为一致）
+    dates = to_ordinals([item.get('date') or '' for item in net_worth_trend])
+    values = np.array([nav_value(item) for item in net_worth_trend], dtype=np.float64)
+    order = np.argsort(dates, kind='stable')
+    dates, values = dates[order], values[order]
+    valid = ~np.isnan(values)
+    if not valid.all():
+        dates, values = dates[valid], values[valid]
+
+    # 过滤首日异常数据（如面值1.0与实际净值100+差异巨大）
+    if len(values) >= 2:
+        v0, v1 = values[0], values[1]
+        if v0 > 0 and abs((v1 - v0) / v0) > 0.5:
+            dates, values = dates[1:], values[1:]
+
+    if len(values) < 30:
+        return None
+
+    return dates, values
+
+
+def period_start(dates: np.ndarray, months: Optional[int], now: datetime) -> int:
+    """二分查找周期起点下标（dates 为升序日序号）"""
+    if months is None:
+        return 0
+    return int(np.searchsorted(dates, cutoff_ordinal(now, months * 30), side='left'))
+
+
+def max_drawdown(values: np.ndarray) -> Optional[float]:
+    """最大回撤（百分比）"""
+    if len(values) < 2:
+        return None
+    peaks = np.maximum.accumulate(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = (peaks - values) / peaks * 100
+    return round(max(float(np.nanmax(drawdowns)), 0.0), 2)
+
+
+def daily_returns(values: np.ndarray) -> np.ndarray:
+    """日收益率序列（跳过前一日净值为 0 的点）"""
+    if len(values) < 2:
+        return np.empty(0)
+    prev = values[:-1]
+    mask = prev != 0
+    return np.diff(values)[mask] / prev[mask]
+
+
+def annual_return(values: np.ndarray) -> Optional[float]:
+    """年化收益率（百分比）"""
+    trading_days = len(values)
+    if trading_days < 2 or values[0] == 0:
+        return None
+    total_return = (values[-1] - values[0]) / values[0]
+    return round(((1 + float(total_return)) ** (TRADING_DAYS_PER_YEAR / trading_days) - 1) * 100, 2)
+
+
+def annual_volatility(returns: np.ndarray) -> Optional[float]:
+    """年化波动率（百分比）"""
+    if len(returns) < 10:
+        return None
+    return round(float(np.std(returns)) * math.sqrt(TRADING_DAYS_PER_YEAR) * 100, 2)
+
+
+def sharpe_ratio(annual_ret: Optional[float], volatility: Optional[float],
+                 risk_free_rate: float = RISK_FREE_RATE) -> Optional[float]:
+    """夏普比率，假设无风险利率为2%"""
+    if volatility is None or volatility == 0 or annual_ret is None:
+        return None
+    return round((annual_ret - risk_free_rate) / volatility, 2)
+
+
+def calculate_risk_metrics(net_worth_trend: List[dict], now: Optional[datetime] = None,
+                           total_return_trend: Optional[List[dict]] = None) -> Optional[Dict[str, Optional[float]]]:
+    """
+    计算基金风险指标：最大回撤、夏普比率、年化波动率、年化收益率、卡玛比率
+    net_worth_trend: [{'date': '2024-01-01', 'net_worth': 1.0}, ...]
+    now: 计算基准时间（默认当前时间）
+    total_return_trend: 累计收益率走势（FundDataCleaner 的 total_return_trend），
+                        提供时同时计算相对基准的指标
+    """
+    series = prepare_series(net_worth_trend)
+    if series is None:
+        return None
+    dates, values = series
+    now = now or datetime.now()
+
+    starts = {period: period_start(dates, months, now) for period, months in DRAWDOWN_PERIODS}
+
+    result = {}
+    for period, _ in DRAWDOWN_PERIODS:
+        result[f'max_drawdown_{period}'] = max_drawdown(values[starts[period]:])
+
+    for period, _ in RETURN_PERIODS:
+        period_values = values[starts[period]:]
+        annual_ret = volatility = sharpe = calmar = None
+
+        if len(period_values) >= MIN_TRADING_DAYS[period]:
+            annual_ret = annual_return(period_values)
+            volatility = annual_volatility(daily_returns(period_values))
+            if volatility is not None and volatility > MAX_VOLATILITY:
+                annual_ret = volatility = None
+            else:
+                sharpe = sharpe_ratio(annual_ret, volatility)
+                max_dd = result.get(f'max_drawdown_{period}')
+                if annual_ret is not None and max_dd is not None and max_dd > 0:
+                    calmar = round(annual_ret / max_dd, 2)
+
+        result[f'annual_return_{period}'] = annual_ret
+        result[f'volatility_{period}'] = volatility
+        result[f'sharpe_ratio_{period}'] = sharpe
+        result[f'calmar_ratio_{period}'] = calmar
+
+    if total_return_trend is not None:
+        result.update(calculate_benchmark_metrics(total_return_trend, now))
+    return result
+
+
+# ==================== 相对基准指标 ====================
+
+BENCHMARK_SERIES_NAME = '沪深300'
+PEER_SERIES_NAME = '同类平均'
+# 相对基准指标只计算近1年，对齐后的日收益率少于该数量时不计算
+MIN_BENCHMARK_RETURNS = 120
+
+BENCHMARK_METRIC_KEYS = [
+    'alpha_1y', 'beta_1y', 'tracking_error_1y', 'information_ratio_1y',
+    'up_capture_1y', 'down_capture_1y', 'sortino_ratio_1y',
+    'peer_tracking_error_1y', 'peer_information_ratio_1y',
+]
+
+
+def _split_total_return_series(total_return_trend: List[dict]):
+    """从累计收益率走势中区分本基金、同类平均、沪深300 三条序列"""
+    fund = peer = benchmark = None
+    for series in total_return_trend or []:
+        if not isinstance(series, dict):
+            continue
+        name = series.get('name') or ''
+        if name == BENCHMARK_SERIES_NAME:
+            benchmark = series.get('data') or []
+        elif name == PEER_SERIES_NAME:
+            peer = series.get('data') or []
+        elif fund is None:
+            fund = series.get('data') or []
+    return fund, peer, benchmark
+
+
+def _growth_series(points: List[dict]):
+    """累计收益率（百分比）转换为 (日序号数组, 净值化的增长序列 1 + r/100)，去掉无效点和重复日期"""
+    points = [p for p in points if isinstance(p, dict)]
+    dates = to_ordinals([p.get('date') or '' for p in points])
+    values = np.array([p.get('value') for p in points], dtype=np.float64)
+    mask = ~np.isnan(values) & (dates != INVALID_ORDINAL)
+    dates, values = dates[mask], 1 + values[mask] / 100
+    dates, index = np.unique(dates, return_index=True)
+    return dates, values[index]
+
+
+def _align_series(series_list):
+    """按日期交集对齐多条序列，返回 (日序号, 矩阵[序列数 × 日期数])"""
+    calendar = TradingCalendar.intersection([dates for dates, _ in series_list])
+    return calendar.ordinals, calendar.align(series_list)
+
+
+def calculate_benchmark_metrics(total_return_trend: List[dict],
+                                now: Optional[datetime] = None) -> Dict[str, Optional[float]]:
+    """
+    计算近1年相对基准指标（基准为沪深300，peer_* 相对同类平均），数据不足的指标为 None
+    - 阿尔法: 年化 Jensen α（百分比），(Rp - Rf) - β × (Rb - Rf)
+    - 贝塔: Cov(Rp, Rb) / Var(Rb)
+    - 跟踪误差: 超额日收益率标准差 × √252（百分比）
+    - 信息比率: 年化超额收益 / 跟踪误差
+    - 上/下行捕获率: 基准上涨/下跌日基金平均收益 ÷ 基准平均收益（百分比）
+    - 索提诺比率: (年化收益率 - 无风险利率) / 年化下行标准差
+    """
+    result = dict.fromkeys(BENCHMARK_METRIC_KEYS)
+    fund, peer, benchmark = _split_total_return_series(total_return_trend)
+    if not fund or not benchmark:
+        return result
+
+    now = now or datetime.now()
+    names = ['fund', 'benchmark'] + (['peer'] if peer else [])
+    series_list = [_growth_series(points) for points in (fund, benchmark, peer) if points]
+    if any(len(dates) < 2 for dates, _ in series_list):
+        return result
+    dates, matrix = _align_series(series_list)
+    matrix = matrix[:, period_start(dates, 12, now):]
+    if matrix.shape[1] < 2 or (matrix[:, :-1] <= 0).any():
+        return result
+
+    # 三条序列的日收益率一次性计算
+    returns = np.diff(matrix, axis=1) / matrix[:, :-1]
+    if returns.shape[1] < MIN_BENCHMARK_RETURNS:
+        return result
+    rows = dict(zip(names, returns))
+    rp, rb = rows['fund'], rows['benchmark']
+    rf_daily = RISK_FREE_RATE / 100 / TRADING_DAYS_PER_YEAR
+    sqrt_year = math.sqrt(TRADING_DAYS_PER_YEAR)
+
+    var_b = float(np.var(rb))
+    if var_b > 0:
+        beta = float(np.mean((rp - rp.mean()) * (rb - rb.mean()))) / var_b
+        alpha = ((rp.mean() - rf_daily) - beta * (rb.mean() - rf_daily)) * TRADING_DAYS_PER_YEAR * 100
+        result['beta_1y'] = round(beta, 2)
+        result['alpha_1y'] = round(float(alpha), 2)
+
+    for prefix, base in (('', rb), ('peer_', rows.get('peer'))):
+        if base is None:
+            continue
+        active = rp - base
+        tracking_error = float(np.std(active)) * sqrt_year * 100
+        if tracking_error > 0:
+            result[f'{prefix}tracking_error_1y'] = round(tracking_error, 2)
+            result[f'{prefix}information_ratio_1y'] = round(
+                float(active.mean()) * TRADING_DAYS_PER_YEAR * 100 / tracking_error, 2
+            )
+
+    up, down = rb > 0, rb < 0
+    if up.any() and rb[up].mean() != 0:
+        result['up_capture_1y'] = round(float(rp[up].mean() / rb[up].mean()) * 100, 2)
+    if down.any() and rb[down].mean() != 0:
+        result['down_capture_1y'] = round(float(rp[down].mean() / rb[down].mean()) * 100, 2)
+
+    # 索提诺：以无风险日收益为目标收益计算下行标准差
+    downside = float(np.sqrt(np.mean(np.minimum(rp - rf_daily, 0) ** 2))) * sqrt_year * 100
+    fund_growth = matrix[0]
+    annual_ret = ((fund_growth[-1] / fund_growth[0]) ** (TRADING_DAYS_PER_YEAR / len(rp)) - 1) * 100
+    if downside > 0:
+        result['sortino_ratio_1y'] = round((float(annual_ret) - RISK_FREE_RATE) / downside, 2)
+
+    return result
+
+
+# ==================== 批量横截面计算 ====================
+
+RISK_METRIC_KEYS = (
+    [f'max_drawdown_{p}' for p, _ in DRAWDOWN_PERIODS]
+    + [f'{name}_{p}' for p, _ in RETURN_PERIODS
+       for name in ('annual_return', 'volatility', 'sharpe_ratio', 'calmar_ratio')]
+    + BENCHMARK_METRIC_KEYS
+)
+
+
+def _load_trend(trend) -> Optional[list]:
+    """批量输入既可以是已解析的列表，也可以是数据库中存储的 JSON 文本/压缩字节"""
+    if trend is None or isinstance(trend, list):
+        return trend
+    try:
+        text = decompress_json_text(trend)
+        return json.loads(text) if text else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _forward_fill(matrix: np.ndarray) -> np.ndarray:
+    """按行向前填充 NaN（行首的 NaN 保持不变）"""
+    n_rows, n_cols = matrix.shape
+    idx = np.where(np.isnan(matrix), 0, np.arange(n_cols))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    filled = matrix[np.arange(n_rows)[:, None], idx]
+    return filled
+
+
+def _round_or_none(value, digits=2):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def _batch_chunk(items, now: datetime) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    计算一批基金的风险指标
+    所有基金的净值对齐到同一交易日历矩阵（行=基金，列=日期，缺失为 NaN），
+    每个指标对整个矩阵做一次向量化运算
+    """
+    codes, series, total_trends = [], [], []
+    for fund_code, trend, total_trend in items:
+        prepared = prepare_series(_load_trend(trend))
+        if prepared is not None:
+            codes.append(fund_code)
+            series.append(prepared)
+            total_trends.append(total_trend)
+    if not codes:
+        return {}
+
+    # 交易日历 = 所有基金日期的并集
+    calendar = TradingCalendar.union([dates for dates, _ in series])
+    matrix = calendar.align(series)
+
+    columns = {months: calendar.period_start(months, now) for _, months in DRAWDOWN_PERIODS}
+    results = {code: {} for code in codes}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 最大回撤：周期内以各基金首个净值为初始峰值（fmax 跳过 NaN）
+        for period, months in DRAWDOWN_PERIODS:
+            window = matrix[:, columns[months]:]
+            if window.shape[1] < 2:
+                for code in codes:
+                    results[code][f'max_drawdown_{period}'] = None
+                continue
+            counts = (~np.isnan(window)).sum(axis=1)
+            peaks = np.fmax.accumulate(window, axis=1)
+            drawdowns = (peaks - window) / peaks * 100
+            all_nan = np.isnan(drawdowns).all(axis=1)
+            max_dd = np.nanmax(np.where(all_nan[:, None], 0, drawdowns), axis=1)
+            for row, code in enumerate(codes):
+                results[code][f'max_drawdown_{period}'] = (
+                    round(max(float(max_dd[row]), 0.0), 2) if counts[row] >= 2 else None
+                )
+
+        # 年化收益率、波动率、夏普比率、卡玛比率
+        for period, months in RETURN_PERIODS:
+            window = matrix[:, columns[months]:]
+            if window.shape[1] < MIN_TRADING_DAYS[period]:
+                for code in codes:
+                    for name in ('annual_return', 'volatility', 'sharpe_ratio', 'calmar_ratio'):
+                        results[code][f'{name}_{period}'] = None
+                continue
+            valid = ~np.isnan(window)
+            counts = valid.sum(axis=1)
+            filled = _forward_fill(window)
+
+            # 日收益率：相对该基金自身的上一个净值点（跨越其他基金才有的日期）
+            prev = np.empty_like(filled)
+            prev[:, 0] = np.nan
+            prev[:, 1:] = filled[:, :-1]
+            returns = np.where(valid & (prev != 0), (window - prev) / prev, np.nan)
+            return_counts = (~np.isnan(returns)).sum(axis=1)
+            with warnings.catch_warnings():
+                # 没有收益率数据的行 nanstd 结果为 NaN，后面按数据不足处理
+                warnings.simplefilter('ignore', RuntimeWarning)
+                volatility = np.nanstd(returns, axis=1) * math.sqrt(TRADING_DAYS_PER_YEAR) * 100
+
+            first = filled[np.arange(len(codes)), valid.argmax(axis=1)]
+            last = filled[:, -1]
+            total_return = (last - first) / first
+
+            for row, code in enumerate(codes):
+                annual_ret = vol = sharpe = calmar = None
+                if counts[row] >= MIN_TRADING_DAYS[period]:
+                    if first[row] != 0:
+                        annual_ret = round(
+                            ((1 + float(total_return[row])) ** (TRADING_DAYS_PER_YEAR / int(counts[row])) - 1) * 100, 2
+                        )
+                    if return_counts[row] >= 10:
+                        vol = _round_or_none(volatility[row])
+                    if vol is not None and vol > MAX_VOLATILITY:
+                        annual_ret = vol = None
+                    else:
+                        sharpe = sharpe_ratio(annual_ret, vol)
+                        max_dd = results[code].get(f'max_drawdown_{period}')
+                        if annual_ret is not None and max_dd is not None and max_dd > 0:
+                            calmar = round(annual_ret / max_dd, 2)
+                results[code][f'annual_return_{period}'] = annual_ret
+                results[code][f'volatility_{period}'] = vol
+                results[code][f'sharpe_ratio_{period}'] = sharpe
+                results[code][f'calmar_ratio_{period}'] = calmar
+
+    # 相对基准指标：各基金的基准序列日期不同，逐只向量化计算
+    for code, total_trend in zip(codes, total_trends):
+        results[code].update(calculate_benchmark_metrics(_load_trend(total_trend), now))
+
+    return results
+
+
+def calculate_risk_metrics_batch(trends: Dict[str, object], now: Optional[datetime] = None,
+                                 workers: int = 1, chunk_size: int = 500,
+                                 total_return_trends: Optional[Dict[str, object]] = None) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    批量计算多只基金的风险指标（结果与逐只调用 calculate_risk_metrics 一致，允许末位舍入差异）
+    trends: {基金代码: 净值走势列表 / JSON 文本 / 压缩字节}
+    workers: 进程数，>1 时按 chunk_size 分片到进程池并行计算（JSON 解析也在子进程中完成）
+    total_return_trends: {基金代码: 累计收益率走势}，用于相对基准指标（缺失时这些指标为 None）
+    返回 {基金代码: 风险指标}，数据不足的基金不在结果中
+    """
+    now = now or datetime.now()
+    total_return_trends = total_return_trends or {}
+    items = [(code, trend, total_return_trends.get(code)) for code, trend in trends.items()]
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+    results = {}
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for chunk_result in executor.map(_batch_chunk, chunks, [now] * len(chunks)):
+                results.update(chunk_result)
+    else:
+        for chunk in chunks:
+            results.update(_batch_chunk(chunk, now))
+    return results
+
+
+# ==================== 滚动窗口指标 ====================
+
+ROLLING_METRICS = ('return', 'vol', 'sharpe', 'drawdown')
+
+
+def _rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """滑动窗口最大值（单调递减双端队列，O(n)）"""
+    items = values.tolist()
+    result = [0.0] * len(items)
+    queue = deque()
+    for i, value in enumerate(items):
+        while queue and items[queue[-1]] <= value:
+            queue.pop()
+        queue.append(i)
+        if queue[0] <= i - window:
+            queue.popleft()
+        result[i] = items[queue[0]]
+    return np.array(result)
+
+
+def calculate_rolling_metrics(net_worth_trend: List[dict], window: int = 252,
+                              metrics=ROLLING_METRICS) -> Optional[dict]:
+    """
+    计算滚动窗口指标序列，每个点使用截至该日的最近 window 个净值点
+    - return: 窗口年化收益率（%）
+    - vol: 窗口内日收益率的年化波动率（%），由收益率及其平方的累积和求得
+    - sharpe: (年化收益率 - 无风险利率) / 年化波动率
+    - drawdown: 相对窗口内最高净值的回撤（%）
+    全部为 O(n)，与窗口长度无关
+    返回 {'dates': [...], 指标: [...]}，数据不足一个窗口时返回 None
+    """
+    series = prepare_series(net_worth_trend)
+    if series is None or window < 2 or len(series[1]) < window:
+        return None
+    dates, values = series
+    n = len(values)
+    result = {'dates': to_date_strings(dates[window - 1:])}
+
+    annual_ret = volatility = None
+    if {'return', 'sharpe'} & set(metrics):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            start_values = values[:n - window + 1]
+            annual_ret = ((values[window - 1:] / start_values) ** (TRADING_DAYS_PER_YEAR / window) - 1) * 100
+        annual_ret[start_values == 0] = np.nan
+
+    if {'vol', 'sharpe'} & set(metrics):
+        # 第 i 个收益率对应净值点 i+1；窗口 [i-window+1, i] 内含 window-1 个收益率
+        prev = values[:-1]
+        valid = prev != 0
+        returns = np.where(valid, np.diff(values) / np.where(valid, prev, 1), 0.0)
+        csum = np.concatenate([[0.0], np.cumsum(returns)])
+        csum_sq = np.concatenate([[0.0], np.cumsum(returns ** 2)])
+        ccount = np.concatenate([[0], np.cumsum(valid)])
+        span = window - 1
+        count = ccount[span:] - ccount[:-span]
+        total = csum[span:] - csum[:-span]
+        total_sq = csum_sq[span:] - csum_sq[:-span]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / count
+            variance = np.maximum(total_sq / count - mean ** 2, 0.0)
+        volatility = np.sqrt(variance) * math.sqrt(TRADING_DAYS_PER_YEAR) * 100
+        volatility[count < 10] = np.nan
+
+    def to_list(array):
+        array = np.round(array, 4)
+        array[~np.isfinite(array)] = np.nan
+        return [None if v != v else v for v in array.tolist()]
+
+    if 'return' in metrics:
+        result['return'] = to_list(annual_ret)
+    if 'vol' in metrics:
+        result['vol'] = to_list(volatility)
+    if 'sharpe' in metrics:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe = (annual_ret - RISK_FREE_RATE) / volatility
+        sharpe[volatility == 0] = np.nan
+        result['sharpe'] = to_list(sharpe)
+    if 'drawdown' in metrics:
+        peaks = _rolling_max(values, window)[window - 1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['drawdown'] = to_list((peaks - values[window - 1:]) / peaks * 100)
+
+    return result
@@ -0,0 +1,296 @@
+"""
+风险指标增量计算
+每只基金持久化一份运行状态（FundRiskState.state_json），新增净值点时只处理新增的点
+和滑出窗口的点，不再对全部历史重新计算
+
+状态内容:
+- 各周期窗口（3m/6m/1y/3y/all）: 窗口首个有效点下标、有效点数、首个净值、
+  滚动峰值及其下标、最大回撤及其对应峰值的下标、日收益率的 Welford 累加器（n/mean/m2）
+- 已处理的走势长度、首/末日期与末值（用于校验新数据是否只是在末尾追加）
+- 增量次数：达到 FULL_RECOMPUTE_INTERVAL 后全量重算，消除浮点累积误差
+
+走势不是纯追加（历史数据被修订、日期乱序等）时自动退回全量计算
+最大回撤的峰值滑出窗口时，只对该窗口做一次全量回撤计算
+"""
+import math
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from risk_engine import (DRAWDOWN_PERIODS, RETURN_PERIODS, MIN_TRADING_DAYS, MAX_VOLATILITY,
+                         TRADING_DAYS_PER_YEAR, calculate_risk_metrics, nav_value, period_start, sharpe_ratio)
+from trading_calendar import to_ordinals
+
+STATE_VERSION = 1
+# 增量更新多少次后强制全量重算
+FULL_RECOMPUTE_INTERVAL = 20
+
+
+def _net_worth(item) -> Optional[float]:
+    value = nav_value(item)
+    return None if value is None else float(value)
+
+
+def _cutoff(months: int, now: datetime) -> str:
+    return (now - timedelta(days=months * 30)).strftime('%Y-%m-%d')
+
+
+def _empty_window() -> dict:
+    return {'start': None, 'count': 0, 'first_value': None,
+            'peak': None, 'peak_idx': None, 'max_dd': 0.0, 'dd_peak_idx': None,
+            'n': 0, 'mean': 0.0, 'm2': 0.0}
+
+
+def _drawdown_state(indices: np.ndarray, values: np.ndarray) -> dict:
+    """计算一段有效点的回撤状态：滚动峰值、最大回撤及其峰值位置（相同峰值取最后出现的位置）"""
+    peaks = np.maximum.accumulate(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = (peaks - values) / peaks * 100
+    if np.isnan(drawdowns).all():
+        j = 0
+    else:
+        j = int(np.nanargmax(drawdowns))
+    dd_peak_pos = j - int(np.argmax(values[:j + 1][::-1] == peaks[j]))
+    peak_pos = len(values) - 1 - int(np.argmax(values[::-1] == peaks[-1]))
+    return {
+        'peak': float(peaks[-1]),
+        'peak_idx': int(indices[peak_pos]),
+        'max_dd': max(float(drawdowns[j]), 0.0) if not np.isnan(drawdowns[j]) else 0.0,
+        'dd_peak_idx': int(indices[dd_peak_pos]),
+    }
+
+
+def _window_from_arrays(indices: np.ndarray, values: np.ndarray) -> dict:
+    """由窗口内的有效点（原始下标、净值）构建窗口状态"""
+    window = _empty_window()
+    if len(values) == 0:
+        return window
+    window.update(start=int(indices[0]), count=len(values), first_value=float(values[0]))
+    window.update(_drawdown_state(indices, values))
+
+    prev = values[:-1]
+    mask = prev != 0
+    returns = np.diff(values)[mask] / prev[mask]
+    if len(returns):
+        mean = float(returns.mean())
+        window.update(n=len(returns), mean=mean, m2=float(((returns - mean) ** 2).sum()))
+    return window
+
+
+def _welford_add(window: dict, x: float):
+    window['n'] += 1
+    delta = x - window['mean']
+    window['mean'] += delta / window['n']
+    window['m2'] += delta * (x - window['mean'])
+
+
+def _welford_remove(window: dict, x: float):
+    n = window['n']
+    if n <= 1:
+        window.update(n=0, mean=0.0, m2=0.0)
+        return
+    old_mean = window['mean']
+    new_mean = (n * old_mean - x) / (n - 1)
+    window['m2'] = max(window['m2'] - (x - old_mean) * (x - new_mean), 0.0)
+    window.update(n=n - 1, mean=new_mean)
+
+
+def _append_point(window: dict, idx: int, value: float, prev_value: Optional[float]):
+    """向窗口末尾追加一个有效点"""
+    if window['count'] == 0:
+        window.update(start=idx, count=1, first_value=value, peak=value, peak_idx=idx,
+                      max_dd=0.0, dd_peak_idx=idx, n=0, mean=0.0, m2=0.0)
+        return
+    if prev_value:
+        _welford_add(window, (value - prev_value) / prev_value)
+    window['count'] += 1
+    if value >= window['peak']:
+        window['peak'], window['peak_idx'] = value, idx
+    drawdown = (window['peak'] - value) / window['peak'] * 100
+    if drawdown > window['max_dd']:
+        window['max_dd'], window['dd_peak_idx'] = drawdown, window['peak_idx']
+
+
+def _slide_window(window: dict, trend: List[dict], cutoff: str, last_idx: int):
+    """移出日期早于 cutoff 的点，同时从 Welford 累加器中移除对应的日收益率"""
+    if window['count'] == 0 or (trend[window['start']].get('date') or '') >= cutoff:
+        return
+
+    prev_value = None
+    new_start = None
+    for k in range(window['start'], last_idx + 1):
+        value = _net_worth(trend[k])
+        if value is None:
+            continue
+        if prev_value:
+            _welford_remove(window, (value - prev_value) / prev_value)
+        if (trend[k].get('date') or '') >= cutoff:
+            new_start = k
+            break
+        prev_value = value
+        window['count'] -= 1
+
+    if new_start is None:
+        window.update(_empty_window())
+        return
+
+    window['start'] = new_start
+    window['first_value'] = _net_worth(trend[new_start])
+    # 最大回撤对应的峰值已滑出窗口，重新计算该窗口的回撤状态
+    if new_start > window['dd_peak_idx']:
+        points = [(k, _net_worth(trend[k])) for k in range(new_start, last_idx + 1)
+                  if nav_value(trend[k]) is not None]
+        indices = np.array([k for k, _ in points])
+        values = np.array([v for _, v in points], dtype=np.float64)
+        window.update(_drawdown_state(indices, values))
+
+
+def metrics_from_state(state: dict) -> Optional[Dict[str, Optional[float]]]:
+    """由运行状态得到风险指标（口径与 risk_engine.calculate_risk_metrics 一致）"""
+    windows = state['windows']
+    if windows['all']['count'] < 30:
+        return None
+
+    result = {}
+    for period, _ in DRAWDOWN_PERIODS:
+        window = windows[period]
+        result[f'max_drawdown_{period}'] = round(window['max_dd'], 2) if window['count'] >= 2 else None
+
+    last_value = state['last_value']
+    for period, _ in RETURN_PERIODS:
+        window = windows[period]
+        annual_ret = volatility = sharpe = calmar = None
+
+        if window['count'] >= MIN_TRADING_DAYS[period]:
+            first_value = window['first_value']
+            if first_value != 0:
+                total_return = (last_value - first_value) / first_value
+                annual_ret = round(((1 + total_return) ** (TRADING_DAYS_PER_YEAR / window['count']) - 1) * 100, 2)
+            if window['n'] >= 10:
+                volatility = round(math.sqrt(window['m2'] / window['n']) * math.sqrt(TRADING_DAYS_PER_YEAR) * 100, 2)
+            if volatility is not None and volatility > MAX_VOLATILITY:
+                annual_ret = volatility = None
+            else:
+                sharpe = sharpe_ratio(annual_ret, volatility)
+                max_dd = result.get(f'max_drawdown_{period}')
+                if annual_ret is not None and max_dd is not None and max_dd > 0:
+                    calmar = round(annual_ret / max_dd, 2)
+
+        result[f'annual_return_{period}'] = annual_ret
+        result[f'volatility_{period}'] = volatility
+        result[f'sharpe_ratio_{period}'] = sharpe
+        result[f'calmar_ratio_{period}'] = calmar
+
+    return result
+
+
+def build_risk_state(net_worth_trend: List[dict], now: Optional[datetime] = None) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    全量计算风险指标并构建运行状态
+    返回 (风险指标, 状态)；走势未按日期排序时不支持增量，状态为 None
+    """
+    now = now or datetime.now()
+    metrics = calculate_risk_metrics(net_worth_trend, now)
+    if metrics is None:
+        return None, None
+
+    dates = [item.get('date') or '' for item in net_worth_trend]
+    ordinals = to_ordinals(dates)
+    if (np.diff(ordinals) < 0).any():
+        return metrics, None
+
+    values = np.array([nav_value(item) for item in net_worth_trend], dtype=np.float64)
+    valid = np.flatnonzero(~np.isnan(values))
+    # 与 risk_engine.prepare_series 相同的首日异常过滤
+    if len(valid) >= 2:
+        v0, v1 = values[valid[0]], values[valid[1]]
+        if v0 > 0 and abs((v1 - v0) / v0) > 0.5:
+            valid = valid[1:]
+    used_dates = ordinals[valid]
+    used_values = values[valid]
+
+    windows = {}
+    for period, months in DRAWDOWN_PERIODS:
+        k = period_start(used_dates, months, now)
+        windows[period] = _window_from_arrays(valid[k:], used_values[k:])
+
+    last = net_worth_trend[-1]
+    state = {
+        'version': STATE_VERSION,
+        'now': now.isoformat(),
+        'raw_len': len(net_worth_trend),
+        'first_date': dates[0],
+        'last_date': dates[-1],
+        'last_raw_value': _net_worth(last),
+        'last_idx': int(valid[-1]),
+        'last_value': float(used_values[-1]),
+        'appends': 0,
+        'windows': windows,
+    }
+    return metrics, state
+
+
+def _can_increment(trend: List[dict], state: Optional[dict], now: datetime) -> bool:
+    """判断新走势是否只是在已处理数据末尾追加了新点"""
+    if not state or state.get('version') != STATE_VERSION:
+        return False
+    if state['appends'] >= FULL_RECOMPUTE_INTERVAL or now.isoformat() < state['now']:
+        return False
+    raw_len = state['raw_len']
+    if len(trend) < raw_len or raw_len == 0:
+        return False
+    if (trend[0].get('date') or '') != state['first_date']:
+        return False
+    last = trend[raw_len - 1]
+    if (last.get('date') or '') != state['last_date'] or _net_worth(last) != state['last_raw_value']:
+        return False
+    prev_date = state['last_date']
+    for item in trend[raw_len:]:
+        date = item.get('date') or ''
+        if date <= prev_date:
+            return False
+        prev_date = date
+    return True
+
+
+def update_risk_state(net_worth_trend: List[dict], state: Optional[dict],
+                      now: Optional[datetime] = None) -> Tuple[Optional[dict], Optional[dict]]:
+    """
+    基于已有状态增量更新风险指标
+    只处理末尾新增的点和滑出窗口的点；无法增量时全量计算
+    返回 (风险指标, 新状态)
+    """
+    now = now or datetime.now()
+    if not _can_increment(net_worth_trend, state, now):
+        return build_risk_state(net_worth_trend, now)
+
+    windows = state['windows']
+    last_idx, last_value = state['last_idx'], state['last_value']
+    raw_len = state['raw_len']
+
+    # 追加新点
+    for idx in range(raw_len, len(net_worth_trend)):
+        value = _net_worth(net_worth_trend[idx])
+        if value is None:
+            continue
+        for window in windows.values():
+            _append_point(window, idx, value, last_value)
+        last_idx, last_value = idx, value
+
+    # 窗口随当前时间滑动
+    for period, months in DRAWDOWN_PERIODS:
+        if months is not None:
+            _slide_window(windows[period], net_worth_trend, _cutoff(months, now), last_idx)
+
+    last = net_worth_trend[-1]
+    state.update(
+        now=now.isoformat(),
+        raw_len=len(net_worth_trend),
+        last_date=last.get('date') or '',
+        last_raw_value=_net_worth(last),
+        last_idx=last_idx,
+        last_value=last_value,
+        appends=state['appends'] + 1,
+    )
+    return metrics_from_state(state), state
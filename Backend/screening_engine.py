@@ -0,0 +1,331 @@
+"""
+内存列式筛选引擎
+把筛选宽表（fund_screening_flat）整表按列载入为 NumPy 数组（行按 fund_code 升序），
+筛选条件编译为布尔掩码，排序分页用 np.partition 取前 k 个再对这 k 个排序，
+不再经过 SQLite；结果的行顺序、NULL 位置、游标语义与 SQL 查询（_keyset_page / OFFSET）完全一致
+
+数据新鲜度：
+- 批量更新、风险指标重算、同类排名重算后整体重建
+- 单只基金刷新 / 增量重排只补丁变化的行（由 screening_table.changed_codes_since 提供变化的基金）
+- 超过 MAX_AGE 秒强制重建，覆盖 migrate_db 等其他进程直接修改数据库的情况
+
+设置环境变量 SCREENING_ENGINE=0 可关闭，筛选接口回退为 SQL 查询
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from models import FundScreeningFlat
+from screening_strategies import FACET_HISTOGRAMS, get_strategy, histogram_buckets, range_conditions
+from screening_table import changed_codes_since, get_screening_version
+
+SCREENING_ENGINE_ENABLED = os.getenv('SCREENING_ENGINE', '1').lower() not in ('0', 'false', 'off')
+
+# 整体重建的最长间隔（秒）
+MAX_AGE = 300
+# 一次变化的基金超过该数量时整体重建而不是补丁
+PATCH_LIMIT = 2000
+
+_TEXT_COLUMNS = ['fund_code', 'fund_name', 'fund_type']
+NUMERIC_COLUMNS = [
+    column.name for column in FundScreeningFlat.__table__.columns
+    if column.name not in _TEXT_COLUMNS + ['id', 'updated_time']
+]
+ROW_COLUMNS = _TEXT_COLUMNS + NUMERIC_COLUMNS + ['updated_time']
+
+# 查询结果行，属性与 FundScreeningFlat 一致，可直接替代 ORM 对象
+ScreeningRow = namedtuple('ScreeningRow', ROW_COLUMNS)
+
+
+def _timestamp(value) -> float:
+    return value.timestamp() if value is not None else np.nan
+
+
+class _Snapshot:
+    """某一数据版本的全部列，补丁时复制后替换，查询期间不会被修改"""
+
+    def __init__(self, rows: list, version: int):
+        self.version = version
+        self.built_at = time.time()
+        self.codes = np.array([row[0] for row in rows], dtype=str)
+        self.positions = {code: i for i, code in enumerate(self.codes.tolist())}
+        self.names = np.array([row[1] for row in rows], dtype=object)
+        self.types = np.array([row[2] for row in rows], dtype=object)
+        values = np.array([row[3:3 + len(NUMERIC_COLUMNS)] for row in rows], dtype=np.float64)
+        values = values.reshape(len(rows), len(NUMERIC_COLUMNS))
+        self.columns = {name: np.ascontiguousarray(values[:, i]) for i, name in enumerate(NUMERIC_COLUMNS)}
+        self.updated = np.array([row[-1] for row in rows], dtype=object)
+        self.timestamps = np.array([_timestamp(value) for value in self.updated.tolist()], dtype=np.float64)
+        self._derive_types()
+        self._derive_names()
+
+    def _derive_types(self):
+        """基金类型编号（NULL 为 -1），类型筛选转为整数比较"""
+        has_type = np.array([value is not None for value in self.types.tolist()], dtype=bool)
+        self.type_values, type_ids = np.unique(self.types[has_type].astype(str), return_inverse=True)
+        self.type_ids = np.full(len(self.types), -1, dtype=np.int64)
+        self.type_ids[has_type] = type_ids
+
+    def _derive_names(self):
+        """基金名称的字典序名次（NULL 为 NaN），字符串排序转为数值排序"""
+        has_name = np.array([value is not None for value in self.names.tolist()], dtype=bool)
+        self.name_values, name_ranks = np.unique(self.names[has_name].astype(str), return_inverse=True)
+        self.name_ranks = np.full(len(self.names), np.nan)
+        self.name_ranks[has_name] = name_ranks
+
+    def copy(self) -> '_Snapshot':
+        other = object.__new__(_Snapshot)
+        other.__dict__.update(self.__dict__)
+        other.columns = {name: values.copy() for name, values in self.columns.items()}
+        other.names = self.names.copy()
+        other.types = self.types.copy()
+        other.updated = self.updated.copy()
+        other.timestamps = self.timestamps.copy()
+        return other
+
+    def patch(self, rows: list):
+        """覆盖已有基金的行（基金须已存在），名称/类型有变化时才重新编号"""
+        names_changed = types_changed = False
+        for row in rows:
+            position = self.positions[row[0]]
+            names_changed |= self.names[position] != row[1]
+            types_changed |= self.types[position] != row[2]
+            self.names[position] = row[1]
+            self.types[position] = row[2]
+            for name, value in zip(NUMERIC_COLUMNS, row[3:3 + len(NUMERIC_COLUMNS)]):
+                self.columns[name][position] = np.nan if value is None else value
+            self.updated[position] = row[-1]
+            self.timestamps[position] = _timestamp(row[-1])
+        if types_changed:
+            self._derive_types()
+        if names_changed:
+            self._derive_names()
+
+    def sort_key(self, sort_by: str) -> np.ndarray:
+        if sort_by == 'fund_name':
+            return self.name_ranks
+        if sort_by == 'updated_time':
+            return self.timestamps
+        return self.columns[sort_by]
+
+    def cursor_key(self, sort_by: str, value) -> float:
+        """游标中的排序值转换到 sort_key 的数值空间"""
+        if sort_by == 'fund_name':
+            position = int(np.searchsorted(self.name_values, value))
+            found = position < len(self.name_values) and self.name_values[position] == value
+            # 名称不存在时落在相邻两个名次之间
+            return float(position) if found else position - 0.5
+        if sort_by == 'updated_time':
+            return value.timestamp()
+        return float(value)
+
+    def row(self, position: int) -> ScreeningRow:
+        numeric = []
+        for name in NUMERIC_COLUMNS:
+            value = self.columns[name][position]
+            if np.isnan(value):
+                numeric.append(None)
+            elif name == 'pass_4433':
+                numeric.append(int(value))
+            else:
+                numeric.append(float(value))
+        return ScreeningRow(str(self.codes[position]), self.names[position], self.types[position],
+                            *numeric, self.updated[position])
+
+
+class ScreeningEngine:
+    """内存筛选引擎：构建/补丁加锁，查询读取当时的快照，不加锁"""
+
+    def __init__(self, max_age: int = MAX_AGE):
+        self.max_age = max_age
+        self._snapshot: Optional[_Snapshot] = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def is_built(self) -> bool:
+        return self._snapshot is not None
+
+    @staticmethod
+    def _load(db, fund_codes: Optional[Iterable[str]] = None) -> list:
+        F = FundScreeningFlat
+        query = db.query(*[getattr(F, name) for name in ROW_COLUMNS])
+        if fund_codes is not None:
+            query = query.filter(F.fund_code.in_(list(fund_codes)))
+        return query.order_by(F.fund_code).all()
+
+    def build(self, db) -> int:
+        """从筛选宽表整体载入，返回基金数"""
+        with self._build_lock:
+            version = get_screening_version()
+            self._snapshot = _Snapshot(self._load(db), version)
+            return len(self._snapshot.codes)
+
+    def ensure_fresh(self, db):
+        """未构建、过期或有全量变更时重建；只有少量基金变化时补丁这些行"""
+        snapshot = self._snapshot
+        if snapshot is None or time.time() - snapshot.built_at > self.max_age:
+            self.build(db)
+            return
+        version, codes = changed_codes_since(snapshot.version)
+        if codes is None or len(codes) > PATCH_LIMIT:
+            self.build(db)
+        elif version != snapshot.version:
+            self._patch(db, codes, version)
+
+    def _patch(self, db, fund_codes: set, version: int):
+        with self._build_lock:
+            snapshot = self._snapshot
+            if snapshot.version >= version:
+                return
+            rows = self._load(db, fund_codes) if fund_codes else []
+            if len(rows) != len(fund_codes) or any(row[0] not in snapshot.positions for row in rows):
+                # 新增或删除了基金，行位置变化，整体重建
+                snapshot = _Snapshot(self._load(db), version)
+            else:
+                snapshot = snapshot.copy()
+                snapshot.patch(rows)
+                snapshot.version = version
+            self._snapshot = snapshot
+
+    @staticmethod
+    def _filter_mask(snapshot: _Snapshot, strategy, filters: dict, ignore_quick_type=False) -> np.ndarray:
+        """与 _apply_screening_filters 相同的筛选条件，返回布尔掩码"""
+        mask = np.ones(len(snapshot.codes), dtype=bool)
+        preset = get_strategy(strategy)
+        if preset:
+            mask &= preset.mask(snapshot.columns)
+
+        # 类型模糊匹配（与 SQL LIKE '%t%' 一致，ASCII 不区分大小写）
+        if filters.get('fund_types'):
+            matched = [i for i, value in enumerate(snapshot.type_values.tolist())
+                       if any(str(t).lower() in value.lower() for t in filters['fund_types'])]
+            mask &= np.isin(snapshot.type_ids, matched)
+
+        for condition in range_conditions(filters):
+            mask &= condition.to_mask(snapshot.columns)
+
+        if filters.get('quick_fund_type') and not ignore_quick_type:
+            mask &= ScreeningEngine._quick_type_mask(snapshot, filters['quick_fund_type'])
+        return mask
+
+    @staticmethod
+    def _quick_type_mask(snapshot: _Snapshot, fund_type: str) -> np.ndarray:
+        """快速类型筛选（精确匹配）"""
+        return np.isin(snapshot.type_ids, np.flatnonzero(snapshot.type_values == fund_type))
+
+    @staticmethod
+    def _facets(snapshot: _Snapshot, base_mask: np.ndarray, mask: np.ndarray) -> dict:
+        """
+        分面计数：基金类型按忽略快速类型筛选的结果统计（快速类型菜单需要看到全部可选类型），
+        4433 与指标直方图按当前结果统计
+        """
+        type_ids = snapshot.type_ids[base_mask]
+        type_counts = np.bincount(type_ids[type_ids >= 0], minlength=len(snapshot.type_values))
+        fund_types = {value: int(count) for value, count in zip(snapshot.type_values.tolist(), type_counts)
+                      if count and value}
+
+        flags = snapshot.columns['pass_4433'][mask]
+        pass_4433 = {
+            'pass': int((flags == 1).sum()),
+            'fail': int((flags == 0).sum()),
+            'unranked': int(np.isnan(flags).sum()),
+        }
+
+        histograms = {}
+        for name, boundaries in FACET_HISTOGRAMS.items():
+            values = snapshot.columns[name][mask]
+            values = values[~np.isnan(values)]
+            buckets = np.searchsorted(np.asarray(boundaries, dtype=np.float64), values, side='right')
+            histograms[name] = histogram_buckets(boundaries, np.bincount(buckets, minlength=len(boundaries) + 1))
+        return {'fund_types': fund_types, 'pass_4433': pass_4433, 'histograms': histograms}
+
+    @staticmethod
+    def _page(snapshot: _Snapshot, mask: np.ndarray, sort_by: str, sort_order: str,
+              after: Optional[Tuple], offset: int, limit: int) -> List[int]:
+        """
+        按 (排序列, fund_code) 排序后取 [offset, offset + limit) 的行位置
+        降序时 NULL 在最后、升序时在最前（与 SQLite 一致）；after 为游标 (排序值, fund_code)
+        """
+        key = snapshot.sort_key(sort_by)
+        is_null = np.isnan(key)
+        descending = sort_order == 'desc'
+        value_mask = mask & ~is_null
+        null_mask = mask & is_null
+
+        if after is not None:
+            value, fund_code = after
+            code_after = snapshot.codes < fund_code if descending else snapshot.codes > fund_code
+            if value is None:
+                null_mask &= code_after
+                if descending:
+                    # 降序时非空段在 NULL 段之前，已全部返回
+                    value_mask[:] = False
+            else:
+                cursor = snapshot.cursor_key(sort_by, value)
+                beyond = key < cursor if descending else key > cursor
+                value_mask &= beyond | ((key == cursor) & code_after)
+                if not descending:
+                    null_mask[:] = False
+
+        need = offset + limit
+        ordered: List[int] = []
+        for segment in (['value', 'null'] if descending else ['null', 'value']):
+            remaining = need - len(ordered)
+            if remaining <= 0:
+                break
+            if segment == 'null':
+                positions = np.flatnonzero(null_mask)
+                # 行已按 fund_code 升序排列
+                positions = positions[::-1][:remaining] if descending else positions[:remaining]
+                ordered.extend(positions.tolist())
+                continue
+
+            positions = np.flatnonzero(value_mask)
+            values = -key[positions] if descending else key[positions]
+            if len(positions) > remaining:
+                # 只保留不大于第 k 小值的行（含与第 k 个并列的），再精确排序
+                kth = np.partition(values, remaining - 1)[remaining - 1]
+                keep = values <= kth
+                positions, values = positions[keep], values[keep]
+            tiebreak = -positions if descending else positions
+            order = np.lexsort((tiebreak, values))[:remaining]
+            ordered.extend(positions[order].tolist())
+        return ordered[offset:offset + limit]
+
+    def query(self, strategy, filters: dict, sort_by: str, sort_order: str,
+              after: Optional[Tuple] = None, offset: int = 0, limit: int = 20,
+              facets: bool = False) -> Tuple[List[ScreeningRow], int, Optional[dict]]:
+        """
+        筛选 + 排序 + 分页，返回 (当前页的行, 符合条件的总数, 分面计数)
+        facets 为 True 时在同一次掩码计算上统计分面，否则分面为 None
+        """
+        snapshot = self._snapshot
+        base_mask = self._filter_mask(snapshot, strategy, filters, ignore_quick_type=True)
+        mask = base_mask
+        if filters.get('quick_fund_type'):
+            mask = base_mask & self._quick_type_mask(snapshot, filters['quick_fund_type'])
+        positions = self._page(snapshot, mask, sort_by, sort_order, after, offset, limit)
+        facet_counts = self._facets(snapshot, base_mask, mask) if facets else None
+        return [snapshot.row(position) for position in positions], int(mask.sum()), facet_counts
+
+    def fund_types(self, strategy, filters: dict) -> List[str]:
+        """符合筛选条件（忽略快速类型筛选）的基金类型，升序"""
+        snapshot = self._snapshot
+        mask = self._filter_mask(snapshot, strategy, filters, ignore_quick_type=True)
+        type_ids = np.unique(snapshot.type_ids[mask])
+        return [value for value in snapshot.type_values[type_ids[type_ids >= 0]].tolist() if value]
+
+
+# 单例模式
+_screening_engine = None
+
+def get_screening_engine() -> ScreeningEngine:
+    """获取内存筛选引擎单例"""
+    global _screening_engine
+    if _screening_engine is None:
+        _screening_engine = ScreeningEngine()
+    return _screening_engine
@@ -0,0 +1,137 @@
+"""
+筛选结果流式导出
+把按批读取的筛选结果（每行一个 dict，字段顺序为 EXPORT_COLUMNS）逐批编码为 csv / ndjson / parquet 字节块，
+由 Flask 生成器响应直接发送，任何时刻内存中只有一批数据，与结果总行数无关
+
+parquet 依赖可选的 pyarrow，未安装时该格式不可用（EXPORT_FORMATS 中不包含 parquet）
+"""
+import csv
+import io
+import json
+from typing import Iterable, Iterator, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# 导出字段与类型（与筛选查询接口返回的字段一致）
+_FIELD_TYPES = [
+    ('fund_code', 'string'),
+    ('fund_name', 'string'),
+    ('fund_type', 'string'),
+    ('return_1m', 'float'),
+    ('return_3m', 'float'),
+    ('return_6m', 'float'),
+    ('return_1y', 'float'),
+    ('return_3y', 'float'),
+    ('max_drawdown_1y', 'float'),
+    ('max_drawdown_3y', 'float'),
+    ('volatility_1y', 'float'),
+    ('volatility_3y', 'float'),
+    ('sharpe_ratio_1y', 'float'),
+    ('sharpe_ratio_3y', 'float'),
+    ('calmar_ratio_1y', 'float'),
+    ('calmar_ratio_3y', 'float'),
+    ('alpha_1y', 'float'),
+    ('beta_1y', 'float'),
+    ('information_ratio_1y', 'float'),
+    ('sortino_ratio_1y', 'float'),
+    ('rank_pct_1m', 'float'),
+    ('rank_pct_3m', 'float'),
+    ('rank_pct_6m', 'float'),
+    ('rank_pct_1y', 'float'),
+    ('pass_4433', 'bool'),
+    ('updated_time', 'string'),
+]
+EXPORT_COLUMNS = [name for name, _ in _FIELD_TYPES]
+
+# 每批读取的行数
+EXPORT_BATCH_SIZE = 1000
+
+# 格式 -> (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+if pa is not None:
+    EXPORT_FORMATS['parquet'] = ('application/vnd.apache.parquet', 'parquet')
+
+
+def _encode_csv(batches: Iterable[List[dict]]) -> Iterator[bytes]:
+    # 带 BOM，Excel 直接打开时中文不乱码
+    yield '\ufeff'.encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        for row in batch:
+            writer.writerow(['' if row[name] is None else row[name] for name in EXPORT_COLUMNS])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _encode_ndjson(batches: Iterable[List[dict]]) -> Iterator[bytes]:
+    for batch in batches:
+        if batch:
+            yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in batch).encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的输出流，ParquetWriter 写入的字节暂存在这里，每写完一个 row group 取走"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _encode_parquet(batches: Iterable[List[dict]]) -> Iterator[bytes]:
+    types = {'string': pa.string(), 'float': pa.float64(), 'bool': pa.bool_()}
+    schema = pa.schema([(name, types[kind]) for name, kind in _FIELD_TYPES])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        # 每批一个 row group
+        for batch in batches:
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+_ENCODERS = {
+    'csv': _encode_csv,
+    'ndjson': _encode_ndjson,
+    'parquet': _encode_parquet,
+}
+
+
+def encode_export(export_format: str, batches: Iterable[List[dict]]) -> Iterator[bytes]:
+    """把逐批产生的行编码为指定格式的字节流（export_format 必须在 EXPORT_FORMATS 中）"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format: {export_format}')
+    return _ENCODERS[export_format](batches)
@@ -0,0 +1,340 @@
+"""
+预设筛选策略注册表
+每个策略由若干个 (宽表列, 比较符, 阈值) 条件声明，同一份声明编译为：
+- SQL 谓词：在 FundScreeningFlat 查询上 filter
+- NumPy 掩码：在宽表列数组上向量化求值（NaN 与 SQL 的 NULL 一样不满足任何比较）
+
+StrategyMembership 在数据刷新后为每个策略预计算成员位图（np.packbits，每只基金 1 bit），
+策略成员判断、成员数、成员的基金类型都直接查位图，不再逐次查询数据库；
+单只基金刷新 / 批量写入的每个提交批次只补丁变化基金的位（由 screening_table.changed_codes_since 提供），
+变化过多或基金增删时才整体重建
+
+新增策略只需 register_strategy(ScreeningStrategy(...))，筛选、可选类型、策略列表接口自动生效
+
+自定义区间筛选（sharpe_min、return_1y_max ...）同样声明在 RANGE_FILTERS 中，
+由 range_conditions() 转为 Condition，SQL 查询与内存筛选引擎共用；
+筛选结果的分面直方图分桶（FACET_HISTOGRAMS）也在这里声明
+"""
+import operator
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+from screening_table import changed_codes_since, get_screening_version
+
+# 一次变化的基金超过该数量时整体重建成员位图而不是补丁
+PATCH_LIMIT = 2000
+
+# 比较符 -> (SQL 表达式运算, NumPy 运算)
+_OPERATORS = {
+    '>': (operator.gt, np.greater),
+    '>=': (operator.ge, np.greater_equal),
+    '<': (operator.lt, np.less),
+    '<=': (operator.le, np.less_equal),
+    '==': (operator.eq, np.equal),
+}
+
+
+@dataclass(frozen=True)
+class Condition:
+    """单个筛选条件：column op value"""
+    column: str
+    op: str
+    value: float
+
+    def __post_init__(self):
+        if self.op not in _OPERATORS:
+            raise ValueError(f'Unknown operator: {self.op}')
+
+    def to_sql(self, model):
+        """编译为 SQLAlchemy 表达式（NULL 不满足条件）"""
+        return _OPERATORS[self.op][0](getattr(model, self.column), self.value)
+
+    def to_mask(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """在列数组上求值，返回布尔掩码（NaN 不满足条件）"""
+        values = columns[self.column]
+        with np.errstate(invalid='ignore'):
+            return _OPERATORS[self.op][1](values, self.value)
+
+
+@dataclass
+class ScreeningStrategy:
+    """预设筛选策略：所有条件同时满足"""
+    id: str
+    name: str
+    description: str
+    tags: List[str] = field(default_factory=list)
+    conditions: List[Condition] = field(default_factory=list)
+
+    @property
+    def columns(self) -> List[str]:
+        return [condition.column for condition in self.conditions]
+
+    def sql_filters(self, model) -> list:
+        """编译为 query.filter(*filters) 的条件列表"""
+        return [condition.to_sql(model) for condition in self.conditions]
+
+    def mask(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """在列数组上求值，返回成员布尔掩码"""
+        length = len(next(iter(columns.values()))) if columns else 0
+        result = np.ones(length, dtype=bool)
+        for condition in self.conditions:
+            result &= condition.to_mask(columns)
+        return result
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'name': self.name, 'description': self.description, 'tags': self.tags}
+
+
+# 按注册顺序排列（策略列表接口的展示顺序）
+STRATEGIES: Dict[str, ScreeningStrategy] = {}
+
+
+def register_strategy(strategy: ScreeningStrategy) -> ScreeningStrategy:
+    """注册策略（id 重复时覆盖）"""
+    STRATEGIES[strategy.id] = strategy
+    return strategy
+
+
+def get_strategy(strategy_id: Optional[str]) -> Optional[ScreeningStrategy]:
+    """按 id 获取策略，未知或为空时返回 None（不做策略筛选）"""
+    return STRATEGIES.get(strategy_id) if strategy_id else None
+
+
+register_strategy(ScreeningStrategy(
+    id='4433',
+    name='4433法则',
+    description='同类型基金中：近1/2/3年排名前25%，近3/6个月排名前33%',
+    tags=['经典策略', '同类排名', '业绩稳定'],
+    # 排名与 4433 标记由同类排名计算写入宽表
+    conditions=[Condition('pass_4433', '==', 1)],
+))
+register_strategy(ScreeningStrategy(
+    id='high_sharpe',
+    name='高夏普比率',
+    description='夏普比率 > 2，单位风险收益最优',
+    tags=['风险调整', '收益优化'],
+    conditions=[Condition('sharpe_ratio_1y', '>', 2), Condition('volatility_1y', '<', 25)],
+))
+register_strategy(ScreeningStrategy(
+    id='low_volatility',
+    name='低波动策略',
+    description='波动率 < 15%，最大回撤 < 15%，稳健型',
+    tags=['低风险', '稳健'],
+    conditions=[Condition('volatility_1y', '<', 15), Condition('max_drawdown_1y', '<', 15)],
+))
+register_strategy(ScreeningStrategy(
+    id='anti_fragile',
+    name='反脆弱策略',
+    description='在极端行情中表现稳健的基金',
+    tags=['抗跌', '极端行情'],
+    conditions=[Condition('max_drawdown_1y', '<', 20), Condition('annual_return_1y', '>', 0)],
+))
+register_strategy(ScreeningStrategy(
+    id='high_calmar',
+    name='高卡玛比率',
+    description='卡玛比率 > 2（年化收益/最大回撤），性价比最优',
+    tags=['风险调整', '性价比'],
+    conditions=[Condition('calmar_ratio_1y', '>', 2), Condition('annual_return_1y', '>', 0)],
+))
+
+
+# 自定义区间筛选: (请求参数, 宽表列, 'min' 下限 / 'max' 上限)
+RANGE_FILTERS = [
+    ('sharpe_min', 'sharpe_ratio_1y', 'min'),
+    ('volatility_max', 'volatility_1y', 'max'),
+    ('max_drawdown_max', 'max_drawdown_1y', 'max'),
+    ('calmar_min', 'calmar_ratio_1y', 'min'),
+    # 相对基准指标（近1年）
+    ('alpha_min', 'alpha_1y', 'min'),
+    ('beta_min', 'beta_1y', 'min'),
+    ('beta_max', 'beta_1y', 'max'),
+    ('tracking_error_max', 'tracking_error_1y', 'max'),
+    ('information_ratio_min', 'information_ratio_1y', 'min'),
+    ('up_capture_min', 'up_capture_1y', 'min'),
+    ('down_capture_max', 'down_capture_1y', 'max'),
+    ('sortino_min', 'sortino_ratio_1y', 'min'),
+    ('peer_information_ratio_min', 'peer_information_ratio_1y', 'min'),
+]
+# 收益率与排名（return_1y_min / return_1y_max / rank_1y_max ...）
+RANGE_FILTERS += [
+    (key, column, bound)
+    for period in ['1m', '3m', '6m', '1y', '2y', '3y']
+    for key, column, bound in [
+        (f'return_{period}_min', f'return_{period}', 'min'),
+        (f'return_{period}_max', f'return_{period}', 'max'),
+        (f'rank_{period}_max', f'rank_pct_{period}', 'max'),
+    ]
+]
+
+
+def range_conditions(filters: dict) -> List[Condition]:
+    """把请求中的区间筛选参数转为条件列表（未提供或不是数值的参数忽略）"""
+    conditions = []
+    for key, column, bound in RANGE_FILTERS:
+        value = filters.get(key)
+        if value is None or isinstance(value, bool):
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        conditions.append(Condition(column, '>=' if bound == 'min' else '<=', value))
+    return conditions
+
+
+# 分面直方图: {宽表列: 分桶边界}，n 个边界划分出 n+1 个左闭右开的桶，首尾两个桶无界
+FACET_HISTOGRAMS = {
+    'sharpe_ratio_1y': [0, 0.5, 1, 1.5, 2, 3],
+    'volatility_1y': [5, 10, 15, 20, 25, 30],
+    'max_drawdown_1y': [5, 10, 15, 20, 30, 40],
+}
+
+
+def histogram_buckets(boundaries: List[float], counts: List[int]) -> List[dict]:
+    """分桶计数转为 [{'min', 'max', 'count'}]（无界一侧为 None）"""
+    edges = [None] + list(boundaries) + [None]
+    return [{'min': edges[i], 'max': edges[i + 1], 'count': int(counts[i])} for i in range(len(boundaries) + 1)]
+
+
+class StrategyMembership:
+    """各策略的成员位图，宽表数据版本变化后补丁或重建（复制后替换），查询不加锁"""
+
+    def __init__(self):
+        self._codes: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._types = np.empty(0, dtype=object)
+        # {策略 id: packbits 位图}
+        self._bitsets: Dict[str, np.ndarray] = {}
+        self._counts: Dict[str, int] = {}
+        self._version: Optional[int] = None
+        self._build_lock = threading.Lock()
+
+    @property
+    def is_built(self) -> bool:
+        return self._version is not None
+
+    @staticmethod
+    def _columns() -> List[str]:
+        return sorted({column for strategy in STRATEGIES.values() for column in strategy.columns})
+
+    @staticmethod
+    def _masks(rows: list, columns: List[str]) -> Dict[str, np.ndarray]:
+        """rows 为 (fund_code, fund_type, *columns)，返回 {策略 id: 布尔掩码}"""
+        values = np.array([row[2:] for row in rows], dtype=np.float64).reshape(len(rows), len(columns))
+        arrays = {name: values[:, i] for i, name in enumerate(columns)}
+        return {strategy_id: strategy.mask(arrays) for strategy_id, strategy in STRATEGIES.items()}
+
+    def build(self, db) -> int:
+        """从筛选宽表重新计算全部策略的成员位图，返回基金数"""
+        with self._build_lock:
+            return self._build(db, get_screening_version())
+
+    def _build(self, db, version: int) -> int:
+        columns = self._columns()
+        rows = db.execute(text(
+            f"SELECT fund_code, fund_type, {', '.join(columns)} FROM fund_screening_flat ORDER BY fund_code"
+        )).fetchall()
+        masks = self._masks(rows, columns)
+
+        codes = [row[0] for row in rows]
+        self._codes = codes
+        self._positions = {code: i for i, code in enumerate(codes)}
+        self._types = np.array([row[1] or '' for row in rows], dtype=object)
+        self._bitsets = {strategy_id: np.packbits(mask) for strategy_id, mask in masks.items()}
+        self._counts = {strategy_id: int(mask.sum()) for strategy_id, mask in masks.items()}
+        self._version = version
+        return len(codes)
+
+    def ensure_fresh(self, db):
+        """未构建或有全量变更时重建；只有少量基金变化时补丁这些基金的位"""
+        if self._version is None:
+            self.build(db)
+            return
+        version, codes = changed_codes_since(self._version)
+        if codes is None or len(codes) > PATCH_LIMIT:
+            self.build(db)
+        elif version != self._version:
+            self._patch(db, codes, version)
+
+    def _patch(self, db, fund_codes: set, version: int):
+        with self._build_lock:
+            if self._version is None or self._version >= version:
+                return
+            if not fund_codes:
+                self._version = version
+                return
+            columns = self._columns()
+            rows = db.execute(text(
+                f"SELECT fund_code, fund_type, {', '.join(columns)} FROM fund_screening_flat "
+                f"WHERE fund_code IN :codes"
+            ).bindparams(bindparam('codes', expanding=True)), {'codes': list(fund_codes)}).fetchall()
+            if len(rows) != len(fund_codes) or any(row[0] not in self._positions for row in rows):
+                # 新增或删除了基金，位置变化，整体重建
+                self._build(db, version)
+                return
+
+            positions = np.array([self._positions[row[0]] for row in rows], dtype=np.int64)
+            byte_index = positions >> 3
+            bits = (0x80 >> (positions & 7)).astype(np.uint8)
+            bitsets, counts = {}, {}
+            for strategy_id, mask in self._masks(rows, columns).items():
+                bitset = self._bitsets[strategy_id].copy()
+                was_member = (bitset[byte_index] & bits) != 0
+                np.bitwise_and.at(bitset, byte_index, ~bits)
+                np.bitwise_or.at(bitset, byte_index[mask], bits[mask])
+                bitsets[strategy_id] = bitset
+                counts[strategy_id] = self._counts[strategy_id] + int(mask.sum()) - int(was_member.sum())
+            types = self._types.copy()
+            types[positions] = [row[1] or '' for row in rows]
+
+            self._types = types
+            self._bitsets, self._counts = bitsets, counts
+            self._version = version
+
+    def mask(self, strategy_id: str) -> Optional[np.ndarray]:
+        """策略成员布尔掩码（按 fund_code 排序），未知策略返回 None"""
+        bitset = self._bitsets.get(strategy_id)
+        if bitset is None:
+            return None
+        return np.unpackbits(bitset, count=len(self._codes)).astype(bool)
+
+    def contains(self, strategy_id: str, fund_code: str) -> bool:
+        """基金是否为策略成员（O(1) 位查找）"""
+        position = self._positions.get(fund_code)
+        bitset = self._bitsets.get(strategy_id)
+        if position is None or bitset is None:
+            return False
+        return bool((bitset[position >> 3] >> (7 - (position & 7))) & 1)
+
+    def fund_strategies(self, fund_code: str) -> List[str]:
+        """基金所属的全部策略"""
+        return [strategy_id for strategy_id in self._bitsets if self.contains(strategy_id, fund_code)]
+
+    def count(self, strategy_id: str) -> Optional[int]:
+        return self._counts.get(strategy_id)
+
+    def fund_types(self, strategy_id: Optional[str] = None) -> List[str]:
+        """策略成员（为空时为全部基金）的基金类型，升序"""
+        if strategy_id:
+            mask = self.mask(strategy_id)
+            if mask is None:
+                mask = np.ones(len(self._codes), dtype=bool)
+            types = self._types[mask]
+        else:
+            types = self._types
+        return sorted({value for value in types.tolist() if value})
+
+
+# 单例模式
+_strategy_membership = None
+
+def get_strategy_membership() -> StrategyMembership:
+    """获取策略成员位图单例"""
+    global _strategy_membership
+    if _strategy_membership is None:
+        _strategy_membership = StrategyMembership()
+    return _strategy_membership
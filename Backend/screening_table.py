@@ -0,0 +1,432 @@
+"""
+基金筛选宽表维护
+把 FundBasicInfo.performance_json 中的阶段收益率、FundRiskMetrics 风险指标、
+FundScreeningRank 同类排名展开写入 fund_screening_flat，筛选接口直接查询该表
+
+- refresh_screening_fund(): 单只基金数据/风险指标变更后增量刷新
+- rebuild_screening_table(): 同类排名重算后全量重建
+两者都使用同一条 INSERT ... SELECT 语句，在 SQLite 内部完成 JSON 解析，不经过 Python
+
+同类排名（fund_screening_rank）同样是一条集合语句（RANKING_SQL）：基于宽表的 REAL 收益率列，
+ROW_NUMBER() / COUNT() OVER (PARTITION BY fund_type) 求排名百分位，4433 标记在同一语句中推导，
+结果一次 upsert 写入，再由 RANK_SYNC_SQL 只把有变化的排名写回宽表
+
+宽表每次变更都会递增进程内的数据版本号（ORM 会话中的变更在事务提交成功后才递增，回滚则丢弃，
+保证读到某个版本号时数据库中已经是该版本的数据），筛选结果总数按 (筛选条件哈希, 数据版本) 缓存；
+同时记录每个版本改动了哪些基金（changed_codes_since），供内存筛选引擎只补丁变化的行；
+状态/统计接口的计数同样按数据版本缓存（StatsCache）
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# 脏数据阈值：近1年波动率超过该值的风险指标视为无效（写入 NULL）
+DIRTY_VOLATILITY_THRESHOLD = 1000
+
+# (宽表列, performance_json 中的键)
+RETURN_COLUMNS = [
+    ('return_1m', '1_month_return'),
+    ('return_3m', '3_month_return'),
+    ('return_6m', '6_month_return'),
+    ('return_1y', '1_year_return'),
+    ('return_2y', '2_year_return'),
+    ('return_3y', '3_year_return'),
+]
+
+RISK_COLUMNS = [
+    'max_drawdown_3m', 'max_drawdown_6m', 'max_drawdown_1y', 'max_drawdown_3y', 'max_drawdown_all',
+    'sharpe_ratio_1y', 'sharpe_ratio_3y', 'volatility_1y', 'volatility_3y',
+    'annual_return_1y', 'annual_return_3y', 'calmar_ratio_1y', 'calmar_ratio_3y',
+    'alpha_1y', 'beta_1y', 'tracking_error_1y', 'information_ratio_1y',
+    'up_capture_1y', 'down_capture_1y', 'sortino_ratio_1y',
+    'peer_tracking_error_1y', 'peer_information_ratio_1y',
+]
+
+RANK_COLUMNS = ['rank_pct_1m', 'rank_pct_3m', 'rank_pct_6m', 'rank_pct_1y', 'rank_pct_2y', 'rank_pct_3y']
+
+
+def _numeric(expr: str) -> str:
+    """
+    JSON 值转为 REAL：数值原样返回，数字字符串转换，空串、"--" 等非数字返回 NULL
+    与 Python 端 float(value) if value else None 的解析规则一致
+    """
+    return (
+        f"CASE WHEN typeof({expr}) IN ('integer', 'real') THEN {expr} "
+        f"WHEN typeof({expr}) = 'text' AND trim({expr}) <> '' "
+        f"AND trim({expr}) GLOB '*[0-9]*' AND trim({expr}) NOT GLOB '*[^0-9.eE+-]*' "
+        f"THEN CAST(trim({expr}) AS REAL) END"
+    )
+
+
+def _build_upsert_sql(where: str = '') -> str:
+    """构建 INSERT OR REPLACE ... SELECT 语句"""
+    extract_cols = ',\n'.join(
+        f"CASE WHEN json_valid(b.performance_json) "
+        f"THEN json_extract(b.performance_json, '$.\"{key}\"') END AS {col}"
+        for col, key in RETURN_COLUMNS
+    )
+    return_exprs = [_numeric(f"src.{col}") for col, _ in RETURN_COLUMNS]
+    risk_exprs = [
+        f"CASE WHEN r.volatility_1y > {DIRTY_VOLATILITY_THRESHOLD} THEN NULL ELSE r.{col} END"
+        for col in RISK_COLUMNS
+    ]
+    rank_exprs = [f"k.{col}" for col in RANK_COLUMNS]
+
+    columns = (['fund_code', 'fund_name', 'fund_type']
+               + [col for col, _ in RETURN_COLUMNS] + RISK_COLUMNS + RANK_COLUMNS
+               + ['pass_4433', 'updated_time'])
+    values = (['src.fund_code', 'src.fund_name', 'src.fund_type']
+              + return_exprs + risk_exprs + rank_exprs
+              + ['k.pass_4433', 'src.updated_time'])
+
+    return f"""
+        INSERT OR REPLACE INTO fund_screening_flat ({', '.join(columns)})
+        SELECT {', '.join(values)}
+        FROM (
+            SELECT b.fund_code, b.fund_name, b.fund_type, b.updated_time,
+            {extract_cols}
+            FROM fund_basic_info b
+            {where}
+        ) AS src
+        LEFT JOIN fund_risk_metrics r ON r.fund_code = src.fund_code
+        LEFT JOIN fund_screening_rank k ON k.fund_code = src.fund_code
+    """
+
+
+# 排名有效收益率：绝对值小于该值视为缺失（通常是成立时间不足，而非真实的 0% 收益）
+MIN_VALID_RETURN = 0.01
+# 4433 法则阈值：长期（1年/2年/3年）前 1/4，短期（6月/3月）前 1/3
+RULE_4433_LONG_PCT = 25
+RULE_4433_SHORT_PCT = 33.33
+
+
+def _build_ranking_sql() -> str:
+    """
+    构建同类排名 upsert 语句（参数 :now 为更新时间）
+    收益率取自宽表中已解析为 REAL 的 return_* 列，不再逐只解析 performance_json
+    口径与原逐类 Python 实现一致：
+    - 只处理有业绩数据的基金，同类型不足 2 只时整个类型跳过
+    - 每个周期只在该周期有效收益率的基金中排名，有效基金不足 2 只时该周期为 NULL
+    - 排名百分位 = 名次 / 有效基金数 × 100（收益高者名次靠前，收益相同按入库顺序）
+    """
+    valid_cols = ',\n'.join(
+        f"CASE WHEN abs(f.{col}) >= {MIN_VALID_RETURN} THEN f.{col} END AS {col}" for col, _ in RETURN_COLUMNS
+    )
+    # 降序排序时 NULL 排在最后，有效基金的名次即为 1..有效基金数
+    rank_cols = ',\n'.join(
+        f"CASE WHEN {col} IS NOT NULL AND COUNT({col}) OVER w >= 2 "
+        f"THEN round(CAST(ROW_NUMBER() OVER (PARTITION BY fund_type ORDER BY {col} DESC, id) AS REAL) "
+        f"/ COUNT({col}) OVER w * 100, 2) END AS {rank}"
+        for (col, _), rank in zip(RETURN_COLUMNS, RANK_COLUMNS)
+    )
+    long_pct, short_pct = RULE_4433_LONG_PCT, RULE_4433_SHORT_PCT
+    pass_4433 = (
+        f"CASE WHEN rank_pct_1y <= {long_pct} "
+        f"AND (rank_pct_2y IS NULL OR rank_pct_2y <= {long_pct}) "
+        f"AND (rank_pct_3y IS NULL OR rank_pct_3y <= {long_pct}) "
+        f"AND rank_pct_6m <= {short_pct} AND rank_pct_3m <= {short_pct} THEN 1 ELSE 0 END"
+    )
+    columns = ['fund_code'] + RANK_COLUMNS + ['pass_4433', 'updated_time']
+
+    return f"""
+        WITH valid AS (
+            SELECT b.id, f.fund_code, f.fund_type, COUNT(*) OVER (PARTITION BY f.fund_type) AS type_count,
+            {valid_cols}
+            FROM fund_screening_flat f
+            JOIN fund_basic_info b ON b.fund_code = f.fund_code
+            WHERE f.fund_type IS NOT NULL AND f.fund_type <> '' AND b.performance_json IS NOT NULL
+        ),
+        ranked AS (
+            SELECT fund_code, type_count,
+            {rank_cols}
+            FROM valid
+            WINDOW w AS (PARTITION BY fund_type)
+        )
+        INSERT INTO fund_screening_rank ({', '.join(columns)})
+        SELECT fund_code, {', '.join(RANK_COLUMNS)}, {pass_4433}, :now
+        FROM ranked
+        WHERE type_count >= 2
+        ON CONFLICT(fund_code) DO UPDATE SET
+        {', '.join(f'{col} = excluded.{col}' for col in columns[1:])}
+    """
+
+
+def _build_rank_sync_sql() -> str:
+    """排名表写回宽表的排名列，只改写有变化的行（排名列都有索引，避免无谓的索引维护）"""
+    columns = RANK_COLUMNS + ['pass_4433']
+    return f"""
+        UPDATE fund_screening_flat
+        SET {', '.join(f'{col} = k.{col}' for col in columns)}
+        FROM fund_screening_rank k
+        WHERE k.fund_code = fund_screening_flat.fund_code
+        AND ({' OR '.join(f'fund_screening_flat.{col} IS NOT k.{col}' for col in columns)})
+    """
+
+
+# 原始 SQL 文本（migrate_db 等直接使用 sqlite3 的脚本也可复用）
+REFRESH_SQL = _build_upsert_sql('WHERE b.fund_code = :fund_code')
+REBUILD_SQL = _build_upsert_sql()
+RANKING_SQL = _build_ranking_sql()
+RANK_SYNC_SQL = _build_rank_sync_sql()
+_REFRESH_STMT = text(REFRESH_SQL)
+_REBUILD_STMT = text(REBUILD_SQL)
+_RANKING_STMT = text(RANKING_SQL)
+_RANK_SYNC_STMT = text(RANK_SYNC_SQL)
+
+# 增量排名：只写入指定基金的排名与 4433 标记
+_RANK_WRITE_STMT = text(f"""
+    INSERT INTO fund_screening_rank (fund_code, {', '.join(RANK_COLUMNS)}, pass_4433, updated_time)
+    VALUES (:fund_code, {', '.join(f':{col}' for col in RANK_COLUMNS)}, :pass_4433, :now)
+    ON CONFLICT(fund_code) DO UPDATE SET
+        {', '.join(f'{col} = excluded.{col}' for col in RANK_COLUMNS + ['pass_4433', 'updated_time'])}
+""")
+_FLAT_RANK_WRITE_STMT = text(f"""
+    UPDATE fund_screening_flat
+    SET {', '.join(f'{col} = :{col}' for col in RANK_COLUMNS + ['pass_4433'])}
+    WHERE fund_code = :fund_code
+""")
+
+
+_data_version = 0
+_version_lock = threading.Lock()
+# 最近的变更记录: (版本号, 改动的基金代码集合)，None 表示全量变更
+_CHANGE_LOG_SIZE = 1024
+_change_log: 'deque[Tuple[int, Optional[Set[str]]]]' = deque(maxlen=_CHANGE_LOG_SIZE)
+
+
+def get_screening_version() -> int:
+    """获取宽表数据版本号"""
+    return _data_version
+
+
+def _bump_version(fund_codes: Optional[Iterable[str]] = None):
+    """递增数据版本；fund_codes 为空表示全量变更"""
+    global _data_version
+    with _version_lock:
+        _data_version += 1
+        _change_log.append((_data_version, set(fund_codes) if fund_codes is not None else None))
+
+
+# ORM 会话中尚未提交的宽表变更（Session.info 中的键）：[基金代码集合或 None, ...]
+_PENDING_KEY = 'screening_pending_changes'
+
+
+def _mark_changed(db, fund_codes: Optional[Iterable[str]] = None):
+    """
+    记录宽表变更：ORM 会话中的变更在提交成功后才递增数据版本（after_commit），回滚时丢弃；
+    直接传入的 Connection（启动迁移，调用方随即提交）立即递增
+    """
+    if isinstance(db, Session):
+        db.info.setdefault(_PENDING_KEY, []).append(set(fund_codes) if fund_codes is not None else None)
+    else:
+        _bump_version(fund_codes)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_on_commit(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    if any(codes is None for codes in pending):
+        _bump_version()
+    else:
+        _bump_version(set().union(*pending))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def changed_codes_since(version: int) -> Tuple[int, Optional[Set[str]]]:
+    """
+    自 version 之后改动过的基金代码
+    返回 (当前版本, 基金代码集合)；期间有全量变更或记录已被挤出时集合为 None
+    """
+    with _version_lock:
+        current = _data_version
+        if version == current:
+            return current, set()
+        if version > current or not _change_log or _change_log[0][0] > version + 1:
+            return current, None
+        codes = set()
+        for entry_version, entry_codes in _change_log:
+            if entry_version <= version:
+                continue
+            if entry_codes is None:
+                return current, None
+            codes |= entry_codes
+        return current, codes
+
+
+def refresh_screening_fund(db, fund_code: str):
+    """
+    增量刷新单只基金的宽表行（不提交事务，由调用方统一提交）
+    先 flush，保证 ORM 中尚未写入的修改对 SQL 可见
+    """
+    if hasattr(db, 'flush'):
+        db.flush()
+    db.execute(_REFRESH_STMT, {'fund_code': fund_code})
+    _mark_changed(db, [fund_code])
+
+
+def rebuild_screening_table(db) -> int:
+    """全量重建宽表（不提交事务），返回写入的行数"""
+    if hasattr(db, 'flush'):
+        db.flush()
+    db.execute(text("DELETE FROM fund_screening_flat"))
+    db.execute(_REBUILD_STMT)
+    _mark_changed(db)
+    return db.execute(text("SELECT COUNT(*) FROM fund_screening_flat")).scalar()
+
+
+def recalculate_screening_ranks(db) -> Tuple[int, int]:
+    """
+    全量重算同类排名与 4433 标记并写回宽表（不提交事务）
+    宽表的收益率列需为最新（基金数据保存时已增量刷新）
+    返回 (排名记录数, 宽表中排名有变化的基金数)；时间格式与 ORM 写入的 DateTime 一致
+    """
+    if hasattr(db, 'flush'):
+        db.flush()
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    db.execute(_RANKING_STMT, {'now': now})
+    ranked = db.execute(text("SELECT changes()")).scalar()
+    changed = db.execute(_RANK_SYNC_STMT).rowcount
+    if changed:
+        _mark_changed(db)
+    return ranked, changed
+
+
+def write_screening_ranks(db, ranks: Dict[str, dict]) -> int:
+    """
+    写入部分基金的排名与 4433 标记（排名表与宽表同时更新，不提交事务）
+    ranks: {基金代码: {排名列: 百分位, 'pass_4433': 0/1}}
+    """
+    if not ranks:
+        return 0
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+    params = [{'fund_code': code, **values, 'now': now} for code, values in ranks.items()]
+    db.execute(_RANK_WRITE_STMT, params)
+    db.execute(_FLAT_RANK_WRITE_STMT, params)
+    _mark_changed(db, ranks)
+    return len(params)
+
+
+class CountCache:
+    """
+    筛选结果总数缓存
+    键为 (筛选条件哈希, 数据版本)，版本变化后旧条目自然失效；调用方须先取版本再计数：
+    版本在事务提交后才递增，计数时读到的数据不会早于所取的版本；
+    另设过期时间，覆盖 migrate_db 等其他进程直接修改数据库的情况
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: int = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Tuple[str, int], Tuple[int, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filter_hash: str, version: int) -> Optional[int]:
+        with self._lock:
+            key = (filter_hash, version)
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            count, created = item
+            if time.time() - created > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return count
+
+    def put(self, filter_hash: str, version: int, count: int):
+        with self._lock:
+            self._entries[(filter_hash, version)] = (count, time.time())
+            self._entries.move_to_end((filter_hash, version))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class StatsCache:
+    """
+    状态/统计接口的计数缓存（基金数、风险指标数、排名数、各类型数量 ...）
+    - 数据版本不变时直接返回上次的结果
+    - 只有单只基金增量变化时，距上次统计不足 min_interval 秒仍返回上次的结果：
+      批量更新期间每保存一只基金版本就变化一次，前端轮询不会每次都重新扫表、与批量写入争用数据库
+    - 全量变更（排名重算、宽表重建）后下次读取立即重新统计
+    - 超过 ttl 强制重新统计，覆盖其他进程直接修改数据库的情况
+    先取版本再统计（版本在提交后才递增），结果按统计开始时的版本缓存；
+    统计期间版本发生变化时，结果可能混有新旧数据，不参与 min_interval 宽限，下次读取重新统计
+    """
+
+    def __init__(self, min_interval: int = 10, ttl: int = 300):
+        self.min_interval = min_interval
+        self.ttl = ttl
+        # {名称: (统计时的数据版本, 统计时间, 结果)}
+        self._entries: Dict[str, Tuple[int, float, dict]] = {}
+        self._lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+
+    def _fresh(self, name: str) -> Optional[dict]:
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        version, computed_at, value = entry
+        age = time.time() - computed_at
+        if age > self.ttl:
+            return None
+        if version == get_screening_version():
+            return value
+        if age < self.min_interval and changed_codes_since(version)[1] is not None:
+            return value
+        return None
+
+    def get(self, name: str, compute: Callable[[], dict]) -> dict:
+        """返回缓存的统计结果，过期时调用 compute() 重新统计（同一时间只统计一次）"""
+        with self._lock:
+            value = self._fresh(name)
+        if value is not None:
+            return value
+        with self._compute_lock:
+            with self._lock:
+                value = self._fresh(name)
+            if value is not None:
+                return value
+            # 先取版本再统计：统计期间发生的变化会让下次读取重新统计
+            version = get_screening_version()
+            value = compute()
+            computed_at = time.time() if get_screening_version() == version else 0.0
+            with self._lock:
+                self._entries[name] = (version, computed_at, value)
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 单例模式
+_count_cache = None
+
+def get_count_cache() -> CountCache:
+    """获取筛选总数缓存单例"""
+    global _count_cache
+    if _count_cache is None:
+        _count_cache = CountCache()
+    return _count_cache
+
+
+# 单例模式
+_stats_cache = None
+
+def get_stats_cache() -> StatsCache:
+    """获取状态统计缓存单例"""
+    global _stats_cache
+    if _stats_cache is None:
+        _stats_cache = StatsCache()
+    return _stats_cache
@@ -0,0 +1,244 @@
+"""
+上游数据接口访问控制
+所有访问基金数据上游（天天基金 / 东方财富、股票列表接口）的 HTTP 请求都经过 UpstreamClient，按主机分别维护：
+- AIMD 自适应限流（rate_limiter.AdaptiveRateLimiter）：成功时缓慢提速，被限流（429 / 503 / 514）、超时、5xx 时减半
+- 指数退避 + 随机抖动重试（full jitter），响应带 Retry-After 时按其等待
+- 熔断器：连续失败 failure_threshold 次后熔断 open_seconds 秒，期间直接抛出 UpstreamUnavailable，
+  调用方走本地缓存（数据库中已保存的数据）；到期后放行一个探测请求，成功则恢复，失败则熔断时间加倍
+
+各主机状态可通过 /api/upstream/status 查看
+"""
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from rate_limiter import AdaptiveRateLimiter
+
+# 每个主机的初始 / 最小 / 最大请求速率（个/秒）
+UPSTREAM_INITIAL_RATE = float(os.getenv('UPSTREAM_INITIAL_RATE', '5'))
+UPSTREAM_MIN_RATE = float(os.getenv('UPSTREAM_MIN_RATE', '0.5'))
+UPSTREAM_MAX_RATE = float(os.getenv('UPSTREAM_MAX_RATE', '30'))
+
+# 上游限流时常见的状态码（514 为东方财富的 Frequency Capped）
+THROTTLE_STATUS = {429, 503, 514}
+
+# 退避: 第 n 次重试等待 uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2^n)) 秒
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class UpstreamUnavailable(Exception):
+    """上游暂不可用（熔断中或等待限流令牌超时），调用方应直接使用缓存数据"""
+
+    def __init__(self, host: str, reason: str, retry_after: float = 0.0):
+        super().__init__(f'{host} unavailable: {reason}')
+        self.host = host
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """单个主机的熔断器: closed → open → half_open → closed / open"""
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 15.0, max_open_seconds: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.open_seconds = open_seconds
+        self.open_until = 0.0
+        self.opened_count = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行请求；熔断到期后只放行一个探测请求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.time() >= self.open_until:
+                self.state = 'half_open'
+                self._probing = False
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        """探测请求未实际发出（如等待令牌超时），让出探测机会"""
+        with self._lock:
+            self._probing = False
+
+    def retry_after(self) -> float:
+        """距离下次可以探测的秒数"""
+        return max(0.0, self.open_until - time.time())
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.open_seconds = self.base_open_seconds
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open':
+                # 探测失败：重新熔断，时间加倍
+                self.open_seconds = min(self.max_open_seconds, self.open_seconds * 2)
+                self._open()
+            elif self.state == 'closed' and self.failures >= self.failure_threshold:
+                self._open()
+
+    def _open(self):
+        self.state = 'open'
+        self.open_until = time.time() + self.open_seconds
+        self.opened_count += 1
+        self._probing = False
+
+
+class UpstreamHost:
+    """单个上游主机的限流器、熔断器与请求统计"""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.limiter = AdaptiveRateLimiter(UPSTREAM_INITIAL_RATE, UPSTREAM_MIN_RATE,
+                                           max(UPSTREAM_MAX_RATE, UPSTREAM_INITIAL_RATE))
+        self.breaker = CircuitBreaker()
+        self.requests = 0
+        self.successes = 0
+        self.throttled = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self.last_error_time: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def count(self, field: str, error: Optional[str] = None):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+            if error:
+                self.last_error = error
+                self.last_error_time = time.time()
+
+    def to_dict(self) -> dict:
+        breaker = self.breaker
+        return {
+            'host': self.host,
+            'rate': round(self.limiter.rate, 2),
+            'min_rate': self.limiter.min_rate,
+            'max_rate': self.limiter.max_rate,
+            'circuit': breaker.state,
+            'consecutive_failures': breaker.failures,
+            'retry_after': round(breaker.retry_after(), 1) if breaker.state != 'closed' else 0,
+            'opened_count': breaker.opened_count,
+            'requests': self.requests,
+            'successes': self.successes,
+            'throttled': self.throttled,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'last_error': self.last_error,
+            'last_error_time': (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.last_error_time))
+                                if self.last_error_time else None),
+        }
+
+
+class UpstreamClient:
+    """按主机限流、重试、熔断的 HTTP 客户端（各模块共用一个实例）"""
+
+    def __init__(self):
+        self._hosts: Dict[str, UpstreamHost] = {}
+        self._lock = threading.Lock()
+
+    def host(self, url: str) -> UpstreamHost:
+        name = urlsplit(url).netloc
+        with self._lock:
+            if name not in self._hosts:
+                self._hosts[name] = UpstreamHost(name)
+            return self._hosts[name]
+
+    def request(self, method: str, url: str, session=None, retries: int = 2,
+                acquire_timeout: Optional[float] = 10.0, **kwargs) -> requests.Response:
+        """
+        发送请求，网络错误 / 超时 / 限流 / 5xx 时退避重试 retries 次
+        返回最后一次响应（其他状态码如 404 直接返回，由调用方判断）；
+        全部重试都是网络错误时抛出最后一个异常；熔断中或等待令牌超过 acquire_timeout 秒时抛出 UpstreamUnavailable
+        """
+        host = self.host(url)
+        http = session or requests
+        response, error = None, None
+        for attempt in range(retries + 1):
+            if attempt:
+                host.count('retries')
+                time.sleep(_backoff(attempt - 1, response))
+            if not host.breaker.allow():
+                host.count('rejected')
+                raise UpstreamUnavailable(host.host, 'circuit_open', host.breaker.retry_after())
+            if not host.limiter.acquire(timeout=acquire_timeout):
+                host.breaker.release_probe()
+                host.count('rejected')
+                raise UpstreamUnavailable(host.host, 'rate_limited')
+            host.count('requests')
+            try:
+                response, error = http.request(method, url, **kwargs), None
+            except requests.RequestException as e:
+                response, error = None, e
+                host.count('errors', f'{type(e).__name__}: {e}'[:200])
+                host.limiter.on_throttle()
+                host.breaker.record_failure()
+                continue
+
+            if response.status_code in THROTTLE_STATUS or response.status_code >= 500:
+                host.count('throttled' if response.status_code in THROTTLE_STATUS else 'errors',
+                           f'HTTP {response.status_code}')
+                host.limiter.on_throttle()
+                host.breaker.record_failure()
+                continue
+
+            host.count('successes')
+            host.limiter.on_success()
+            host.breaker.record_success()
+            return response
+
+        if response is not None:
+            return response
+        raise error
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def status(self) -> List[dict]:
+        with self._lock:
+            hosts = list(self._hosts.values())
+        return [host.to_dict() for host in hosts]
+
+
+def _backoff(attempt: int, response: Optional[requests.Response]) -> float:
+    """第 attempt 次重试前的等待秒数（指数退避 + full jitter，优先使用 Retry-After）"""
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_CAP)
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+# 单例模式
+_upstream_client = None
+
+def get_upstream_client() -> UpstreamClient:
+    """获取上游请求客户端单例"""
+    global _upstream_client
+    if _upstream_client is None:
+        _upstream_client = UpstreamClient()
+    return _upstream_client
@@ -46,6 +46,21 @@ export const fundAPI = {
     return api.get(`/fund/${fundCode}/compare-data${params}`)
   },
   
+  // 获取滚动窗口指标序列（metrics: 'return,vol,sharpe,drawdown' 的子集）
+  getRollingMetrics(fundCode, window = 252, metrics = 'sharpe,vol,drawdown') {
+    return api.get(`/fund/${fundCode}/rolling-metrics?window=${window}&metrics=${metrics}`)
+  },
+  
+  // 获取走势最相似的基金（近一年日收益率相关性）
+  getSimilarFunds(fundCode, k = 20) {
+    return api.get(`/fund/${fundCode}/similar?k=${k}`)
+  },
+  
+  // 获取风险指标的同类百分位（metrics 为空时返回全部风险指标）
+  getRiskPercentiles(fundCode, metrics = '') {
+    return api.get(`/fund/${fundCode}/percentiles${metrics ? `?metrics=${metrics}` : ''}`)
+  },
+  
   // 获取每日市场行情
   getDailyMarket(forceRefresh = false) {
     const params = forceRefresh ? '?refresh=true' : ''
@@ -165,6 +180,18 @@ export const screeningAPI = {
     return api.post('/screening/query', params)
   },
   
+  // 导出全部筛选结果的下载链接（csv / ndjson / parquet），由浏览器直接流式下载
+  getExportUrl(params, format = 'csv') {
+    const query = new URLSearchParams({
+      format,
+      filters: JSON.stringify(params.filters || {}),
+      strategy: params.strategy || '',
+      sort_by: params.sort_by || '',
+      sort_order: params.sort_order || ''
+    })
+    return `${API_BASE_URL}/screening/export?${query.toString()}`
+  },
+  
   // 获取预设策略列表
   getStrategies() {
     return api.get('/screening/strategies')
@@ -191,6 +218,14 @@ export const screeningAPI = {
   }
 }
 
+// ==================== 组合分析 API ====================
+export const analyticsAPI = {
+  // 多只基金日收益率相关性矩阵（含层次聚类顺序）
+  getCorrelation(fundCodes, days = 365) {
+    return api.get(`/analytics/correlation?codes=${fundCodes.join(',')}&days=${days}`)
+  }
+}
+
 // ==================== 基金回测 API ====================
 export const backtestAPI = {
   // 定投回测